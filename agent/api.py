@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, Body, File, UploadFile, Form, Query # type: ignore
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, Body, File, UploadFile, Form, Query # type: ignore
 from fastapi.responses import StreamingResponse # type: ignore
 import asyncio
 import json
 import traceback
 import base64
+import hashlib
+import heapq
 from datetime import datetime, timezone
 import uuid
 from typing import Optional, List, Dict, Any
@@ -13,14 +15,17 @@ import tempfile
 import os
 
 # from agentpress.thread_manager import ThreadManager
-from services.postgresql import DBConnection
+from services.postgresql import DBConnection, mark_read_your_writes
 from services import redis
 from utils.simple_auth_middleware import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access
 from utils.logger import logger, structlog
 # from services.billing import check_billing_status, can_use_model
 from utils.config import config
 from sandbox.sandbox import create_sandbox, delete_sandbox, get_or_start_sandbox
-from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status
+from run_agent_background import (
+    run_agent_background, _cleanup_redis_response_list, update_agent_run_status,
+    get_response_stream_key, use_response_stream, push_control_signal, mark_run_stop_requested
+)
 
 def determine_sandbox_type(files):
     """
@@ -287,15 +292,16 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     client = await db.client
     final_status = "failed" if error_message else "stopped"
 
-    # 添加：尝试从Redis获取最终响应
+    # 添加：尝试从Redis获取最终响应（stream 模式下消费者按 ID 自行读取，无需整表拉取）
     response_list_key = f"agent_run:{agent_run_id}:responses"
     all_responses = []
-    try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
-    except Exception as e:
-        logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
+    if not use_response_stream():
+        try:
+            all_responses_json = await redis.lrange(response_list_key, 0, -1)
+            all_responses = [json.loads(r) for r in all_responses_json]
+            logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
+        except Exception as e:
+            logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
       
     # 更新数据库状态
     update_success = await update_agent_run_status(
@@ -309,7 +315,12 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     # 发送STOP信号到全局控制频道
     global_control_channel = f"agent_run:{agent_run_id}:control"
     try:
+        # 先写停止标记再发布：尚未完成订阅的运行在注册时也能看到这次停止请求
+        await mark_run_stop_requested(agent_run_id)
         await redis.publish(global_control_channel, "STOP")
+        if use_response_stream():
+            # stream 模式下的 SSE 消费者不订阅控制频道，通过响应流中的控制条目结束
+            await push_control_signal(agent_run_id, "STOP")
         logger.debug(f"Published STOP signal to global channel {global_control_channel}")
     except Exception as e:
         logger.error(f"Failed to publish STOP signal to global channel {global_control_channel}: {str(e)}")
@@ -857,6 +868,7 @@ async def get_thread_agent(thread_id: str, user_id: str = Depends(get_current_us
 async def stream_agent_run(
     agent_run_id: str,
     token: Optional[str] = None,
+    last_event_id: Optional[str] = None,
     request: Request = None
 ):
     
@@ -895,6 +907,66 @@ async def stream_agent_run(
     response_list_key = f"agent_run:{agent_run_id}:responses"  # Redis List 键名，存储 agent_run 的所有响应数据
     response_channel = f"agent_run:{agent_run_id}:new_response" # Redis Pub/Sub 频道名，用于通知新响应到达
     control_channel = f"agent_run:{agent_run_id}:control" # edis Pub/Sub 频道名，用于控制信号，比如发送停止、暂停、错误、管理流式输出的生命周期
+    response_stream_key = get_response_stream_key(agent_run_id)  # Redis Stream 键名，stream 模式下响应和控制信号都在这里
+
+    # 断点续传：优先使用查询参数，其次是浏览器 EventSource 重连时自动携带的 Last-Event-ID 请求头
+    resume_from_id = last_event_id or (request.headers.get("last-event-id") if request else None) or "0-0"
+
+    async def stream_generator_from_redis_stream(agent_run_data):
+        """Stream mode: XREAD BLOCK from the last seen entry ID, one Redis round trip per batch.
+
+        每条 SSE 消息都带上 `id:` 字段（即 Stream entry ID），客户端重连时从该 ID 之后精确续传。
+        """
+        last_id = resume_from_id
+        is_running = (agent_run_data.get('status') if agent_run_data else None) == 'running'
+
+        try:
+            if is_running:
+                structlog.contextvars.bind_contextvars(
+                    thread_id=agent_run_data.get('thread_id'),
+                )
+
+            while True:
+                # 运行中的任务阻塞等待新条目；已结束的任务只做一次非阻塞追读
+                entries = await redis.xread(
+                    {response_stream_key: last_id},
+                    count=500,
+                    block=5000 if is_running else None
+                )
+
+                if not entries:
+                    if not is_running:
+                        logger.info(f"Agent run {agent_run_id} is not running (status: {agent_run_data.get('status')}). Ending stream.")
+                        yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
+                        return
+                    continue
+
+                for _, stream_entries in entries:
+                    for entry_id, fields in stream_entries:
+                        last_id = entry_id
+
+                        # 控制条目：STOP / END_STREAM / ERROR
+                        control_signal = fields.get("control")
+                        if control_signal:
+                            yield f"id: {entry_id}\ndata: {json.dumps({'type': 'status', 'status': control_signal})}\n\n"
+                            return
+
+                        response_json = fields.get("data")
+                        if response_json is None:
+                            continue
+                        yield f"id: {entry_id}\ndata: {response_json}\n\n"
+
+                        response = json.loads(response_json)
+                        if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
+                            logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
+                            return
+
+        except asyncio.CancelledError:
+            logger.info(f"Stream generator cancelled for {agent_run_id} at entry {last_id}")
+        except Exception as e:
+            logger.error(f"Error in stream generator for agent run {agent_run_id}: {e}", exc_info=True)
+            error_message = {'type': 'status', 'status': 'error', 'message': f'Stream failed: {e}'}
+            yield f"data: {json.dumps(error_message)}\n\n"
 
     async def stream_generator(agent_run_data):
         # 定义流式生成器元数据
@@ -1119,8 +1191,10 @@ async def stream_agent_run(
             await asyncio.sleep(0.1)
             logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
 
+    generator = stream_generator_from_redis_stream(agent_run_data) if use_response_stream() else stream_generator(agent_run_data)
+
     return StreamingResponse(
-        stream_generator(agent_run_data), 
+        generator, 
         media_type="text/event-stream", 
         headers={
         "Cache-Control": "no-cache, no-transform", "Connection": "keep-alive",
@@ -1417,6 +1491,7 @@ async def initiate_agent_with_files(
                 logger.error(f"Failed to create sandbox: {str(e)}")
                 logger.info("Cleaning up created project...")
                 await client.table('projects').eq('project_id', project_id).delete()
+                await _invalidate_thread_count(user_id)
                 if sandbox_id:
                     try: 
                         # TODO
@@ -1471,6 +1546,7 @@ async def initiate_agent_with_files(
         if not thread.data:
             logger.error(f"Failed to create thread")
             raise Exception("Failed to create thread")
+        await _invalidate_thread_count(user_id)
             
 
         # 在创建新的Agent会话时异步触发，通过大模型生成更贴合主题的会话名称 
@@ -1712,25 +1788,34 @@ async def get_agents(
         # 过滤条件：是否为默认 Agent，只有明确传入 True/False 时才应用此过滤
         if has_default is not None:
             query = query.eq("is_default", has_default)
-        
-                
-        # 支持按 name、updated_at、created_at 排序
+
+        # 工具相关的筛选和排序使用 VersionService 随当前版本维护的工具摘要列，
+        # 在同一条查询里完成过滤、计数和分页，总数和页码与筛选结果一致
+        if has_mcp_tools is not None:
+            query = query.eq("has_mcp_tools", has_mcp_tools)
+        if has_agentpress_tools is not None:
+            query = query.eq("has_agentpress_tools", has_agentpress_tools)
+        tools_filter = [tool.strip() for tool in tools.split(',') if tool.strip()] if tools else []
+        if tools_filter:
+            # 命中任意一个请求的工具即可（tool_names && $n，走 GIN 索引）
+            query = query.overlaps("tool_names", tools_filter)
+
+        # 支持按 name、updated_at、created_at、tools_count 排序
         # 支持升序(asc)和降序(desc)
         # 默认按创建时间降序排列（最新的在前）
-        if sort_by == "name":
-            query = query.order("name", desc=(sort_order == "desc"))
-        elif sort_by == "updated_at":
-            query = query.order("updated_at", desc=(sort_order == "desc"))
-        elif sort_by == "created_at":
-            query = query.order("created_at", desc=(sort_order == "desc"))
+        desc = sort_order == "desc"
+        if sort_by in ("name", "updated_at", "tools_count"):
+            query = query.order(sort_by, desc=desc)
         else:
-            # 默认按创建时间排序
-            query = query.order("created_at", desc=(sort_order == "desc"))
+            query = query.order("created_at", desc=desc)
+        # 排序值相同时按 agent_id 排，保证翻页时顺序稳定
+        query = query.order("agent_id", desc=desc)
 
         # 获取分页数据和总数量
         query = query.range(offset, offset + limit - 1)
         agents_result = await query.execute()
         total_count = agents_result.count if agents_result.count is not None else 0
+        total_pages = (total_count + limit - 1) // limit
 
         if not agents_result.data:
             logger.info(f"No agents found for user: {user_id}")
@@ -1739,19 +1824,16 @@ async def get_agents(
                 "pagination": {
                     "page": page,
                     "limit": limit,
-                    "total": 0,
-                    "pages": 0
+                    "total": total_count,
+                    "pages": total_pages
                 }
             }
         
-        # 后处理：工具过滤和tools_count排序
         agents_data = agents_result.data
         
-        # 首先，批量获取所有Agent的版本数据，确保我们拥有正确的工具信息
-        # 这样做比逐个Agent调用服务更高效
+        # 批量获取当前页所有Agent的版本数据，用于返回工具配置和 current_version
         agent_version_map = {}
         version_ids = list({agent['current_version_id'] for agent in agents_data if agent.get('current_version_id')})
-        logger.info(f"version_ids: {version_ids}")
         if version_ids:
             try:
                 versions_result = await client.table('agent_versions').select(
@@ -1760,117 +1842,27 @@ async def get_agents(
 
                 for row in (versions_result.data or []):
                     config = row.get('config') or {}
-                    tools = config.get('tools') or {}
-                version_dict = {
+                    if isinstance(config, str):
+                        config = json.loads(config)
+                    tools_config = config.get('tools') or {}
+                    agent_version_map[row['agent_id']] = {
                         'version_id': row['version_id'],
                         'agent_id': row['agent_id'],
                         'version_number': row['version_number'],
                         'version_name': row['version_name'],
                         'system_prompt': config.get('system_prompt', ''),
-                        'configured_mcps': tools.get('mcp', []),
-                        'custom_mcps': tools.get('custom_mcp', []),
-                        'agentpress_tools': tools.get('agentpress', {}),
+                        'model': config.get('model'),
+                        'configured_mcps': tools_config.get('mcp', []),
+                        'custom_mcps': tools_config.get('custom_mcp', []),
+                        'agentpress_tools': tools_config.get('agentpress', {}),
                         'is_active': row.get('is_active', False),
                         'created_at': row.get('created_at'),
                         'updated_at': row.get('updated_at') or row.get('created_at'),
                         'created_by': row.get('created_by'),
-                }
-                agent_version_map[row['agent_id']] = version_dict
+                    }
             except Exception as e:
                 logger.warning(f"Failed to batch load versions for agents: {e}")
         
-        # 应用工具过滤条件使用版本数据
-        if has_mcp_tools is not None or has_agentpress_tools is not None or tools:
-            filtered_agents = []
-            tools_filter = []
-            if tools:
-                # 处理tools参数可能作为dict而不是字符串传递的情况
-                if isinstance(tools, str):
-                    tools_filter = [tool.strip() for tool in tools.split(',') if tool.strip()]
-                elif isinstance(tools, dict):
-                    # 如果tools是dict，记录问题并跳过过滤
-                    logger.warning(f"Received tools parameter as dict instead of string: {tools}")
-                    tools_filter = []
-                elif isinstance(tools, list):
-                    # 如果tools是list，直接使用
-                    tools_filter = [str(tool).strip() for tool in tools if str(tool).strip()]
-                else:
-                    logger.warning(f"Unexpected tools parameter type: {type(tools)}, value: {tools}")
-                    tools_filter = []
-            
-            for agent in agents_data:
-                # Get version data if available and extract configuration
-                version_data = agent_version_map.get(agent['agent_id'])
-                from agent.config_helper import extract_agent_config
-                agent_config = extract_agent_config(agent, version_data)
-                
-                configured_mcps = agent_config['configured_mcps']
-                agentpress_tools = agent_config['agentpress_tools']
-                
-                # Check MCP tools filter
-                if has_mcp_tools is not None:
-                    has_mcp = bool(configured_mcps and len(configured_mcps) > 0)
-                    if has_mcp_tools != has_mcp:
-                        continue
-                
-                # Check AgentPress tools filter
-                if has_agentpress_tools is not None:
-                    has_enabled_tools = any(
-                        tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
-                        for tool_data in agentpress_tools.values()
-                    )
-                    if has_agentpress_tools != has_enabled_tools:
-                        continue
-                
-                # Check specific tools filter
-                if tools_filter:
-                    agent_tools = set()
-                    # Add MCP tools
-                    for mcp in configured_mcps:
-                        if isinstance(mcp, dict) and 'name' in mcp:
-                            agent_tools.add(f"mcp:{mcp['name']}")
-                    
-                    # Add enabled AgentPress tools
-                    for tool_name, tool_data in agentpress_tools.items():
-                        if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False):
-                            agent_tools.add(f"agentpress:{tool_name}")
-                    
-                    # Check if any of the requested tools are present
-                    if not any(tool in agent_tools for tool in tools_filter):
-                        continue
-                
-                filtered_agents.append(agent)
-            
-            agents_data = filtered_agents
-        
-        # 处理tools_count排序 (后处理 required)
-        if sort_by == "tools_count":
-            def get_tools_count(agent):
-                # 获取版本数据如果available
-                version_data = agent_version_map.get(agent['agent_id'])
-                
-                # 使用版本数据用于工具如果available, 否则回退到Agent数据
-                if version_data:
-                    configured_mcps = version_data.get('configured_mcps', [])
-                    agentpress_tools = version_data.get('agentpress_tools', {})
-                else:
-                    configured_mcps = agent.get('configured_mcps', [])
-                    agentpress_tools = agent.get('agentpress_tools', {})
-                
-                mcp_count = len(configured_mcps)
-                agentpress_count = sum(
-                    1 for tool_data in agentpress_tools.values()
-                    if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
-                )
-                return mcp_count + agentpress_count
-            
-            agents_data.sort(key=get_tools_count, reverse=(sort_order == "desc"))
-        
-        # 应用分页到过滤结果如果我们做了后处理
-        if has_mcp_tools is not None or has_agentpress_tools is not None or tools or sort_by == "tools_count":
-            total_count = len(agents_data)
-            agents_data = agents_data[offset:offset + limit]
-        
         # 格式化响应
         agent_list = []
         for agent in agents_data:
@@ -1929,8 +1921,6 @@ async def get_agents(
                 metadata=json.loads(agent.get('metadata', '{}')) if isinstance(agent.get('metadata'), str) else (agent.get('metadata') or {})
             ))
         
-        total_pages = (total_count + limit - 1) // limit
-        
         logger.info(f"Found {len(agent_list)} agents for user: {user_id} (page {page}/{total_pages})")
         return {
             "agents": agent_list,
@@ -2428,6 +2418,8 @@ async def update_agent(
     #         status_code=403, 
     #         detail="Custom agent currently disabled. This feature is not available at the moment."
     #     )
+    from .versioning.version_service import summarize_tools
+    
     logger.info(f"Updating agent {agent_id} for user: {user_id}")
     client = await db.client
     
@@ -2539,7 +2531,8 @@ async def update_agent(
                     
                     await client.table('agents').update({
                         'current_version_id': version_id,
-                        'version_count': 1
+                        'version_count': 1,
+                        **summarize_tools(initial_version_data["configured_mcps"], initial_version_data["agentpress_tools"])
                     }).eq('agent_id', agent_id).execute()
                     current_version_data = initial_version_data
                     logger.info(f"Created initial version for agent {agent_id}")
@@ -2643,6 +2636,7 @@ async def update_agent(
                 new_version_id = new_version.version_id
                 update_data['current_version_id'] = new_version_id
                 update_data['version_count'] = new_version.version_number
+                update_data.update(summarize_tools(current_configured_mcps, current_agentpress_tools))
                 
                 logger.info(f"Created new version {new_version.version_name} for agent {agent_id}")
                 
@@ -3324,105 +3318,145 @@ async def get_agent_tools(
     return {"agentpress_tools": agentpress_tools, "mcp_tools": mcp_tools}
 
 
+# 线程总数只用于侧边栏分页展示，允许短时间不精确；新建线程时删除缓存
+THREAD_COUNT_CACHE_TTL = 60
+
+_THREAD_LIST_COLUMNS = """
+    t.thread_id, t.account_id, t.project_id, t.metadata, t.created_at, t.updated_at,
+    p.project_id AS project_project_id, p.name AS project_name, p.description AS project_description,
+    p.account_id AS project_account_id, p.sandbox AS project_sandbox,
+    p.created_at AS project_created_at, p.updated_at AS project_updated_at
+"""
+
+
+def _encode_cursor(created_at, key: str) -> str:
+    """Opaque keyset cursor for a (created_at, id) position"""
+    payload = [created_at.isoformat() if isinstance(created_at, datetime) else created_at, key]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor: str):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_created_at, cursor_key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(cursor_created_at), str(cursor_key)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _invalidate_thread_count(account_id: str):
+    try:
+        await redis.delete(f"thread_count:{account_id}")
+    except Exception as e:
+        logger.warning(f"Failed to invalidate thread count for {account_id}: {e}")
+
+
+async def _get_thread_count(client, account_id: str) -> int:
+    cache_key = f"thread_count:{account_id}"
+    try:
+        cached = await redis.get(cache_key)
+        if cached is not None:
+            return int(cached)
+    except Exception as e:
+        logger.warning(f"Failed to read cached thread count for {account_id}: {e}")
+
+    rows = await client.fetch('threads', "SELECT COUNT(*) AS count FROM threads WHERE account_id = $1", account_id)
+    total = int(rows[0]['count']) if rows else 0
+    try:
+        await redis.set(cache_key, str(total), ex=THREAD_COUNT_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to cache thread count for {account_id}: {e}")
+    return total
+
+
+def _map_thread_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    project_data = None
+    if row.get('project_project_id'):
+        project_data = {
+            "project_id": row['project_project_id'],
+            "name": row.get('project_name') or '',
+            "description": row.get('project_description') or '',
+            "account_id": row['project_account_id'],
+            "sandbox": row.get('project_sandbox') or {},
+            "is_public": False,
+            "created_at": row['project_created_at'],
+            "updated_at": row['project_updated_at']
+        }
+
+    return {
+        "thread_id": row['thread_id'],
+        "account_id": row['account_id'],
+        "project_id": row.get('project_id'),
+        "metadata": row.get('metadata') or {},
+        "is_public": False,
+        "created_at": row['created_at'],
+        "updated_at": row['updated_at'],
+        "project": project_data  # 关联的项目数据
+    }
+
+
 @router.get("/threads")
 async def get_user_threads(
     user_id: str = Depends(get_current_user_id_from_jwt),
-    page: Optional[int] = Query(1, ge=1, description="Page number (1-based)"),
-    limit: Optional[int] = Query(1000, ge=1, le=1000, description="Number of items per page (max 1000)")
+    page: Optional[int] = Query(1, ge=1, description="Page number (1-based); ignored when cursor is given"),
+    limit: Optional[int] = Query(1000, ge=1, le=1000, description="Number of items per page (max 1000)"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from pagination.next_cursor of the previous page")
 ):
-    """获取当前用户的所有对话线程，包含关联的项目数据"""
-    logger.info(f"Fetching threads with project data for user: {user_id} (page={page}, limit={limit})")
+    """获取当前用户的对话线程（按创建时间倒序），包含关联的项目数据
+
+    分页在数据库中完成：传入 cursor 时按 (created_at, thread_id) 做 keyset 分页，
+    直接命中 (account_id, created_at, thread_id) 索引；只传 page 时退回 LIMIT/OFFSET。
+    线程和项目通过一次 LEFT JOIN 查询取回，总数来自短时缓存的 COUNT。
+    """
+    logger.info(f"Fetching threads with project data for user: {user_id} (page={page}, limit={limit}, cursor={bool(cursor)})")
+    keyset = _decode_cursor(cursor) if cursor else None
     client = await db.client
     try:
-        # 计算分页偏移量
-        offset = (page - 1) * limit
-        
-        # 步骤1: 从threads表中获取指定用户的所有对话线程，按创建时间倒序排列
-        threads_result = await client.table('threads').select('*').eq('account_id', user_id).order('created_at', desc=True).execute()
-        
-        # 如果没有找到任何线程，返回空结果
-        if not threads_result.data:
-            logger.info(f"No threads found for user: {user_id}")
-            return {
-                "threads": [],
-                "pagination": {
-                    "page": page,
-                    "limit": limit,
-                    "total": 0,
-                    "pages": 0
-                }
-            }
-        
-        # 获取总线程数量
-        total_count = len(threads_result.data)
-        
-        # 步骤2: 对线程数据进行分页处理
-        paginated_threads = threads_result.data[offset:offset + limit]
-        
-        # 步骤3: 提取所有线程中关联的项目ID，并去重
-        project_ids = [
-            thread['project_id'] for thread in paginated_threads 
-            if thread.get('project_id')
-        ]
-        unique_project_ids = list(set(project_ids)) if project_ids else []
-        
-        # 步骤4: 如果有项目ID，则批量获取项目数据
-        projects_by_id = {}
-        if unique_project_ids:
-            projects_result = await client.table('projects').select('*').in_('project_id', unique_project_ids).execute()
-            
-            if projects_result.data:
-                logger.info(f"[API] Raw projects from DB: {len(projects_result.data)}")
-                # 创建项目ID到项目数据的映射表，便于快速查找
-                projects_by_id = {
-                    project['project_id']: project 
-                    for project in projects_result.data
-                }
-        
-        # 步骤5: 将线程数据与项目数据进行关联映射
-        mapped_threads = []
-        for thread in paginated_threads:
-            project_data = None
-            # 如果线程有关联的项目，则获取项目数据
-            if thread.get('project_id') and thread['project_id'] in projects_by_id:
-                project = projects_by_id[thread['project_id']]
-                project_data = {
-                    "project_id": project['project_id'],
-                    "name": project.get('name', ''),
-                    "description": project.get('description', ''),
-                    "account_id": project['account_id'],
-                    "sandbox": project.get('sandbox', {}),
-                    "is_public": project.get('is_public', False),
-                    "created_at": project['created_at'],
-                    "updated_at": project['updated_at']
-                }
-            
-            # 构建线程数据结构，包含关联的项目信息
-            mapped_thread = {
-                "thread_id": thread['thread_id'],
-                "account_id": thread['account_id'],
-                "project_id": thread.get('project_id'),
-                "metadata": thread.get('metadata', {}),
-                "is_public": thread.get('is_public', False),
-                "created_at": thread['created_at'],
-                "updated_at": thread['updated_at'],
-                "project": project_data  # 关联的项目数据
-            }
-            mapped_threads.append(mapped_thread)
-        
-        # 步骤6: 计算总页数
+        # 多取一行用来判断是否还有下一页
+        if keyset:
+            created_at, thread_id = keyset
+            rows = await client.fetch('threads', f"""
+                SELECT {_THREAD_LIST_COLUMNS}
+                FROM threads t
+                LEFT JOIN projects p ON p.project_id = t.project_id
+                WHERE t.account_id = $1 AND (t.created_at, t.thread_id) < ($2, $3)
+                ORDER BY t.created_at DESC, t.thread_id DESC
+                LIMIT $4
+            """, user_id, created_at, thread_id, limit + 1)
+        else:
+            offset = (page - 1) * limit
+            rows = await client.fetch('threads', f"""
+                SELECT {_THREAD_LIST_COLUMNS}
+                FROM threads t
+                LEFT JOIN projects p ON p.project_id = t.project_id
+                WHERE t.account_id = $1
+                ORDER BY t.created_at DESC, t.thread_id DESC
+                LIMIT $2 OFFSET $3
+            """, user_id, limit + 1, offset)
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        mapped_threads = [_map_thread_row(row) for row in rows]
+        next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['thread_id']) if has_more else None
+
+        # 第一页就取完时总数就是本页行数，不必再 COUNT
+        if not cursor and page == 1 and not has_more:
+            total_count = len(rows)
+        else:
+            total_count = await _get_thread_count(client, user_id)
         total_pages = (total_count + limit - 1) // limit if total_count else 0
-        
-        logger.info(f"[API] Mapped threads for frontend: {len(mapped_threads)} threads, {len(projects_by_id)} unique projects")
-        
-        # 步骤7: 返回结果，包含线程列表和分页信息
+
+        logger.info(f"[API] Mapped threads for frontend: {len(mapped_threads)} threads (has_more={has_more})")
+
         return {
             "threads": mapped_threads,
             "pagination": {
                 "page": page,
                 "limit": limit,
                 "total": total_count,
-                "pages": total_pages
+                "pages": total_pages,
+                "next_cursor": next_cursor,
+                "has_more": has_more
             }
         }
         
@@ -3700,6 +3734,8 @@ async def create_thread(
         except Exception as e:
             logger.error(f"Error creating sandbox: {str(e)}")
             await client.table('projects').delete().eq('project_id', project_id).execute()
+            # 删除项目会级联删除其线程
+            await _invalidate_thread_count(account_id)
             if sandbox_id:
                 try: 
                     await delete_sandbox(sandbox_id)
@@ -3743,6 +3779,7 @@ async def create_thread(
         
         thread = await client.schema('public').table('threads').insert(thread_data)
         thread_id = thread.data[0]['thread_id']
+        await _invalidate_thread_count(account_id)
         logger.info(f"Created new thread: {thread_id}")
 
         logger.info(f"Successfully created thread {thread_id} with project {project_id}")
@@ -3754,80 +3791,206 @@ async def create_thread(
         raise HTTPException(status_code=500, detail=f"Failed to create thread: {str(e)}")
 
 
+# messages 表和 events 表中的用户消息合并成一个按 (created_at, id) 排序的视图；
+# 每个分支都投影出相同的列，events.actions 等大字段不再读取
+_THREAD_MESSAGES_BRANCHES = (
+    """
+    SELECT 'message' AS source, m.message_id::text AS id, m.thread_id::text AS thread_id, m.type, m.role,
+           m.is_llm_message, m.content, m.metadata, m.created_at, m.updated_at,
+           m.agent_id::text AS agent_id, m.agent_version_id::text AS agent_version_id
+    FROM messages m
+    WHERE m.thread_id = $1::text::uuid {conditions}
+    """,
+    """
+    SELECT 'event' AS source, e.id, e.session_id AS thread_id, 'user' AS type, 'user' AS role,
+           false AS is_llm_message, e.content, NULL::jsonb AS metadata, e.timestamp AS created_at, e.timestamp AS updated_at,
+           NULL::text AS agent_id, NULL::text AS agent_version_id
+    FROM events e
+    WHERE e.session_id = $1::text AND e.author = 'user' {conditions}
+    """,
+)
+
+
+def _build_thread_messages_query(descending: bool, since, before, limit: Optional[int]):
+    """Build the merged, keyset-paginated messages query and its parameters (after $1 = thread_id)"""
+    params: List[Any] = []
+    branch_conditions = {'m': [], 'e': []}
+
+    def add_bound(bound, operator: str, range_operator: str):
+        created_at, key = bound
+        params.extend([created_at, key])
+        # $1 是 thread_id，params 从 $2 开始编号
+        ts_param, key_param = f"${len(params)}", f"${len(params) + 1}"
+        for alias, (ts_column, key_column) in (('m', ('m.created_at', 'm.message_id::text')), ('e', ('e.timestamp', 'e.id'))):
+            # 单列范围条件让 (thread_id, created_at) 索引先定位，行比较再处理同一时间戳内的顺序
+            branch_conditions[alias].append(f"{ts_column} {range_operator} {ts_param}")
+            branch_conditions[alias].append(f"({ts_column}, {key_column}) {operator} ({ts_param}, {key_param})")
+
+    if since:
+        add_bound(since, '>', '>=')
+    if before:
+        add_bound(before, '<', '<=')
+
+    direction = "DESC" if descending else "ASC"
+    branches = []
+    for alias, template in zip(('m', 'e'), _THREAD_MESSAGES_BRANCHES):
+        conditions = ''.join(f" AND {condition}" for condition in branch_conditions[alias])
+        branches.append(template.format(conditions=conditions))
+
+    if limit:
+        # 多取一行判断是否还有更多；每个分支先各自排序截断，合并时只需归并少量行
+        params.append(limit + 1)
+        limit_clause = f"LIMIT ${len(params) + 1}"
+        branches = [f"({branch} ORDER BY created_at {direction}, id {direction} {limit_clause})" for branch in branches]
+    else:
+        limit_clause = ""
+
+    query = f"""
+        SELECT * FROM ({' UNION ALL '.join(branches)}) merged
+        ORDER BY created_at {direction}, id {direction}
+        {limit_clause}
+    """
+    return query, params
+
+
+async def _thread_messages_etag(client, thread_id: str, variant: str) -> str:
+    """Weak ETag from the message counts and latest timestamps; changes on insert, delete and in-place update
+
+    messages.updated_at 由 update_messages_updated_at 触发器在每次 UPDATE 时刷新（内容修改、is_llm_message 切换等）。
+    """
+    rows = await client.fetch('messages', """
+        SELECT m.message_count, m.message_latest, m.message_updated, e.event_count, e.event_latest
+        FROM (
+            SELECT count(*) AS message_count, max(created_at) AS message_latest, max(updated_at) AS message_updated
+            FROM messages WHERE thread_id = $1::text::uuid
+        ) m, (
+            SELECT count(*) AS event_count, max(timestamp) AS event_latest
+            FROM events WHERE session_id = $1::text AND author = 'user'
+        ) e
+    """, thread_id)
+    state = rows[0] if rows else {}
+    digest = hashlib.sha1(
+        f"{thread_id}|{variant}|{state.get('message_count')}|{state.get('message_latest')}|"
+        f"{state.get('message_updated')}|{state.get('event_count')}|{state.get('event_latest')}".encode('utf-8')
+    ).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+async def _load_assistants_for_tool_calls(client, thread_id: str, message_rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Assistant messages outside the page that own the tool calls of the page's tool messages"""
+    page_tool_call_ids = set()
+    for row in message_rows:
+        if row.get('type') != 'assistant':
+            continue
+        content = row.get('content')
+        if isinstance(content, str):
+            try:
+                content = json.loads(content)
+            except ValueError:
+                continue
+        if isinstance(content, dict):
+            page_tool_call_ids.update(tc.get('id') for tc in content.get('tool_calls') or [] if isinstance(tc, dict))
+
+    missing = set()
+    for row in message_rows:
+        if row.get('type') != 'tool':
+            continue
+        metadata = row.get('metadata')
+        if isinstance(metadata, str):
+            try:
+                metadata = json.loads(metadata)
+            except ValueError:
+                continue
+        tool_call_id = metadata.get('tool_call_id') if isinstance(metadata, dict) else None
+        if tool_call_id and tool_call_id not in page_tool_call_ids:
+            missing.add(tool_call_id)
+
+    if not missing:
+        return []
+
+    rows = await client.fetch('messages', """
+        SELECT message_id::text AS message_id, thread_id::text AS thread_id, type, role, is_llm_message,
+               content, metadata, created_at, updated_at, agent_id::text AS agent_id, agent_version_id::text AS agent_version_id
+        FROM messages
+        WHERE thread_id = $1::text::uuid AND type = 'assistant' AND content->'tool_calls' @> ANY($2::jsonb[])
+    """, thread_id, [json.dumps([{"id": tool_call_id}]) for tool_call_id in sorted(missing)])
+    return rows
+
+
 @router.get("/threads/{thread_id}/messages")
 async def get_thread_messages(
     thread_id: str,
+    request: Request,
+    response: Response,
     user_id: str = Depends(get_current_user_id_from_jwt),
-    order: str = Query("desc", description="Order by created_at: 'asc' or 'desc'")
+    order: str = Query("desc", description="Order by created_at: 'asc' or 'desc'"),
+    since: Optional[str] = Query(None, description="Only return messages after this cursor (delta sync)"),
+    before: Optional[str] = Query(None, description="Only return messages before this cursor (older pages)"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of messages; all matching messages when omitted")
 ):
-    """Get all messages for a thread, fetching in batches of 1000 from the DB to avoid large queries."""
-    logger.info(f"Fetching all messages for thread: {thread_id}, order={order}")
+    """Get the messages of a thread from the merged messages/events view.
+
+    不带参数时与以前一样返回全部消息；since / before 为响应 cursor 中的 newest / oldest，
+    用于增量同步和向前翻页。响应带 ETag，线程没有变化时 If-None-Match 直接返回 304。
+    """
+    logger.info(f"Fetching messages for thread: {thread_id}, order={order}, since={bool(since)}, before={bool(before)}, limit={limit}")
+    descending = order == "desc"
+    since_bound = _decode_cursor(since) if since else None
+    before_bound = _decode_cursor(before) if before else None
+
     client = await db.client
     await verify_thread_access(client, thread_id, user_id)
     try:
-        batch_size = 1000
-        offset = 0
-        all_messages = []
-        # 🔧 Step 1: 从 messages 表查询系统消息 (assistant, tool, status等)
-        all_system_messages = []
-        offset = 0
-        while True:
-            query = client.table('messages').select('*').eq('thread_id', thread_id)
-            query = query.order('created_at', desc=(order == "desc"))
-            query = query.range(offset, offset + batch_size - 1)
-            messages_result = await query.execute()
-            batch = messages_result.data or []
-            all_system_messages.extend(batch)
-            logger.debug(f"Fetched batch of {len(batch)} system messages (offset {offset})")
-            if len(batch) < batch_size:
-                break
-            offset += batch_size
-        
-        # 🔧 Step 2: 从 events 表查询用户消息
-        all_user_events = []
-        offset = 0  
-        while True:
-            query = client.schema('public').table('events').select('*').eq('session_id', thread_id).eq('author', 'user')
-            query = query.order('timestamp', desc=(order == "desc"))
-            query = query.range(offset, offset + batch_size - 1)
-            events_result = await query.execute()
-            batch = events_result.data or []
-            all_user_events.extend(batch)
-            logger.debug(f"Fetched batch of {len(batch)} user events (offset {offset})")
-            if len(batch) < batch_size:
-                break
-            offset += batch_size
-        
-        # 🔧 Step 3: 转换并合并两种数据源
-        system_messages = _format_messages_from_table(all_system_messages)
-        user_messages = _convert_user_events_to_messages(all_user_events)
-        
-        # 🔧 Step 4: 合并并按时间排序
-        all_messages = system_messages + user_messages
-        all_messages.sort(key=lambda x: x.get('created_at', ''), reverse=(order == "desc"))
-        
-        # 🔍 详细统计
-        system_stats = {}
-        for msg in system_messages:
-            msg_type = msg.get('type', 'unknown')
-            system_stats[msg_type] = system_stats.get(msg_type, 0) + 1
-            
-        user_stats = {}
-        for msg in user_messages:
-            msg_type = msg.get('type', 'unknown')  
-            user_stats[msg_type] = user_stats.get(msg_type, 0) + 1
-        
-        all_stats = {}
-        for msg in all_messages:
-            msg_type = msg.get('type', 'unknown')
-            all_stats[msg_type] = all_stats.get(msg_type, 0) + 1
-        
-        logger.info(f"🔗 合并结果统计:")
-        logger.info(f"  📨 系统消息{len(system_messages)}条: {system_stats}")
-        logger.info(f"  👤 用户消息{len(user_messages)}条: {user_stats}")
-        logger.info(f"  📊 总计{len(all_messages)}条: {all_stats}")
-        
-        return {"messages": all_messages}
+        etag = await _thread_messages_etag(client, thread_id, f"{order}|{since}|{before}|{limit}")
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+
+        # 分页方向从游标往外走：since 取紧接着游标之后的消息，before 取紧挨着游标之前的消息，
+        # 保证连续翻页不会跳过中间的消息；最后再按请求的 order 排列
+        if since_bound:
+            scan_descending = False
+        elif before_bound:
+            scan_descending = True
+        else:
+            scan_descending = descending
+        query, params = _build_thread_messages_query(scan_descending, since_bound, before_bound, limit)
+        rows = await client.fetch('messages', query, thread_id, *params)
+
+        has_more = bool(limit) and len(rows) > limit
+        if limit:
+            rows = rows[:limit]
+        if scan_descending != descending:
+            rows.reverse()
+
+        message_rows = [dict(row, message_id=row['id']) for row in rows if row['source'] == 'message']
+        event_rows = [
+            {"id": row['id'], "session_id": row['thread_id'], "content": row['content'], "timestamp": row['created_at']}
+            for row in rows if row['source'] == 'event'
+        ]
+
+        context_rows = await _load_assistants_for_tool_calls(client, thread_id, message_rows) if (since or before or limit) else []
+        system_messages = _format_messages_from_table(message_rows, context_messages=context_rows)
+        user_messages = _convert_user_events_to_messages(event_rows)
+
+        # 两个列表都已按数据库顺序排列，归并即可，不再整体排序
+        all_messages = list(heapq.merge(
+            system_messages, user_messages, key=lambda msg: msg.get('created_at'), reverse=descending
+        ))
+
+        newest, oldest = None, None
+        if rows:
+            newest, oldest = (rows[0], rows[-1]) if descending else (rows[-1], rows[0])
+        logger.info(f"Fetched {len(all_messages)} messages for thread {thread_id} ({len(message_rows)} rows + {len(event_rows)} user events)")
+
+        response.headers["ETag"] = etag
+        return {
+            "messages": all_messages,
+            "cursor": {
+                "newest": _encode_cursor(newest['created_at'], newest['id']) if newest else since,
+                "oldest": _encode_cursor(oldest['created_at'], oldest['id']) if oldest else before,
+                "has_more": has_more
+            }
+        }
     except Exception as e:
         logger.error(f"Error fetching messages for thread {thread_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch messages: {str(e)}")
@@ -4197,6 +4360,7 @@ async def _create_adk_session_if_not_exists(client, user_id: str, session_id: st
                 logger.info(f"Created ADK session: {session_id}")
             else:
                 logger.debug(f"ADK session already exists: {session_id}")
+        mark_read_your_writes()
                 
     except Exception as e:
         logger.error(f"Create ADK session failed: {e}")
@@ -4244,6 +4408,7 @@ async def _log_adk_user_message_event(client, user_id: str, message_content: str
                 event_id, app_name, user_id, session_id, invocation_id,
                 "user", datetime.now(), json.dumps(content), actions_bytes  
             )
+        mark_read_your_writes()
         
         logger.info(f"User message event recorded successfully: {event_id}")
         return event_id
@@ -4278,6 +4443,7 @@ async def _log_adk_agent_response_event(client, user_id: str, response_content:
                 event_id, app_name, user_id, session_id, invocation_id,
                 "assistant", datetime.now(), json.dumps(content), b'', True  # turn_complete=True
             )
+        mark_read_your_writes()
         
         logger.info(f"记录AI回复事件成功: {event_id}")
         return event_id
@@ -4286,26 +4452,14 @@ async def _log_adk_agent_response_event(client, user_id: str, response_content:
         logger.error(f"记录AI回复事件失败: {e}")
         raise
 
-def _format_messages_from_table(messages):
-    """格式化messages表数据为前端期望格式，支持assistant消息动态拆分"""
+def _format_messages_from_table(messages, context_messages=None):
+    """格式化messages表数据为前端期望格式，支持assistant消息动态拆分
+
+    context_messages 是不在本页、但拥有本页 tool 消息所对应 tool_call 的 assistant 消息，
+    只用于修正 tool 消息的 assistant_message_id，不会出现在返回结果里。
+    """
     formatted_messages = []
     
-  
-    raw_message_stats = {}
-    for msg in messages:
-        msg_type = msg.get('type', 'unknown')
-        raw_message_stats[msg_type] = raw_message_stats.get(msg_type, 0) + 1
-    logger.info(f"raw message type stats: {raw_message_stats}")
-    
-    # 特别检查原始assistant消息
-    raw_assistant_messages = [msg for msg in messages if msg.get('type') == 'assistant']
-    if raw_assistant_messages:
-        for assistant_msg in raw_assistant_messages:
-            raw_msg_id = assistant_msg.get('message_id')
-            logger.info(f"found raw assistant message: ID={raw_msg_id} (type: {type(raw_msg_id)}), metadata preview={str(assistant_msg.get('metadata', ''))[:200]}...")
-    else:
-        logger.warning("no assistant message found")
-    
     for msg in messages:
         try:
             # 处理content字段 - 解析为对象以便后续判断
@@ -4351,7 +4505,7 @@ def _format_messages_from_table(messages):
                 metadata_obj.get("split_for_frontend") == True and
                 metadata_obj.get("tool_call_mapping")):
                 
-                logger.info(f"🔧 检测到需要拆分的assistant消息: {msg.get('message_id')}")
+                logger.debug(f"🔧 检测到需要拆分的assistant消息: {msg.get('message_id')}")
                 tool_call_mapping = metadata_obj.get("tool_call_mapping", [])
                 assistant_text = content_obj.get("content", "")
                 tool_calls = content_obj.get("tool_calls", [])
@@ -4405,7 +4559,7 @@ def _format_messages_from_table(messages):
                         }
                         
                         formatted_messages.append(split_message)
-                        logger.info(f"split assistant message: {deterministic_uuid} (tool: {matching_tool_call.get('function', {}).get('name', 'unknown')})")
+                        logger.debug(f"split assistant message: {deterministic_uuid} (tool: {matching_tool_call.get('function', {}).get('name', 'unknown')})")
                         logger.debug(f"split message field type check: message_id={type(deterministic_uuid)}, thread_id={type(split_message['thread_id'])}")
                 
             else:
@@ -4433,6 +4587,8 @@ def _format_messages_from_table(messages):
                 # 🔧 更新tool消息的assistant_message_id关联
     assistant_messages = [msg for msg in formatted_messages if msg.get('type') == 'assistant']
     tool_messages = [msg for msg in formatted_messages if msg.get('type') == 'tool']
+    if context_messages and tool_messages:
+        assistant_messages += [msg for msg in _format_messages_from_table(context_messages) if msg.get('type') == 'assistant']
     
     # 创建tool_call_id到assistant_message_id的映射
     tool_call_to_assistant = {}
@@ -4464,14 +4620,11 @@ def _format_messages_from_table(messages):
                 metadata['assistant_message_id'] = correct_assistant_id
                 tool_msg['metadata'] = json.dumps(metadata, ensure_ascii=False)
                 updated_tool_count += 1
-                logger.info(f"update tool message {tool_msg.get('message_id')} -> assistant {correct_assistant_id}")
+                logger.debug(f"update tool message {tool_msg.get('message_id')} -> assistant {correct_assistant_id}")
         except Exception as e:
             logger.warning(f"update tool message assistant failed {tool_msg.get('message_id')}: {e}")
     
-    # 🔍 最终统计
-    logger.info(f"final assistant message count: {len(assistant_messages)}")
-    logger.info(f"tool message count: {len(tool_messages)}")
-    logger.info(f"updated {updated_tool_count} tool message assistant")
+    logger.debug(f"formatted {len(formatted_messages)} messages, linked {updated_tool_count} tool messages to assistant messages")
     
     return formatted_messages
 
@@ -135,9 +135,18 @@ class FufanmanusAgentRepository:
       
     async def update_agent_version_pointer(self, agent_id: str, version_id: str) -> bool:
         try:
+            from agent.versioning.version_service import summarize_version_config
+            
             client = await self.db.client
+            version_result = await client.table('agent_versions').select('config').eq('version_id', version_id).execute()
+            if not version_result.data:
+                logger.warning(f"Version {version_id} not found, not pointing agent {agent_id} at it")
+                return False
+            
+            # 工具摘要列必须和 current_version_id 一起更新
             result = await client.table('agents').update({
-                'current_version_id': version_id
+                'current_version_id': version_id,
+                **summarize_version_config(version_result.data[0].get('config'))
             }).eq('agent_id', agent_id)
             
             return bool(result.data)
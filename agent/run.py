@@ -1,5 +1,8 @@
 import os
+import io
 import json
+import base64
+import hashlib
 import asyncio
 import datetime
 from typing import Optional, Dict, List, Any, AsyncGenerator
@@ -181,7 +184,9 @@ class PromptManager:
         now = datetime.datetime.now(datetime.timezone.utc)
         datetime_info = f"\n\n=== CURRENT DATE/TIME INFORMATION ===\n"
         datetime_info += f"Today's date: {now.strftime('%A, %B %d, %Y')}\n"
-        datetime_info += f"Current UTC time: {now.strftime('%H:%M:%S UTC')}\n"
+        # 时间只精确到小时：同一小时内生成的系统提示词逐字节相同，可以命中 ADK runner 缓存和模型提供方的 prompt cache；
+        # 标注为小时而不是具体时间，避免模型把整点当成当前时刻
+        datetime_info += f"Current UTC hour: {now.strftime('%H:00')}-{now.strftime('%H:59')} UTC (exact minutes not provided)\n"
         datetime_info += f"Current year: {now.strftime('%Y')}\n"
         datetime_info += f"Current month: {now.strftime('%B')}\n"
         datetime_info += f"Current day: {now.strftime('%A')}\n"
@@ -191,12 +196,47 @@ class PromptManager:
 
         return {"role": "system", "content": system_content}
 
+def _compress_screenshot(data_url: str) -> str:
+    """按配置缩小截图并重新编码为 JPEG，减小上传体积和模型输入 token（CPU 密集，通过 asyncio.to_thread 调用）
+
+    只处理 data URL；HTTP 地址、Pillow 不可用或解码失败时原样返回。
+    """
+    max_dimension = config.BROWSER_SCREENSHOT_MAX_DIMENSION
+    if max_dimension <= 0 or not data_url.startswith('data:') or ';base64,' not in data_url:
+        return data_url
+    try:
+        from PIL import Image # type: ignore
+    except ImportError:
+        return data_url
+
+    try:
+        encoded = data_url.split(';base64,', 1)[1]
+        image = Image.open(io.BytesIO(base64.b64decode(encoded)))
+        image.thumbnail((max_dimension, max_dimension))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=config.BROWSER_SCREENSHOT_JPEG_QUALITY, optimize=True)
+        compressed = base64.b64encode(output.getvalue()).decode('ascii')
+        # 重新编码反而更大时保留原图
+        if len(compressed) >= len(encoded):
+            return data_url
+        return f"data:image/jpeg;base64,{compressed}"
+    except Exception as e:
+        logger.warning(f"Failed to compress browser screenshot: {e}")
+        return data_url
+
+
 class MessageManager:
     """
     消息管理器类
     
     负责构建临时消息，包括浏览器状态和图像上下文信息。
     这些临时消息会在AI处理用户请求时作为上下文信息提供给模型。
+
+    浏览器状态按 message_id 缓存：本进程没有写入新的 browser_state / image_context 消息时
+    （见 agentpress.context_manager.record_context_message）不再查询数据库；
+    截图按内容哈希去重，与上一轮已发送的截图相同时只发送一句说明。
     """
     
     def __init__(self, client, thread_id: str, model_name: str, trace: Optional[StatefulTraceClient]): # type: ignore
@@ -213,13 +253,104 @@ class MessageManager:
         self.thread_id = thread_id
         self.model_name = model_name
         self.trace = trace
+        # 已查询过的消息类型，以及每种类型最近处理过的 message_id
+        self._checked_types = set()
+        self._seen_message_ids: Dict[str, Optional[str]] = {}
+        # 最近一次浏览器状态生成的文本与截图（截图附带内容哈希）
+        self._browser_state_text: Optional[dict] = None
+        self._browser_screenshot: Optional[tuple] = None
+        self._last_sent_screenshot_hash: Optional[str] = None
+
+    def _supports_images(self) -> bool:
+        # 检查模型是否支持图像处理（Gemini、Anthropic、OpenAI）
+        model_name = self.model_name.lower()
+        return 'gemini' in model_name or 'anthropic' in model_name or 'openai' in model_name
+
+    async def _fetch_latest(self, message_type: str) -> Optional[dict]:
+        """本进程写入过更新的消息、或本轮运行还没查询过时才查询该类型的最新消息"""
+        from agentpress.context_manager import get_context_message_writes
+
+        known_id = get_context_message_writes(self.thread_id).get(message_type)
+        if message_type in self._checked_types and (not known_id or known_id == self._seen_message_ids.get(message_type)):
+            return None
+
+        self._checked_types.add(message_type)
+        result = await self.client.table('messages').select('message_id, content').eq('thread_id', self.thread_id).eq('type', message_type).order('created_at', desc=True).limit(1).execute()
+        if not result.data:
+            return None
+
+        message = result.data[0]
+        message_id = str(message['message_id'])
+        if message_id == self._seen_message_ids.get(message_type):
+            return None
+        self._seen_message_ids[message_type] = message_id
+        return message
+
+    async def _update_browser_state(self, message: dict):
+        # 解析浏览器状态内容
+        browser_content = message["content"]
+        if isinstance(browser_content, str):
+            browser_content = json.loads(browser_content)
+
+        # 提取截图信息：优先使用URL（base64_data），如果没有则使用Base64
+        screenshot_base64 = browser_content.get("screenshot_base64")  # Base64编码的截图
+        screenshot_url = browser_content.get("base64_data")  # 截图的URL或data URL
+        if not screenshot_url and screenshot_base64:
+            screenshot_url = f"data:image/jpeg;base64,{screenshot_base64}"
+
+        # 复制浏览器状态文本，移除截图相关字段
+        browser_state_text = browser_content.copy()
+        browser_state_text.pop('screenshot_base64', None)
+        browser_state_text.pop('base64_data', None)
+        self._browser_state_text = browser_state_text or None
+
+        self._browser_screenshot = None
+        if screenshot_url and self._supports_images():
+            screenshot_hash = hashlib.sha1(screenshot_url.encode('utf-8')).hexdigest()
+            if self._browser_screenshot_hash_matches(screenshot_hash):
+                # 与上一轮发送的截图字节相同，不必重新压缩
+                self._browser_screenshot = (screenshot_hash, None)
+            else:
+                # Pillow 解码/缩放/编码是 CPU 密集操作，放到线程池里执行，避免阻塞事件循环
+                compressed = await asyncio.to_thread(_compress_screenshot, screenshot_url)
+                self._browser_screenshot = (screenshot_hash, compressed)
+
+    def _browser_screenshot_hash_matches(self, screenshot_hash: str) -> bool:
+        return config.BROWSER_SCREENSHOT_SKIP_UNCHANGED and screenshot_hash == self._last_sent_screenshot_hash
+
+    def _browser_state_content(self) -> List[dict]:
+        content = []
+        # 如果有浏览器状态文本信息，添加到临时消息中
+        if self._browser_state_text:
+            content.append({
+                "type": "text",
+                "text": f"The following is the current state of the browser:\n{json.dumps(self._browser_state_text, indent=2)}"
+            })
+
+        if self._browser_screenshot:
+            screenshot_hash, screenshot_url = self._browser_screenshot
+            if self._browser_screenshot_hash_matches(screenshot_hash):
+                content.append({
+                    "type": "text",
+                    "text": "The browser screenshot is unchanged since the previous step."
+                })
+            elif screenshot_url:
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": screenshot_url,
+                        "format": "image/jpeg"
+                    }
+                })
+                self._last_sent_screenshot_hash = screenshot_hash
+        return content
     
     async def build_temporary_message(self) -> Optional[dict]:
         """
         构建临时消息
         
         这个方法会：
-        1. 获取最新的浏览器状态信息（包括截图）
+        1. 获取最新的浏览器状态信息（包括截图），没有新的浏览器状态时复用缓存
         2. 获取最新的图像上下文信息
         3. 将这些信息组合成一个临时消息，供AI模型使用
         
@@ -229,60 +360,25 @@ class MessageManager:
         temp_message_content_list = []  # 存储临时消息的内容列表
 
         # 获取最新的浏览器状态消息
-        latest_browser_state_msg = await self.client.table('messages').select('*').eq('thread_id', self.thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
-        
-        if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
-            try:
-                # 解析浏览器状态内容
-                browser_content = latest_browser_state_msg.data[0]["content"]
-                if isinstance(browser_content, str):
-                    browser_content = json.loads(browser_content)
-                
-                # 提取截图信息
-                screenshot_base64 = browser_content.get("screenshot_base64")  # Base64编码的截图
-                screenshot_url = browser_content.get("base64_data")  # 截图的base64数据
-                
-                # 复制浏览器状态文本，移除截图相关字段
-                browser_state_text = browser_content.copy()
-                browser_state_text.pop('screenshot_base64', None)
-                browser_state_text.pop('base64_data', None)
-
-                # 如果有浏览器状态文本信息，添加到临时消息中
-                if browser_state_text:
-                    temp_message_content_list.append({
-                        "type": "text",
-                        "text": f"The following is the current state of the browser:\n{json.dumps(browser_state_text, indent=2)}"
-                    })
-                
-                # 检查模型是否支持图像处理（Gemini、Anthropic、OpenAI）
-                if 'gemini' in self.model_name.lower() or 'anthropic' in self.model_name.lower() or 'openai' in self.model_name.lower():
-                    # 优先使用URL，如果没有则使用Base64
-                    if screenshot_url:
-                        temp_message_content_list.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": screenshot_url,
-                                "format": "image/jpeg"
-                            }
-                        })
-                    elif screenshot_base64:
-                        temp_message_content_list.append({
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{screenshot_base64}",
-                            }
-                        })
-
-            except Exception as e:
-                logger.error(f"Error parsing browser state: {e}")
+        try:
+            latest_browser_state_msg = await self._fetch_latest('browser_state')
+            if latest_browser_state_msg:
+                await self._update_browser_state(latest_browser_state_msg)
+            temp_message_content_list.extend(self._browser_state_content())
+        except Exception as e:
+            logger.error(f"Error parsing browser state: {e}")
 
         # 获取最新的图像上下文消息
-        latest_image_context_msg = await self.client.table('messages').select('*').eq('thread_id', self.thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
+        try:
+            latest_image_context_msg = await self._fetch_latest('image_context')
+        except Exception as e:
+            logger.error(f"Error fetching image context: {e}")
+            latest_image_context_msg = None
         
-        if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
+        if latest_image_context_msg:
             try:
                 # 解析图像上下文内容
-                image_context_content = latest_image_context_msg.data[0]["content"] if isinstance(latest_image_context_msg.data[0]["content"], dict) else json.loads(latest_image_context_msg.data[0]["content"])
+                image_context_content = latest_image_context_msg["content"] if isinstance(latest_image_context_msg["content"], dict) else json.loads(latest_image_context_msg["content"])
                 
                 # 提取图像信息
                 base64_image = image_context_content.get("base64")  # Base64编码的图像
@@ -305,7 +401,7 @@ class MessageManager:
                     })
 
                 # 处理完图像上下文后，删除该消息（避免重复使用）
-                await self.client.table('messages').delete().eq('message_id', latest_image_context_msg.data[0]["message_id"]).execute()
+                await self.client.table('messages').delete().eq('message_id', latest_image_context_msg["message_id"]).execute()
                 
             except Exception as e:
                 logger.error(f"Error parsing image context: {e}")
@@ -1087,4 +1183,10 @@ async def run_agent(
     except Exception as run_error:
         logger.error(f"runner.run() failed: {run_error}")
         logger.error(f"Error details: {traceback.format_exc()}")
-        raise run_error
\ No newline at end of file
+        raise run_error
+    finally:
+        # 释放本次运行缓存的 ADK Runner 及其持有的工具实例
+        from services.llm import release_adk_runners
+        released = release_adk_runners(thread_id)
+        if released:
+            logger.debug(f"Released {released} cached ADK runners for thread {thread_id}")
\ No newline at end of file
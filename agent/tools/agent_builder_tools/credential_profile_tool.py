@@ -283,17 +283,9 @@ After connecting, you'll be able to use {result.toolkit.name} tools in your agen
                 }
                 
                 mcp_wrapper_instance = MCPToolWrapper(mcp_configs=[mcp_config_for_wrapper])
-                await mcp_wrapper_instance.initialize_and_register_tools()
+                await mcp_wrapper_instance.initialize_and_register_tools(self.thread_manager.tool_registry)
                 updated_schemas = mcp_wrapper_instance.get_schemas()
                 
-                for method_name, schema_list in updated_schemas.items():
-                    for schema in schema_list:
-                        self.thread_manager.tool_registry.tools[method_name] = {
-                            "instance": mcp_wrapper_instance,
-                            "schema": schema
-                        }
-                        logger.info(f"Dynamically registered MCP tool: {method_name}")
-                
                 logger.info(f"Successfully registered {len(updated_schemas)} MCP tools dynamically for {profile.toolkit_name}")
                 
             except Exception as e:
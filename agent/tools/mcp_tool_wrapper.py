@@ -1,9 +1,12 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 from agentpress.tool import Tool, ToolResult, ToolSchema, SchemaType
 from mcp_module import mcp_service
+from utils.config import config as app_config
 from utils.logger import logger
+from collections import OrderedDict
 import inspect
 import asyncio
+import copy
 import time
 import hashlib
 import json
@@ -13,11 +16,23 @@ from agent.tools.utils.dynamic_tool_builder import DynamicToolBuilder
 from agent.tools.utils.mcp_tool_executor import MCPToolExecutor
 from services import redis as redis_service
 
+# 进程内缓存的服务器数量；Redis 是跨进程共享的第二层
+MCP_SCHEMA_MEMORY_CACHE_SIZE = 256
 
-class MCPSchemaRedisCache:
-    def __init__(self, ttl_seconds: int = 3600, key_prefix: str = "mcp_schema:"):
-        self._ttl = ttl_seconds
+# 这些字段不影响服务器返回的工具列表，不参与缓存键：修改启用的工具或说明不会让缓存失效
+_NON_DISCOVERY_CONFIG_KEYS = ('enabledTools', 'enabled_tools', 'instructions')
+
+
+class MCPSchemaCache:
+    """Two-tier (process + Redis) cache of discovered MCP tool definitions.
+
+    条目在 MCP_SCHEMA_CACHE_TTL 内视为新鲜；过期后直到 MCP_SCHEMA_CACHE_MAX_STALE 仍会返回，
+    由调用方先使用旧定义并在后台重新发现、回写（stale-while-revalidate）。
+    """
+
+    def __init__(self, key_prefix: str = "mcp_schema:v2:"):
         self._key_prefix = key_prefix
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self._redis_client = None
     
     async def _ensure_redis(self):
@@ -29,55 +44,66 @@ class MCPSchemaRedisCache:
                 return False
         return True
     
-    def _get_cache_key(self, config: Dict[str, Any]) -> str:
-        config_str = json.dumps(config, sort_keys=True)
+    def cache_key(self, config: Dict[str, Any]) -> str:
+        discovery_config = {k: v for k, v in config.items() if k not in _NON_DISCOVERY_CONFIG_KEYS}
+        config_str = json.dumps(discovery_config, sort_keys=True, default=str)
         config_hash = hashlib.md5(config_str.encode()).hexdigest()
         return f"{self._key_prefix}{config_hash}"
     
-    async def get(self, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > MCP_SCHEMA_MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+    
+    async def _get_from_redis(self, key: str) -> Optional[Dict[str, Any]]:
         if not await self._ensure_redis():
             return None
-            
         try:
-            key = self._get_cache_key(config)
             cached_data = await self._redis_client.get(key)
-            
-            if cached_data:
-                logger.debug(f"⚡ Redis cache hit for MCP: {config.get('name', config.get('qualifiedName', 'Unknown'))}")
-                return json.loads(cached_data)
-            else:
-                logger.debug(f"Redis cache miss for MCP: {config.get('name', config.get('qualifiedName', 'Unknown'))}")
-                return None
-                
+            return json.loads(cached_data) if cached_data else None
         except Exception as e:
             logger.warning(f"Error reading from Redis cache: {e}")
             return None
     
-    async def set(self, config: Dict[str, Any], data: Dict[str, Any]):
+    async def get(self, key: str) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """Return (entry, is_fresh), or None when nothing usable is cached."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+        else:
+            entry = await self._get_from_redis(key)
+            if entry is None:
+                return None
+            self._remember(key, entry)
+        
+        age = time.time() - entry.get('fetched_at', 0)
+        if age > app_config.MCP_SCHEMA_CACHE_MAX_STALE:
+            return None
+        return entry, age <= app_config.MCP_SCHEMA_CACHE_TTL
+    
+    async def set(self, key: str, data: Dict[str, Any]):
+        entry = {**data, 'fetched_at': time.time()}
+        self._remember(key, entry)
+        
         if not await self._ensure_redis():
             return
-            
         try:
-            key = self._get_cache_key(config)
-            serialized_data = json.dumps(data)
-            
-            await self._redis_client.setex(key, self._ttl, serialized_data)
-            logger.debug(f"✅ Cached MCP schema in Redis for {config.get('name', config.get('qualifiedName', 'Unknown'))} (TTL: {self._ttl}s)")
-            
+            await self._redis_client.setex(key, app_config.MCP_SCHEMA_CACHE_MAX_STALE, json.dumps(entry))
+            logger.debug(f"✅ Cached MCP schema {key} ({len(entry.get('tools', []))} tools)")
         except Exception as e:
             logger.warning(f"Error writing to Redis cache: {e}")
     
     async def clear_pattern(self, pattern: Optional[str] = None):
+        search_prefix = f"{self._key_prefix}{pattern or ''}"
+        for key in [key for key in self._memory if key.startswith(search_prefix)]:
+            self._memory.pop(key, None)
+        
         if not await self._ensure_redis():
             return
         try:
-            if pattern:
-                search_pattern = f"{self._key_prefix}{pattern}*"
-            else:
-                search_pattern = f"{self._key_prefix}*"
-            
             keys = []
-            async for key in self._redis_client.scan_iter(match=search_pattern):
+            async for key in self._redis_client.scan_iter(match=f"{search_prefix}*"):
                 keys.append(key)
             
             if keys:
@@ -89,7 +115,7 @@ class MCPSchemaRedisCache:
     
     async def get_stats(self) -> Dict[str, Any]:
         if not await self._ensure_redis():
-            return {"available": False}
+            return {"available": False, "memory_entries": len(self._memory)}
         try:
             count = 0
             async for _ in self._redis_client.scan_iter(match=f"{self._key_prefix}*"):
@@ -98,7 +124,9 @@ class MCPSchemaRedisCache:
             return {
                 "available": True,
                 "cached_schemas": count,
-                "ttl_seconds": self._ttl,
+                "memory_entries": len(self._memory),
+                "ttl_seconds": app_config.MCP_SCHEMA_CACHE_TTL,
+                "max_stale_seconds": app_config.MCP_SCHEMA_CACHE_MAX_STALE,
                 "key_prefix": self._key_prefix
             }
         except Exception as e:
@@ -106,7 +134,15 @@ class MCPSchemaRedisCache:
             return {"available": False, "error": str(e)}
 
 
-_redis_cache = MCPSchemaRedisCache(ttl_seconds=3600)
+_schema_cache = MCPSchemaCache()
+
+# 正在后台刷新的缓存键，同一服务器的过期条目只刷新一次
+_refreshing_keys: Set[str] = set()
+
+
+def _config_name(config: Dict[str, Any]) -> str:
+    return config.get('name', config.get('qualifiedName', 'Unknown'))
+
 
 class MCPToolWrapper(Tool):
     def __init__(self, mcp_configs: Optional[List[Dict[str, Any]]] = None, use_cache: bool = True):
@@ -117,6 +153,9 @@ class MCPToolWrapper(Tool):
         self._dynamic_tools = {}
         self._custom_tools = {}
         self.use_cache = use_cache
+        self._tool_registry = None
+        self._late_tasks: Set[asyncio.Task] = set()
+        self._refresh_tasks: Set[asyncio.Task] = set()
         
         self.connection_manager = MCPConnectionManager()
         self.custom_handler = CustomMCPHandler(self.connection_manager)
@@ -128,115 +167,144 @@ class MCPToolWrapper(Tool):
     async def _ensure_initialized(self):
         if not self._initialized:
             await self._initialize_servers()
-            await self._create_dynamic_tools()
+            self._create_dynamic_tools()
             self._initialized = True
     
     async def _initialize_servers(self):
+        """Bring up all configured servers concurrently within MCP_DISCOVERY_DEADLINE_MS.
+
+        缓存命中（包括过期但仍在 MAX_STALE 内的条目）立即注册；未命中的服务器并发发现，
+        截止时间内完成的随本次启动注册，其余在后台完成后再注册到 tool registry。
+        """
         start_time = time.time()
+        keys = [_schema_cache.cache_key(config) for config in self.mcp_configs]
         
-        standard_configs = [cfg for cfg in self.mcp_configs if not cfg.get('isCustom', False)]
-        custom_configs = [cfg for cfg in self.mcp_configs if cfg.get('isCustom', False)]
+        if self.use_cache and self.mcp_configs:
+            cached_entries = await asyncio.gather(*(_schema_cache.get(key) for key in keys))
+        else:
+            cached_entries = [None] * len(self.mcp_configs)
         
-        cached_configs = []
-        cached_tools_data = []
+        cached_names = []
+        pending = []
+        for config, key, cached in zip(self.mcp_configs, keys, cached_entries):
+            if cached is not None:
+                data, fresh = cached
+                try:
+                    await self._restore_cached(config, data)
+                    cached_names.append(_config_name(config))
+                    if not fresh:
+                        self._schedule_refresh(config, key)
+                    continue
+                except Exception as e:
+                    logger.warning(f"Failed to restore cached tools for {_config_name(config)}: {e}")
+            
+            pending.append(asyncio.create_task(self._discover_and_register(config, key), name=_config_name(config)))
         
-        initialization_tasks = []
+        if cached_names:
+            logger.info(f"⚡ Loaded {len(cached_names)} MCP schemas from cache: {', '.join(cached_names)}")
         
-        if standard_configs:
-            for config in standard_configs:
-                if self.use_cache:
-                    cached_data = await _redis_cache.get(config)
-                    if cached_data:
-                        cached_configs.append(config.get('qualifiedName', 'Unknown'))
-                        cached_tools_data.append(cached_data)
-                        continue
-                
-                task = self._initialize_single_standard_server(config)
-                initialization_tasks.append(('standard', config, task))
+        if not pending:
+            if not cached_names:
+                logger.info("No MCP servers to initialize")
+            return
         
-        if custom_configs:
-            for config in custom_configs:
-                if self.use_cache:
-                    cached_data = await _redis_cache.get(config)
-                    if cached_data:
-                        cached_configs.append(config.get('name', 'Unknown'))
-                        cached_tools_data.append(cached_data)
-                        continue
-                
-                task = self._initialize_single_custom_mcp(config)
-                initialization_tasks.append(('custom', config, task))
+        deadline = app_config.MCP_DISCOVERY_DEADLINE_MS / 1000 if app_config.MCP_DISCOVERY_DEADLINE_MS > 0 else None
+        logger.info(f"🚀 Initializing {len(pending)} MCP servers in parallel (deadline: {deadline}s, cache enabled: {self.use_cache})...")
+        done, late = await asyncio.wait(pending, timeout=deadline)
         
-        if cached_tools_data:
-            logger.info(f"⚡ Loaded {len(cached_configs)} MCP schemas from Redis cache: {', '.join(cached_configs)}")
-            for cached_data in cached_tools_data:
-                try:
-                    if cached_data.get('type') == 'standard':
-                        logger.debug("Standard MCP tools found in cache but require connection to restore")
-                    elif cached_data.get('type') == 'custom':
-                        custom_tools = cached_data.get('tools', {})
-                        if custom_tools:
-                            self.custom_handler.custom_tools.update(custom_tools)
-                            logger.debug(f"Restored {len(custom_tools)} custom tools from cache")
-                except Exception as e:
-                    logger.warning(f"Failed to restore cached tools: {e}")
+        successful = 0
+        failed = 0
+        for task in done:
+            if task.exception() is not None:
+                failed += 1
+                logger.error(f"Failed to initialize MCP server '{task.get_name()}': {task.exception()}")
+            else:
+                successful += 1
         
-        if initialization_tasks:
-            logger.info(f"🚀 Initializing {len(initialization_tasks)} MCP servers in parallel (cache enabled: {self.use_cache})...")
-            
-            tasks = [task for _, _, task in initialization_tasks]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            successful = 0
-            failed = 0
-            
-            for i, result in enumerate(results):
-                task_type, config, _ = initialization_tasks[i]
-                if isinstance(result, Exception):
-                    failed += 1
-                    config_name = config.get('name', config.get('qualifiedName', 'Unknown'))
-                    logger.error(f"Failed to initialize MCP server '{config_name}': {result}")
-                else:
-                    successful += 1
-                    if self.use_cache and result:
-                        await _redis_cache.set(config, result)
-            
-            elapsed_time = time.time() - start_time
-            logger.info(f"⚡ MCP initialization completed in {elapsed_time:.2f}s - {successful} successful, {failed} failed, {len(cached_configs)} from cache")
+        for task in late:
+            self._late_tasks.add(task)
+            task.add_done_callback(self._on_late_server_done)
+        
+        elapsed_time = time.time() - start_time
+        logger.info(
+            f"⚡ MCP initialization completed in {elapsed_time:.2f}s - {successful} successful, {failed} failed, "
+            f"{len(cached_names)} from cache, {len(late)} still connecting"
+        )
+    
+    async def _discover(self, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if config.get('isCustom', False):
+            tools = await self.custom_handler.discover_custom_mcp(config)
+            return None if tools is None else {'type': 'custom', 'tools': tools}
+        
+        logger.debug(f"Connecting to standard MCP server: {config['qualifiedName']}")
+        connection = await self.mcp_manager.connect_server(config)
+        tools = [
+            {"name": tool.name, "description": tool.description, "input_schema": tool.inputSchema}
+            for tool in connection.tools or []
+        ]
+        return {'type': 'standard', 'tools': tools}
+    
+    async def _discover_and_register(self, config: Dict[str, Any], key: str) -> Optional[Dict[str, Any]]:
+        data = await self._discover(config)
+        if data is None:
+            return None
+        
+        # standard 服务器在 connect_server 时已经注册到 mcp_service
+        if data['type'] == 'custom':
+            self.custom_handler.register_custom_mcp_tools(config, data['tools'])
+        
+        if self.use_cache:
+            await _schema_cache.set(key, data)
+        return data
+    
+    async def _restore_cached(self, config: Dict[str, Any], data: Dict[str, Any]):
+        if data.get('type') == 'custom':
+            self.custom_handler.register_custom_mcp_tools(config, data.get('tools', []))
         else:
-            if cached_configs:
-                elapsed_time = time.time() - start_time
-                logger.info(f"⚡ All {len(cached_configs)} MCP schemas loaded from Redis cache in {elapsed_time:.2f}s - instant startup!")
-            else:
-                logger.info("No MCP servers to initialize")
+            await self.mcp_manager.restore_connection(config, data.get('tools', []))
     
-    async def _initialize_single_standard_server(self, config: Dict[str, Any]):
-        try:
-            logger.debug(f"Connecting to standard MCP server: {config['qualifiedName']}")
-            await self.mcp_manager.connect_server(config)
-            logger.debug(f"✓ Connected to MCP server: {config['qualifiedName']}")
-            
-            tools_info = self.mcp_manager.get_all_tools_openapi()
-            return {'tools': tools_info, 'type': 'standard', 'timestamp': time.time()}
-        except Exception as e:
-            logger.error(f"✗ Failed to connect to MCP server {config['qualifiedName']}: {e}")
-            raise e
+    def _schedule_refresh(self, config: Dict[str, Any], key: str):
+        if key in _refreshing_keys:
+            return
+        _refreshing_keys.add(key)
+        task = asyncio.create_task(self._refresh_cached_schema(copy.deepcopy(config), key))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
     
-    async def _initialize_single_custom_mcp(self, config: Dict[str, Any]):
+    async def _refresh_cached_schema(self, config: Dict[str, Any], key: str):
         try:
-            logger.debug(f"Initializing custom MCP: {config.get('name', 'Unknown')}")
-            await self.custom_handler._initialize_single_custom_mcp(config)
-            logger.debug(f"✓ Initialized custom MCP: {config.get('name', 'Unknown')}")
-            
-            custom_tools = self.custom_handler.get_custom_tools()
-            return {'tools': custom_tools, 'type': 'custom', 'timestamp': time.time()}
+            data = await self._discover(config)
+            if data is not None:
+                await _schema_cache.set(key, data)
+                logger.debug(f"Revalidated cached MCP schema for {_config_name(config)}")
         except Exception as e:
-            logger.error(f"✗ Failed to initialize custom MCP {config.get('name', 'Unknown')}: {e}")
-            raise e
-            
-    async def _initialize_standard_servers(self, standard_configs: List[Dict[str, Any]]):
-        pass
+            logger.warning(f"Background refresh of MCP schema for {_config_name(config)} failed: {e}")
+        finally:
+            _refreshing_keys.discard(key)
+    
+    def _on_late_server_done(self, task: asyncio.Task):
+        self._late_tasks.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.error(f"Failed to initialize MCP server '{task.get_name()}': {task.exception()}")
+            return
+        if task.result() is None:
+            return
+        
+        self._create_dynamic_tools()
+        self._register_with_registry()
+        logger.info(f"Registered late MCP server '{task.get_name()}' after the discovery deadline")
+    
+    def _register_with_registry(self):
+        if self._tool_registry is None or not self._dynamic_tools:
+            return
+        self._tool_registry.register_instance_methods(
+            self,
+            {tool_data['method_name']: tool_data['method'] for tool_data in self._dynamic_tools.values()}
+        )
     
-    async def _create_dynamic_tools(self):
+    def _create_dynamic_tools(self):
         try:
             available_tools = self.mcp_manager.get_all_tools_openapi()
             custom_tools = self.custom_handler.get_custom_tools()
@@ -315,9 +383,12 @@ class MCPToolWrapper(Tool):
         raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
     
     async def initialize_and_register_tools(self, tool_registry=None):
+        # 记住 registry，启动截止时间之后才完成发现的服务器也能注册进来
+        self._tool_registry = tool_registry
         await self._ensure_initialized()
         if tool_registry and self._dynamic_tools:
             logger.info(f"Updating tool registry with {len(self._dynamic_tools)} MCP tools")
+            self._register_with_registry()
             
     async def get_available_tools(self) -> List[Dict[str, Any]]:
         await self._ensure_initialized()
@@ -328,6 +399,8 @@ class MCPToolWrapper(Tool):
         return await self.tool_executor.execute_tool(tool_name, arguments)
     
     async def cleanup(self):
+        for task in list(self._late_tasks):
+            task.cancel()
         if self._initialized:
             try:
                 await self.mcp_manager.disconnect_all()
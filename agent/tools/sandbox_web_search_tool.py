@@ -1,7 +1,7 @@
 from tavily import AsyncTavilyClient
 import httpx
 from dotenv import load_dotenv
-from agentpress.tool import ToolResult
+from agentpress.tool import ToolResult, ToolConcurrency, tool_scheduling
 from utils.config import config
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.adk_thread_manager import ADKThreadManager
@@ -33,6 +33,7 @@ class SandboxWebSearchTool(SandboxToolsBase):
         # 获取 Tavily 的异步搜索客户端
         self.tavily_client = AsyncTavilyClient(api_key=self.tavily_api_key)
 
+    @tool_scheduling(concurrency=ToolConcurrency.SHARED)
     async def web_search(
         self, 
         query: str,
@@ -17,8 +17,6 @@ import traceback
 import json
 import base64
 import io
-import os
-import time
 import asyncio
 from typing import Optional
 from datetime import datetime
@@ -30,7 +28,9 @@ from browser_use import Browser
 from agentpress.tool import ToolResult
 from agentpress.adk_thread_manager import ADKThreadManager
 from sandbox.tool_base import SandboxToolsBase
+from utils.config import config
 from utils.logger import logger
+from utils.screenshot_store import get_screenshot_store
 
 
 class SandboxBrowserTool(SandboxToolsBase):
@@ -114,13 +114,13 @@ class SandboxBrowserTool(SandboxToolsBase):
             raise
 
     async def _take_screenshot_and_save(self, action_name: str) -> dict:
-        """Take screenshot and save to disk, return screenshot info.
+        """Take screenshot and hand it to the screenshot store, return screenshot info.
 
-        截取当前页面的屏幕截图并保存到本地文件系统。
-        生成的截图文件名包含动作名称和时间戳以避免冲突。
+        截取当前页面的屏幕截图，交给 utils.screenshot_store 处理：
+        按内容哈希去重，在线程池中编码为 WebP/JPEG，写入本地目录或对象存储，并定期清理旧截图。
 
         Args:
-            action_name: 动作名称，用于生成文件名
+            action_name: 动作名称，用于截图描述
 
         Returns:
             dict: 包含截图URL、文件名、大小等信息的字典，失败返回None
@@ -142,33 +142,9 @@ class SandboxBrowserTool(SandboxToolsBase):
             # 解码 base64 图像数据
             img_data = base64.b64decode(b64img)
 
-            # 创建截图目录（扁平结构，匹配API端点）
-            screenshots_dir = os.path.join(".", "screenshots")
-            os.makedirs(screenshots_dir, exist_ok=True)
-
-            # 生成唯一的文件名（包含时间戳避免冲突）
-            timestamp = int(time.time())
-            safe_action = action_name.replace(" ", "_").replace("/", "_")
-            screenshot_filename = f"browser_{safe_action}_{timestamp}.png"
-            screenshot_path = os.path.join(screenshots_dir, screenshot_filename)
-
-            # 将图像数据写入文件
-            with open(screenshot_path, "wb") as f:
-                f.write(img_data)
-
-            # 生成可访问的HTTP URL（匹配API端点路径）
-            screenshot_url = f"http://localhost:8000/api/screenshots/{screenshot_filename}"
-
-            # 构建截图信息字典
-            screenshot_info = {
-                "url": screenshot_url,
-                "filename": screenshot_filename,
-                "size": len(img_data),
-                "content_type": "image/png",
-                "description": f"Screenshot: {action_name}"
-            }
+            screenshot_info = await get_screenshot_store().save(img_data, description=f"Screenshot: {action_name}")
 
-            logger.info(f"Screenshot saved successfully: {screenshot_path} (size: {len(img_data)} bytes)")
+            logger.info(f"Screenshot stored: {screenshot_info['filename']} (size: {screenshot_info['size']} bytes)")
             return screenshot_info
 
         except Exception as e:
@@ -239,7 +215,7 @@ class SandboxBrowserTool(SandboxToolsBase):
                 success_response["base64_data"] = screenshot_url
 
                 # Optional: base_url for relative path concatenation
-                success_response["base_url"] = "http://localhost:8000"
+                success_response["base_url"] = config.SCREENSHOT_PUBLIC_BASE_URL
 
             # 如果有screenshot对象，也添加相关信息
             if "screenshot" in result_data and result_data["screenshot"]:
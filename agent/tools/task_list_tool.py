@@ -1,12 +1,12 @@
 from agentpress.tool import Tool, ToolResult
+from agent.tools.utils.task_list_store import TaskListConflictError, TaskListStore
 from utils.logger import logger
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple, Union
+from collections import OrderedDict
 import json
 from pydantic import BaseModel, Field # type: ignore
 from enum import Enum
 import uuid
-import asyncio
-import sys
 
 """
 为什么复杂任务需要任务清单？
@@ -142,8 +142,20 @@ class Task(BaseModel):
     status: TaskStatus = TaskStatus.PENDING
     section_id: str  # Reference to section ID instead of section name
 
+# 进程内任务清单缓存：thread_id -> (version, sections, tasks)。
+# 读取时先用一次 SELECT version 校验缓存，其他进程改过清单时重新加载，避免 view_tasks 返回过期内容；
+# 写入同样带着版本号做乐观锁校验，校验之后的并发修改只会导致一次冲突重试，不会覆盖别人的修改。
+TASK_LIST_CACHE_SIZE = 500
+_task_list_cache: "OrderedDict[str, Tuple[int, List[Section], List[Task]]]" = OrderedDict()
+
+# 校验并修改状态副本后返回的结果：错误信息，或接收当前版本号、执行写库并返回新版本号的函数
+_Mutation = Union[str, Callable[[int], Awaitable[int]]]
+
+
 class TaskListTool(Tool):
     """Simplified task management system - no extra class definitions."""
+
+    WRITE_RETRIES = 3
     
     def __init__(self, project_id: str, thread_manager, thread_id: str):
         super().__init__()
@@ -151,215 +163,121 @@ class TaskListTool(Tool):
         self.thread_manager = thread_manager
         self.thread_id = thread_id
         self.task_list_message_type = "task_list"
-    
+        self.store = TaskListStore(thread_manager.db)
+
+    async def _load_state(self) -> Tuple[int, List[Section], List[Task]]:
+        """Load (version, sections, tasks), from the in-process cache when its version is still current"""
+        cached = _task_list_cache.get(self.thread_id)
+        if cached is not None:
+            if cached[0] == await self.store.get_version(self.thread_id):
+                _task_list_cache.move_to_end(self.thread_id)
+                return cached
+            _task_list_cache.pop(self.thread_id, None)
+
+        snapshot = await self.store.load(self.thread_id)
+        if snapshot is None:
+            version, sections, tasks = await self._import_legacy_data()
+        else:
+            version = snapshot['version']
+            sections = [Section(**s) for s in snapshot['sections']]
+            tasks = [Task(**t) for t in snapshot['tasks']]
+
+        self._cache_state(version, sections, tasks)
+        return version, sections, tasks
+
+    def _cache_state(self, version: int, sections: List[Section], tasks: List[Task]):
+        _task_list_cache[self.thread_id] = (version, sections, tasks)
+        _task_list_cache.move_to_end(self.thread_id)
+        while len(_task_list_cache) > TASK_LIST_CACHE_SIZE:
+            _task_list_cache.popitem(last=False)
+
     async def _load_data(self) -> Tuple[List[Section], List[Task]]:
         """Load sections and tasks from storage"""
+        _, sections, tasks = await self._load_state()
+        return sections, tasks
+
+    async def _import_legacy_data(self) -> Tuple[int, List[Section], List[Task]]:
+        """一次性迁移：旧版本把整个清单存成一条 task_list 消息，首次加载时导入到任务表"""
+        client = await self.thread_manager.db.client
+        result = await client.table('messages').select('content')\
+            .eq('thread_id', self.thread_id)\
+            .eq('type', self.task_list_message_type)\
+            .order('created_at', desc=True).limit(1).execute()
+
+        if not result.data or not result.data[0].get('content'):
+            return 0, [], []
+
+        content = result.data[0]['content']
+        if isinstance(content, str):
+            content = json.loads(content)
+
+        sections = []
+        tasks = []
+        for s in content.get('sections', []):
+            if 'id' in s:
+                sections.append(Section(**s))
+            else:
+                # 旧的嵌套格式：section 内直接包含 tasks
+                section = Section(title=s['title'])
+                sections.append(section)
+                for old_task in s.get('tasks', []):
+                    task = Task(
+                        content=old_task['content'],
+                        status=TaskStatus(old_task.get('status', 'pending')),
+                        section_id=section.id
+                    )
+                    if 'id' in old_task:
+                        task.id = old_task['id']
+                    tasks.append(task)
+        tasks.extend(Task(**t) for t in content.get('tasks', []))
+
+        if not sections and not tasks:
+            return 0, [], []
+
         try:
-            client = await self.thread_manager.db.client
-            result = await client.table('messages').select('*')\
-                .eq('thread_id', self.thread_id)\
-                .eq('type', self.task_list_message_type)\
-                .order('created_at', desc=True).limit(1).execute()
-            
-            if result.data and result.data[0].get('content'):
-                content = result.data[0]['content']
-                if isinstance(content, str):
-                    content = json.loads(content)
-                
-                # 提取 sections 和 tasks
-                sections_data = content.get('sections', [])
-                tasks_data = content.get('tasks', [])
-                
-                sections = []
-                for i, s in enumerate(sections_data):
-                    try:
-                        section = Section(**s)
-                        sections.append(section)
-                        logger.debug(f"Created section {i}: {section.id}")
-                    except Exception as e:
-                        logger.error(f"Error creating section {i}: {e}, data: {s}")
-                        raise
-                        
-                tasks = []
-                for i, t in enumerate(tasks_data):
-                    try:
-                        # 检查 在创建 Task 对象之前，检查 raw task data 中的 coroutines
-                        if 'status' in t and asyncio.iscoroutine(t['status']):
-                            t['status'] = 'pending'  # Fix it
-                        
-                        task = Task(**t)
-                        
-                        # 再次检查创建的 task 中的 coroutines
-                        if asyncio.iscoroutine(task.status):
-                            task.status = TaskStatus.PENDING
-
-                        tasks.append(task)
-                        logger.debug(f"Created task {i}: {task.id}, status: {repr(task.status)}")
-                    except Exception as e:
-                        logger.error(f"Error creating task {i}: {e}, data: {t}")
-                        raise
-                
-                # 处理旧格式迁移
-                if not sections and 'sections' in content:
-                    # 从旧的嵌套格式创建 sections
-                    for old_section in content['sections']:
-                        section = Section(title=old_section['title'])
-                        sections.append(section)
-                        
-                        # 更新 tasks 以引用 section ID
-                        for old_task in old_section.get('tasks', []):
-                            task = Task(
-                                content=old_task['content'],
-                                status=TaskStatus(old_task.get('status', 'pending')),
-                                section_id=section.id
-                            )
-                            if 'id' in old_task:
-                                task.id = old_task['id']
-                            tasks.append(task)
-                
-                return sections, tasks
-            
-            # 返回空列表 - 没有默认 section
-            return [], []
-            
-        except Exception as e:
-            logger.error(f"Error loading data: {e}")
-            return [], []
-    
-    async def _save_data(self, sections: List[Section], tasks: List[Task]):
-        """Save sections and tasks to storage"""
-        try:
-            client = await self.thread_manager.db.client
-            logger.info(f"Save data - Client type: {type(client)}")
-            
-            #    'section_title': '研究与准备',
-            #   'task_contents': [
-            #    '从TripAdvisor收集关于巴黎旅行的基本信息。',
-            #    '搜索巴黎的热门景点、餐厅和活动。',
-            #    '查找巴黎的交通选项及建议。',
-            #    '收集巴黎的天气预报信息。',
-            #    '确定潜在的备用计划（如遇到不可预见的情况）。',
-            #]
-
-            # EMERGENCY DEBUG: Check for coroutines in tasks before serialization
-            print(f"🔍 _save_data: Processing {len(tasks)} tasks for serialization", file=sys.stderr)
-            
-            for i, task in enumerate(tasks):
-                print(f"🔍 Task {i} - id: {task.id}", file=sys.stderr)
-                print(f"🔍 Task {i} - content type: {type(task.content)}", file=sys.stderr)
-                print(f"🔍 Task {i} - status type: {type(task.status)}, value: {repr(task.status)}", file=sys.stderr)
-                print(f"🔍 Task {i} - section_id type: {type(task.section_id)}", file=sys.stderr)
-                
-                # Check each field for coroutines with emergency debug
-                if asyncio.iscoroutine(task.status):
-                    print(f"❌ FOUND COROUTINE in task.status for task {task.id}: {task.status}", file=sys.stderr)
-                    task.status = TaskStatus.PENDING
-                    print(f"✅ FIXED: Set status to PENDING", file=sys.stderr)
-                    
-                if asyncio.iscoroutine(task.content):
-                    print(f"❌ FOUND COROUTINE in task.content for task {task.id}: {task.content}", file=sys.stderr)
-                    task.content = "ERROR: Content was a coroutine"
-                    
-                if asyncio.iscoroutine(task.section_id):
-                    print(f"❌ FOUND COROUTINE in task.section_id for task {task.id}: {task.section_id}", file=sys.stderr)
-                    task.section_id = "default-section"
-                    
-                # Try to call model_dump to see where the error occurs
-                try:
-                    print(f"🧪 Testing model_dump for task {i}...", file=sys.stderr)
-                    dump_result = task.model_dump()
-                    print(f"✅ model_dump success for task {i}", file=sys.stderr)
-                except Exception as model_dump_error:
-                    print(f"❌ model_dump FAILED for task {i}: {model_dump_error}", file=sys.stderr)
-                    print(f"   Task object: {task}", file=sys.stderr)
-                    print(f"   Task.__dict__: {task.__dict__}", file=sys.stderr)
-                    # Try to identify which field is the problem
-                    for field_name in ['id', 'content', 'status', 'section_id']:
-                        try:
-                            field_value = getattr(task, field_name)
-                            print(f"   {field_name}: {type(field_value)} = {repr(field_value)}", file=sys.stderr)
-                            if asyncio.iscoroutine(field_value):
-                                print(f"   ❌ FIELD {field_name} IS COROUTINE!", file=sys.stderr)
-                        except Exception as field_error:
-                            print(f"   ❌ Error accessing field {field_name}: {field_error}", file=sys.stderr)
-            
-            # EMERGENCY DEBUG: Test content creation 
-            print(f"🔍 Creating content dict with {len(sections)} sections and {len(tasks)} tasks", file=sys.stderr)
-            try:
-                sections_data = []
-                for i, section in enumerate(sections):
-                    print(f"🔍 Processing section {i}: {section.id}", file=sys.stderr)
-                    section_dump = section.model_dump()
-                    sections_data.append(section_dump)
-                    print(f"✅ Section {i} model_dump success", file=sys.stderr)
-                
-                tasks_data = []
-                for i, task in enumerate(tasks):
-                    print(f"🔍 Processing task {i} for content creation: {task.id}", file=sys.stderr)
-                    try:
-                        task_dump = task.model_dump()
-                        tasks_data.append(task_dump)
-                        print(f"✅ Task {i} model_dump success in content creation", file=sys.stderr)
-                    except Exception as task_dump_error:
-                        print(f"❌ Task {i} model_dump FAILED in content creation: {task_dump_error}", file=sys.stderr)
-                        raise
-                
-                content = {
-                    'sections': sections_data,
-                    'tasks': tasks_data
-                }
-                print(f"✅ Content dict created successfully", file=sys.stderr)
-                
-            except Exception as content_error:
-                print(f"❌ CONTENT CREATION FAILED: {content_error}", file=sys.stderr)
-                raise
-            
-            
-            # 找到已经存在的message
-            result = await client.table('messages').select('message_id')\
-                .eq('thread_id', self.thread_id)\
-                .eq('type', self.task_list_message_type)\
-                .order('created_at', desc=True).limit(1).execute()
-            
-            # Check if existing message found
-            print(f"🔍 Database query completed: {len(result.data) if result.data else 0} records found", file=sys.stderr)
-            
-            # Serialize content to JSON
+            version = await self.store.replace(
+                self.thread_id, 0,
+                [s.model_dump(mode='json') for s in sections],
+                [t.model_dump(mode='json') for t in tasks],
+            )
+            logger.info(f"Imported legacy task list for thread {self.thread_id}: {len(sections)} sections, {len(tasks)} tasks")
+            return version, sections, tasks
+        except TaskListConflictError:
+            # 另一个调用已经完成了导入
+            snapshot = await self.store.load(self.thread_id)
+            return (
+                snapshot['version'],
+                [Section(**s) for s in snapshot['sections']],
+                [Task(**t) for t in snapshot['tasks']],
+            )
+
+    async def _commit(self, mutate: Callable[[List[Section], List[Task]], _Mutation]) -> ToolResult:
+        """Apply ``mutate`` to a copy of the current state and persist it with optimistic versioning.
+
+        mutate 在状态副本上校验并原地修改，返回错误信息（不写库）或写库函数。
+        版本冲突时丢弃缓存、重新加载并重放 mutate。
+        """
+        for attempt in range(self.WRITE_RETRIES):
+            version, sections, tasks = await self._load_state()
+            sections = [s.model_copy() for s in sections]
+            tasks = [t.model_copy() for t in tasks]
+
+            outcome = mutate(sections, tasks)
+            if isinstance(outcome, str):
+                return ToolResult(success=False, output=outcome)
+
             try:
-                json_content = json.dumps(content)
-                print(f"JSON serialization successful, length: {len(json_content)}", file=sys.stderr)
-            except Exception as json_error:
-                print(f"JSON serialization failed: {json_error}", file=sys.stderr)
-                raise
-                
-            if result.data:
-                # Update existing
-                print(f"Updating existing message", file=sys.stderr)
-                message_id_for_update = result.data[0]['message_id']
-                print(f"About to update with message_id: {message_id_for_update} (type: {type(message_id_for_update)})", file=sys.stderr)
-                
-                # FIXED: Correct order - set condition first, then call update() (async method)
-                # update() returns a coroutine directly, cannot chain .eq() after it
-                await client.table('messages')\
-                    .eq('message_id', message_id_for_update)\
-                    .update({'content': json_content})
-                print(f"Update operation completed successfully", file=sys.stderr)
-            else:
-                # 创建新的
-                print(f"🔍 Inserting new message", file=sys.stderr)
-                await client.table('messages').insert({
-                    'thread_id': self.thread_id,
-                    'project_id': self.project_id,
-                    'type': self.task_list_message_type,
-                    'role': 'assistant',
-                    'content': json_content,
-                    'is_llm_message': False,
-                    'metadata': json.dumps({})
-                })
-            
-        except Exception as e:
-            logger.error(f"Error saving data: {e}")
-            raise
+                new_version = await outcome(version)
+            except TaskListConflictError:
+                logger.info(f"Task list for thread {self.thread_id} changed concurrently, retrying ({attempt + 1}/{self.WRITE_RETRIES})")
+                _task_list_cache.pop(self.thread_id, None)
+                continue
+
+            self._cache_state(new_version, sections, tasks)
+            response_data = self._format_response(sections, tasks)
+            return ToolResult(success=True, output=json.dumps(response_data, indent=2))
+
+        return ToolResult(success=False, output="Task list was modified concurrently, please view the tasks and retry")
 
     def _format_response(self, sections: List[Section], tasks: List[Task]) -> Dict[str, Any]:
         """Format data for response"""
@@ -445,74 +363,68 @@ class TaskListTool(Tool):
             ToolResult: Success with JSON string of created task structure, or failure with error message.
         """
         try:
-            existing_sections, existing_tasks = await self._load_data()
-    
-            section_map = {s.id: s for s in existing_sections}
-            title_map = {s.title.lower(): s for s in existing_sections}
-        
-            created_tasks = 0
-            created_sections = 0
-      
-            if sections:
-                # Batch creation across multiple sections
-                for section_data in sections:
-                    section_title_input = section_data["title"]
-                    task_list = section_data["tasks"]
-                    
-                    # Find or create section
-                    title_lower = section_title_input.lower()
-                    if title_lower in title_map:
-                        target_section = title_map[title_lower]
-                    else:
-                        target_section = Section(title=section_title_input)
-                        existing_sections.append(target_section)
-                        title_map[title_lower] = target_section
-                        created_sections += 1
-                    
-                    # Create tasks in this section
-                    for task_content in task_list:
-                        new_task = Task(content=task_content, section_id=target_section.id)
-                        existing_tasks.append(new_task)
-                        created_tasks += 1
-                        
-            else:
-                # 单个section创建 - 需要显式指定section
-                if not task_contents:
-                    return ToolResult(success=False, output="必须提供 'sections' 数组或 'task_contents' 与 section 信息")
-                
-                # 如果没有指定section信息，创建默认section
-                if not section_id and not section_title:
-                    section_title = "Tasks"  # 设置默认section标题
-                
-                target_section = None
-                
-                if section_id:
-                    # Use existing section ID
-                    if section_id not in section_map:
-                        return ToolResult(success=False, output=f"Section ID '{section_id}' not found")
-                    target_section = section_map[section_id]
-                    
-                elif section_title:
-                    # Find or create section by title
-                    title_lower = section_title.lower()
-                    if title_lower in title_map:
-                        target_section = title_map[title_lower]
+            def mutate(existing_sections: List[Section], existing_tasks: List[Task]) -> _Mutation:
+                nonlocal section_title
+                section_map = {s.id: s for s in existing_sections}
+                title_map = {s.title.lower(): s for s in existing_sections}
+                new_sections: List[Section] = []
+                new_tasks: List[Task] = []
+
+                if sections:
+                    # Batch creation across multiple sections
+                    for section_data in sections:
+                        section_title_input = section_data["title"]
+                        task_list = section_data["tasks"]
+
+                        # Find or create section
+                        title_lower = section_title_input.lower()
+                        if title_lower in title_map:
+                            target_section = title_map[title_lower]
+                        else:
+                            target_section = Section(title=section_title_input)
+                            new_sections.append(target_section)
+                            title_map[title_lower] = target_section
+
+                        # Create tasks in this section
+                        for task_content in task_list:
+                            new_tasks.append(Task(content=task_content, section_id=target_section.id))
+
+                else:
+                    # 单个section创建 - 需要显式指定section
+                    if not task_contents:
+                        return "必须提供 'sections' 数组或 'task_contents' 与 section 信息"
+
+                    # 如果没有指定section信息，创建默认section
+                    if not section_id and not section_title:
+                        section_title = "Tasks"  # 设置默认section标题
+
+                    if section_id:
+                        # Use existing section ID
+                        if section_id not in section_map:
+                            return f"Section ID '{section_id}' not found"
+                        target_section = section_map[section_id]
                     else:
-                        target_section = Section(title=section_title)
-                        existing_sections.append(target_section)
-                        created_sections += 1
-                
-                # Create tasks
-                for content in task_contents:
-                    new_task = Task(content=content, section_id=target_section.id)
-                    existing_tasks.append(new_task)
-                    created_tasks += 1
-            
-            await self._save_data(existing_sections, existing_tasks)
-            
-            response_data = self._format_response(existing_sections, existing_tasks)
-            
-            return ToolResult(success=True, output=json.dumps(response_data, indent=2))
+                        # Find or create section by title
+                        title_lower = section_title.lower()
+                        if title_lower in title_map:
+                            target_section = title_map[title_lower]
+                        else:
+                            target_section = Section(title=section_title)
+                            new_sections.append(target_section)
+
+                    # Create tasks
+                    for content in task_contents:
+                        new_tasks.append(Task(content=content, section_id=target_section.id))
+
+                existing_sections.extend(new_sections)
+                existing_tasks.extend(new_tasks)
+                return lambda version: self.store.add(
+                    self.thread_id, version,
+                    [s.model_dump(mode='json') for s in new_sections],
+                    [t.model_dump(mode='json') for t in new_tasks],
+                )
+
+            return await self._commit(mutate)
             
         except Exception as e:
             logger.error(f"Error creating tasks: {e}")
@@ -583,93 +495,44 @@ class TaskListTool(Tool):
             ToolResult: Success with JSON string of updated task structure, or failure with error message.
         """
         try:
-            import traceback
-            
             # 标准化 task_ids 总是一个列表
             if isinstance(task_ids, str):
                 target_task_ids = [task_ids]
             else:
-                target_task_ids = task_ids
-            
-            sections, tasks = await self._load_data()
-            section_map = {s.id: s for s in sections}
-            task_map = {t.id: t for t in tasks}
-            
-            # 验证所有 task IDs 是否存在
-            missing_tasks = [tid for tid in target_task_ids if tid not in task_map]
-            if missing_tasks:
-                return ToolResult(success=False, output=f"Task IDs not found: {missing_tasks}")
-            
-            # 验证 section ID 是否提供
-            if section_id and section_id not in section_map:
-                return ToolResult(success=False, output=f"Section ID '{section_id}' not found")
-            
-            # 应用更新
-            updated_count = 0
-            for tid in target_task_ids:
-                try:
-                    task = task_map[tid]
-                    logger.debug(f"Updating task {tid}, current type: {type(task)}")
-                    
-                    if content is not None:
-                        task.content = content
-                        logger.debug(f"Updated content for task {tid}")
-                        
-                    if status is not None:
-                        # 添加调试日志和更安全的 status 转换
-                        logger.debug(f"Updating status for task {tid}, status type: {type(status)}, value: {repr(status)}")
-                        try:
-                            # 确保 status 是一个字符串 - 处理潜在的 coroutine 对象
-                            if asyncio.iscoroutine(status):
-                                logger.error(f"ERROR: status parameter is a coroutine object: {status}")
-                                status_str = "pending"  # Default fallback
-                            else:
-                                status_str = str(status) if status is not None else "pending"
-                            
-                            # 创建新的 status enum
-                            new_status = TaskStatus(status_str)
-                            
-                            # 额外安全检查 before assignment
-                            if asyncio.iscoroutine(new_status):
-                                logger.error(f"ERROR: new_status is still a coroutine: {new_status}")
-                                new_status = TaskStatus.PENDING
-                            
-                            # Use Pydantic's validation by creating a new Task object instead of direct assignment
-                            # This ensures validation is triggered
-                            try:
-                                updated_task = Task(
-                                    id=task.id,
-                                    content=task.content,
-                                    status=new_status,
-                                    section_id=task.section_id
-                                )
-                                # 复制验证后的值 back
-                                task.status = updated_task.status
-                            except Exception as validation_error:
-                                logger.error(f"Pydantic validation failed for task {tid}: {validation_error}")
-                                task.status = TaskStatus.PENDING  # Safe fallback
-                            
-                            logger.debug(f"Successfully updated status for task {tid} to {repr(task.status)}")
-                        except Exception as status_error:
-                            logger.error(f"Error updating status for task {tid}: {status_error}")
-                            raise
-                            
-                    if section_id is not None:
-                        task.section_id = section_id
-                        logger.debug(f"Updated section_id for task {tid}")
-                    
-                    updated_count += 1
-                    
-                except Exception as task_error:
-                    logger.error(f"Error processing task {tid}: {task_error}")
-                    logger.error(f"Task object type: {type(task_map.get(tid))}")
-                    raise
-            
-            await self._save_data(sections, tasks)
-            
-            response_data = self._format_response(sections, tasks)
-            
-            return ToolResult(success=True, output=json.dumps(response_data, indent=2))
+                target_task_ids = list(task_ids)
+
+            # 只写入实际提供的字段；非法的 status 在这里直接报错
+            fields: Dict[str, Any] = {}
+            if content is not None:
+                fields['content'] = content
+            if status is not None:
+                fields['status'] = TaskStatus(status).value
+            if section_id is not None:
+                fields['section_id'] = section_id
+
+            def mutate(sections: List[Section], tasks: List[Task]) -> _Mutation:
+                section_map = {s.id: s for s in sections}
+                task_index = {t.id: i for i, t in enumerate(tasks)}
+
+                # 验证所有 task IDs 是否存在
+                missing_tasks = [tid for tid in target_task_ids if tid not in task_index]
+                if missing_tasks:
+                    return f"Task IDs not found: {missing_tasks}"
+
+                # 验证 section ID 是否提供
+                if section_id and section_id not in section_map:
+                    return f"Section ID '{section_id}' not found"
+
+                # 应用更新（通过 model_copy(update=...) 生成新对象，缓存中的旧对象保持不变）
+                for tid in target_task_ids:
+                    i = task_index[tid]
+                    tasks[i] = tasks[i].model_copy(update={
+                        k: (TaskStatus(v) if k == 'status' else v) for k, v in fields.items()
+                    })
+
+                return lambda version: self.store.update_tasks(self.thread_id, version, target_task_ids, fields)
+
+            return await self._commit(mutate)
             
         except Exception as e:
             logger.error(f"Error updating tasks: {e}")
@@ -745,57 +608,34 @@ class TaskListTool(Tool):
             # Validate confirm parameter for section deletion
             if section_ids and not confirm:
                 return ToolResult(success=False, output="Must set confirm=true to delete sections")
-            
-            sections, tasks = await self._load_data()
-            section_map = {s.id: s for s in sections}
-            task_map = {t.id: t for t in tasks}
-            
-            # Process task deletions
-            deleted_tasks = 0
-            remaining_tasks = tasks.copy()
-            if task_ids:
-                # Normalize task_ids to always be a list
-                if isinstance(task_ids, str):
-                    target_task_ids = [task_ids]
-                else:
-                    target_task_ids = task_ids
-                
+
+            # Normalize ids to always be lists
+            target_task_ids = [task_ids] if isinstance(task_ids, str) else list(task_ids or [])
+            target_section_ids = [section_ids] if isinstance(section_ids, str) else list(section_ids or [])
+
+            def mutate(sections: List[Section], tasks: List[Task]) -> _Mutation:
+                section_map = {s.id: s for s in sections}
+                task_map = {t.id: t for t in tasks}
+
                 # Validate all task IDs exist
                 missing_tasks = [tid for tid in target_task_ids if tid not in task_map]
                 if missing_tasks:
-                    return ToolResult(success=False, output=f"Task IDs not found: {missing_tasks}")
-                
-                # Remove tasks
-                task_id_set = set(target_task_ids)
-                remaining_tasks = [task for task in tasks if task.id not in task_id_set]
-                deleted_tasks = len(tasks) - len(remaining_tasks)
-            
-            # Process section deletions
-            deleted_sections = 0
-            remaining_sections = sections.copy()
-            if section_ids:
-                # Normalize section_ids to always be a list
-                if isinstance(section_ids, str):
-                    target_section_ids = [section_ids]
-                else:
-                    target_section_ids = section_ids
-                
+                    return f"Task IDs not found: {missing_tasks}"
+
                 # Validate all section IDs exist
                 missing_sections = [sid for sid in target_section_ids if sid not in section_map]
                 if missing_sections:
-                    return ToolResult(success=False, output=f"Section IDs not found: {missing_sections}")
-                
-                # Remove sections and their tasks
+                    return f"Section IDs not found: {missing_sections}"
+
+                # Remove tasks, then sections and their tasks
+                task_id_set = set(target_task_ids)
                 section_id_set = set(target_section_ids)
-                remaining_sections = [s for s in sections if s.id not in section_id_set]
-                remaining_tasks = [t for t in remaining_tasks if t.section_id not in section_id_set]
-                deleted_sections = len(sections) - len(remaining_sections)
-            
-            await self._save_data(remaining_sections, remaining_tasks)
-            
-            response_data = self._format_response(remaining_sections, remaining_tasks)
-            
-            return ToolResult(success=True, output=json.dumps(response_data, indent=2))
+                sections[:] = [s for s in sections if s.id not in section_id_set]
+                tasks[:] = [t for t in tasks if t.id not in task_id_set and t.section_id not in section_id_set]
+
+                return lambda version: self.store.delete(self.thread_id, version, target_task_ids, target_section_ids)
+
+            return await self._commit(mutate)
             
         except Exception as e:
             logger.error(f"Error deleting tasks/sections: {e}")
@@ -824,16 +664,14 @@ class TaskListTool(Tool):
         try:
             if not confirm:
                 return ToolResult(success=False, output=" Must set confirm=true to clear all data")
-            
-            # Create completely empty state - no default section
-            sections = []
-            tasks = []
-            
-            await self._save_data(sections, tasks)
-            
-            response_data = self._format_response(sections, tasks)
-            
-            return ToolResult(success=True, output=json.dumps(response_data, indent=2))
+
+            def mutate(sections: List[Section], tasks: List[Task]) -> _Mutation:
+                # Create completely empty state - no default section
+                sections.clear()
+                tasks.clear()
+                return lambda version: self.store.replace(self.thread_id, version, [], [])
+
+            return await self._commit(mutate)
             
         except Exception as e:
             logger.error(f"Error clearing all data: {e}")
@@ -1,11 +1,8 @@
 import json
 import asyncio
-from typing import Dict, Any, List
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.sse import sse_client
-from mcp.client.stdio import stdio_client
-from mcp.client.streamable_http import streamablehttp_client
+from typing import Dict, Any, List, Optional
 from utils.logger import logger
+from mcp_module import get_mcp_session_pool
 from .mcp_connection_manager import MCPConnectionManager
 
 
@@ -40,31 +37,58 @@ class CustomMCPHandler:
             return e
     
     async def _initialize_single_custom_mcp(self, config: Dict[str, Any]):
+        tools_info = await self.discover_custom_mcp(config)
+        if tools_info is not None:
+            self.register_custom_mcp_tools(config, tools_info)
+    
+    async def discover_custom_mcp(self, config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Fetch the tool definitions of one custom MCP without registering them; None if the config is unusable."""
         custom_type = config.get('customType', 'sse')
         server_config = config.get('config', {})
-        enabled_tools = config.get('enabledTools', config.get('enabled_tools', []))
         server_name = config.get('name', 'Unknown')
         
         logger.info(f"Initializing custom MCP: {server_name} (type: {custom_type})")
         
         if custom_type == 'composio':
-            await self._initialize_composio_mcp(server_name, server_config, enabled_tools)
+            return await self._discover_composio_mcp(server_name, server_config)
         elif custom_type == 'pipedream':
-            await self._initialize_pipedream_mcp(server_name, server_config, enabled_tools)
+            return await self._discover_pipedream_mcp(server_name, server_config)
         elif custom_type == 'sse':
-            await self._initialize_sse_mcp(server_name, server_config, enabled_tools)
+            return await self._discover_sse_mcp(server_name, server_config)
         elif custom_type == 'http':
-            await self._initialize_http_mcp(server_name, server_config, enabled_tools)
+            return await self._discover_http_mcp(server_name, server_config)
         elif custom_type == 'json':
-            await self._initialize_json_mcp(server_name, server_config, enabled_tools)
+            return await self._discover_json_mcp(server_name, server_config)
         else:
             logger.error(f"Custom MCP {server_name}: Unsupported type '{custom_type}'")
+            return None
+    
+    def register_custom_mcp_tools(self, config: Dict[str, Any], tools_info: List[Dict[str, Any]]):
+        """Register discovered (or cached) tool definitions, keeping only the enabled ones."""
+        self._register_custom_tools_from_info(
+            tools_info,
+            config.get('name', 'Unknown'),
+            config.get('enabledTools', config.get('enabled_tools', [])),
+            config.get('customType', 'sse'),
+            config.get('config', {})
+        )
+    
+    @staticmethod
+    def _tools_to_info(tools) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": tool.name,
+                "description": tool.description,
+                "input_schema": tool.inputSchema
+            }
+            for tool in tools
+        ]
     
-    async def _initialize_composio_mcp(self, server_name: str, server_config: Dict[str, Any], enabled_tools: List[str]):
+    async def _discover_composio_mcp(self, server_name: str, server_config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
         profile_id = server_config.get('profile_id')
         if not profile_id:
             logger.error(f"Composio MCP {server_name}: Missing profile_id in config")
-            return
+            return None
         
         try:
             from composio_integration.composio_profile_service import ComposioProfileService
@@ -76,19 +100,15 @@ class CustomMCPHandler:
             
             logger.info(f"Resolved Composio profile {profile_id} to MCP URL")
 
-            async with streamablehttp_client(mcp_url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
-                    
-                    self._register_custom_tools(tools, server_name, enabled_tools, 'composio', server_config)
-                    logger.info(f"Registered {len(tools)} tools from Composio MCP {server_name}")
+            tools = await get_mcp_session_pool().list_tools('http', url=mcp_url)
+            logger.info(f"Discovered {len(tools)} tools from Composio MCP {server_name}")
+            return self._tools_to_info(tools)
             
         except Exception as e:
             logger.error(f"Failed to initialize Composio MCP {server_name}: {str(e)}")
+            raise
     
-    async def _initialize_pipedream_mcp(self, server_name: str, server_config: Dict[str, Any], enabled_tools: List[str]):
+    async def _discover_pipedream_mcp(self, server_name: str, server_config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
         app_slug = server_config.get('app_slug')
         if not app_slug and 'headers' in server_config and 'x-pd-app-slug' in server_config['headers']:
             app_slug = server_config['headers']['x-pd-app-slug']
@@ -97,7 +117,7 @@ class CustomMCPHandler:
         external_user_id = await self._resolve_external_user_id(server_config)
         if not external_user_id:
             logger.error(f"Custom MCP {server_name}: Missing external_user_id for Pipedream")
-            return
+            return None
         
         server_config['external_user_id'] = external_user_id
         oauth_app_id = server_config.get('oauth_app_id')
@@ -107,8 +127,6 @@ class CustomMCPHandler:
         try:
             import os
             from pipedream import connection_service
-            from mcp import ClientSession
-            from mcp.client.streamable_http import streamablehttp_client
             
             access_token = await connection_service._ensure_access_token()
             
@@ -131,53 +149,36 @@ class CustomMCPHandler:
 
             url = "https://remote.mcp.pipedream.net"
             
-            async with streamablehttp_client(url, headers=headers) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
-                    
-                    self._register_custom_tools(tools, server_name, enabled_tools, 'pipedream', server_config)
+            tools = await get_mcp_session_pool().list_tools('http', url=url, headers=headers)
+            return self._tools_to_info(tools)
                     
         except Exception as e:
             logger.error(f"Pipedream MCP {server_name}: Connection failed - {str(e)}")
             raise
     
-    async def _initialize_sse_mcp(self, server_name: str, server_config: Dict[str, Any], enabled_tools: List[str]):
+    async def _discover_sse_mcp(self, server_name: str, server_config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
         if 'url' not in server_config:
             logger.error(f"Custom MCP {server_name}: Missing 'url' in config")
-            return
+            return None
         
         server_info = await self.connection_manager.connect_sse_server(server_name, server_config)
-        if server_info.get('status') == 'connected':
-            tools_info = server_info.get('tools', [])
-            self._register_custom_tools_from_info(tools_info, server_name, enabled_tools, 'sse', server_config)
-        else:
-            logger.error(f"Failed to connect to custom MCP {server_name}")
+        return server_info.get('tools', [])
     
-    async def _initialize_http_mcp(self, server_name: str, server_config: Dict[str, Any], enabled_tools: List[str]):
+    async def _discover_http_mcp(self, server_name: str, server_config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
         if 'url' not in server_config:
             logger.error(f"Custom MCP {server_name}: Missing 'url' in config")
-            return
+            return None
         
         server_info = await self.connection_manager.connect_http_server(server_name, server_config)
-        if server_info.get('status') == 'connected':
-            tools_info = server_info.get('tools', [])
-            self._register_custom_tools_from_info(tools_info, server_name, enabled_tools, 'http', server_config)
-        else:
-            logger.error(f"Failed to connect to custom MCP {server_name}")
+        return server_info.get('tools', [])
     
-    async def _initialize_json_mcp(self, server_name: str, server_config: Dict[str, Any], enabled_tools: List[str]):
+    async def _discover_json_mcp(self, server_name: str, server_config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
         if 'command' not in server_config:
             logger.error(f"Custom MCP {server_name}: Missing 'command' in config")
-            return
+            return None
         
         server_info = await self.connection_manager.connect_stdio_server(server_name, server_config)
-        if server_info.get('status') == 'connected':
-            tools_info = server_info.get('tools', [])
-            self._register_custom_tools_from_info(tools_info, server_name, enabled_tools, 'json', server_config)
-        else:
-            logger.error(f"Failed to connect to custom MCP {server_name}")
+        return server_info.get('tools', [])
     
     async def _resolve_external_user_id(self, server_config: Dict[str, Any]) -> str:
         profile_id = server_config.get('profile_id')
@@ -217,28 +218,6 @@ class CustomMCPHandler:
             logger.error(f"Failed to resolve profile {profile_id}: {str(e)}")
             return None
     
-    def _register_custom_tools(self, tools, server_name: str, enabled_tools: List[str], custom_type: str, server_config: Dict[str, Any]):
-        tools_registered = 0
-        
-        for tool in tools:
-            tool_name_from_server = tool.name
-            if not enabled_tools or tool_name_from_server in enabled_tools:
-                tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool_name_from_server}"
-                self.custom_tools[tool_name] = {
-                    'name': tool_name,
-                    'description': tool.description,
-                    'parameters': tool.inputSchema,
-                    'server': server_name,
-                    'original_name': tool_name_from_server,
-                    'is_custom': True,
-                    'custom_type': custom_type,
-                    'custom_config': server_config
-                }
-                tools_registered += 1
-                logger.debug(f"Registered custom tool: {tool_name}")
-        
-        logger.info(f"Successfully initialized custom MCP {server_name} with {tools_registered} tools")
-    
     def _register_custom_tools_from_info(self, tools_info: List[Dict[str, Any]], server_name: str, enabled_tools: List[str], custom_type: str, server_config: Dict[str, Any]):
         tools_registered = 0
         
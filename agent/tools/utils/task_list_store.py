@@ -0,0 +1,155 @@
+"""
+Row-per-task storage for TaskListTool.
+
+表结构（migrations/fufanmanus.sql）：
+    task_lists          每个线程一行，version 为乐观锁版本号
+    task_list_sections  每个 section 一行
+    task_list_tasks     每个任务一行
+
+task_lists 外键指向 threads，分组和任务外键指向 task_lists，均为 ON DELETE CASCADE：删除线程或项目时清单随之删除。
+
+每次写入都在一个事务里先执行 ``UPDATE task_lists SET version = version + 1 WHERE version = $expected``，
+版本号不匹配说明其他调用已经修改过清单，抛出 TaskListConflictError，由调用方重新加载后重试。
+"""
+
+from typing import Any, Dict, List, Optional
+
+from services.postgresql import mark_read_your_writes
+from utils.logger import logger
+
+
+class TaskListConflictError(Exception):
+    """The task list was modified since it was loaded."""
+
+
+class TaskListStore:
+    def __init__(self, db):
+        self.db = db
+
+    async def _pool(self):
+        client = await self.db.client
+        return client.pool
+
+    async def get_version(self, thread_id: str) -> int:
+        """Current version of the thread's task list; 0 if it has no task list row."""
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            version = await conn.fetchval("SELECT version FROM task_lists WHERE thread_id = $1", thread_id)
+        return version or 0
+
+    async def load(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Return {'version', 'sections', 'tasks'} ordered by position, or None if the thread has no task list row."""
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            version = await conn.fetchval("SELECT version FROM task_lists WHERE thread_id = $1", thread_id)
+            if version is None:
+                return None
+            sections = await conn.fetch(
+                "SELECT section_id AS id, title FROM task_list_sections WHERE thread_id = $1 ORDER BY position",
+                thread_id,
+            )
+            tasks = await conn.fetch(
+                "SELECT task_id AS id, content, status, section_id FROM task_list_tasks WHERE thread_id = $1 ORDER BY position",
+                thread_id,
+            )
+        return {
+            "version": version,
+            "sections": [dict(row) for row in sections],
+            "tasks": [dict(row) for row in tasks],
+        }
+
+    async def _bump_version(self, conn, thread_id: str, expected_version: int) -> int:
+        if expected_version == 0:
+            version = await conn.fetchval(
+                "INSERT INTO task_lists (thread_id, version) VALUES ($1, 1) ON CONFLICT (thread_id) DO NOTHING RETURNING version",
+                thread_id,
+            )
+        else:
+            version = await conn.fetchval(
+                "UPDATE task_lists SET version = version + 1, updated_at = now() WHERE thread_id = $1 AND version = $2 RETURNING version",
+                thread_id, expected_version,
+            )
+        if version is None:
+            raise TaskListConflictError(f"Task list for thread {thread_id} changed since version {expected_version}")
+        return version
+
+    async def _insert_rows(self, conn, thread_id: str, sections: List[Dict[str, Any]], tasks: List[Dict[str, Any]]):
+        # 新行排在已有行之后；版本号更新已经锁住了 task_lists 行，MAX(position) 不会被并发写入改变
+        if sections:
+            base = await conn.fetchval(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM task_list_sections WHERE thread_id = $1", thread_id
+            )
+            await conn.executemany(
+                "INSERT INTO task_list_sections (thread_id, section_id, title, position) VALUES ($1, $2, $3, $4)",
+                [(thread_id, s["id"], s["title"], base + i) for i, s in enumerate(sections)],
+            )
+        if tasks:
+            base = await conn.fetchval(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM task_list_tasks WHERE thread_id = $1", thread_id
+            )
+            await conn.executemany(
+                "INSERT INTO task_list_tasks (thread_id, task_id, section_id, content, status, position) VALUES ($1, $2, $3, $4, $5, $6)",
+                [(thread_id, t["id"], t["section_id"], t["content"], t["status"], base + i) for i, t in enumerate(tasks)],
+            )
+
+    async def add(self, thread_id: str, expected_version: int, sections: List[Dict[str, Any]], tasks: List[Dict[str, Any]]) -> int:
+        """Append new sections/tasks and return the new version."""
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                version = await self._bump_version(conn, thread_id, expected_version)
+                await self._insert_rows(conn, thread_id, sections, tasks)
+        mark_read_your_writes()
+        return version
+
+    async def update_tasks(self, thread_id: str, expected_version: int, task_ids: List[str], fields: Dict[str, Any]) -> int:
+        """Apply the same field changes to the given tasks with one UPDATE statement."""
+        columns = [column for column in ("content", "status", "section_id") if column in fields]
+        assignments = ", ".join(f"{column} = ${i + 3}" for i, column in enumerate(columns))
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                version = await self._bump_version(conn, thread_id, expected_version)
+                if columns:
+                    await conn.execute(
+                        f"UPDATE task_list_tasks SET {assignments}, updated_at = now() WHERE thread_id = $1 AND task_id = ANY($2::varchar[])",
+                        thread_id, task_ids, *[fields[column] for column in columns],
+                    )
+        mark_read_your_writes()
+        return version
+
+    async def delete(self, thread_id: str, expected_version: int, task_ids: List[str], section_ids: List[str]) -> int:
+        """Delete tasks by id and sections (with their tasks) by id."""
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                version = await self._bump_version(conn, thread_id, expected_version)
+                if task_ids:
+                    await conn.execute(
+                        "DELETE FROM task_list_tasks WHERE thread_id = $1 AND task_id = ANY($2::varchar[])",
+                        thread_id, task_ids,
+                    )
+                if section_ids:
+                    await conn.execute(
+                        "DELETE FROM task_list_tasks WHERE thread_id = $1 AND section_id = ANY($2::varchar[])",
+                        thread_id, section_ids,
+                    )
+                    await conn.execute(
+                        "DELETE FROM task_list_sections WHERE thread_id = $1 AND section_id = ANY($2::varchar[])",
+                        thread_id, section_ids,
+                    )
+        mark_read_your_writes()
+        return version
+
+    async def replace(self, thread_id: str, expected_version: int, sections: List[Dict[str, Any]], tasks: List[Dict[str, Any]]) -> int:
+        """Replace the whole list; used by clear_all and the one-time import of legacy task_list messages."""
+        pool = await self._pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                version = await self._bump_version(conn, thread_id, expected_version)
+                await conn.execute("DELETE FROM task_list_tasks WHERE thread_id = $1", thread_id)
+                await conn.execute("DELETE FROM task_list_sections WHERE thread_id = $1", thread_id)
+                await self._insert_rows(conn, thread_id, sections, tasks)
+        mark_read_your_writes()
+        logger.debug(f"Replaced task list for thread {thread_id}: {len(sections)} sections, {len(tasks)} tasks")
+        return version
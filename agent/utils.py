@@ -5,7 +5,7 @@ from utils.cache import Cache
 from utils.logger import logger
 from utils.config import config
 from services import redis
-from run_agent_background import update_agent_run_status
+from run_agent_background import update_agent_run_status, mark_run_stop_requested
 
 
 async def _cleanup_redis_response_list(agent_run_id: str):
@@ -51,6 +51,8 @@ async def stop_agent_run(db, agent_run_id: str, error_message: Optional[str] = N
 
     global_control_channel = f"agent_run:{agent_run_id}:control"
     try:
+        # 先写停止标记再发布：尚未完成订阅的运行在注册时也能看到这次停止请求
+        await mark_run_stop_requested(agent_run_id)
         await redis.publish(global_control_channel, "STOP")
         logger.debug(f"Published STOP signal to global channel {global_control_channel}")
     except Exception as e:
@@ -54,6 +54,35 @@ class AgentVersion:
         }
 
 
+def summarize_tools(configured_mcps: List[Dict[str, Any]], agentpress_tools: Dict[str, Any]) -> Dict[str, Any]:
+    """Tool summary columns denormalized onto agents so GET /agents can filter and sort in SQL.
+
+    tool_names 与 /agents 的 tools 参数取值一致：mcp:{名称} 和已启用的 agentpress:{工具名}。
+    """
+    configured_mcps = configured_mcps or []
+    mcp_names = [
+        f"mcp:{mcp['name']}" for mcp in configured_mcps
+        if isinstance(mcp, dict) and mcp.get('name')
+    ]
+    enabled_tools = [
+        f"agentpress:{tool_name}" for tool_name, tool_data in (agentpress_tools or {}).items()
+        if tool_data and isinstance(tool_data, dict) and tool_data.get('enabled', False)
+    ]
+    return {
+        'has_mcp_tools': len(configured_mcps) > 0,
+        'has_agentpress_tools': len(enabled_tools) > 0,
+        'tool_names': mcp_names + enabled_tools,
+        'tools_count': len(configured_mcps) + len(enabled_tools),
+    }
+
+
+def summarize_version_config(config: Any) -> Dict[str, Any]:
+    """summarize_tools for a raw agent_versions.config value (JSON text or dict)."""
+    config = json.loads(config) if isinstance(config, str) else (config or {})
+    tools = config.get('tools', {})
+    return summarize_tools(tools.get('mcp', []), tools.get('agentpress', {}))
+
+
 class VersionServiceError(Exception):
     pass
 
@@ -135,12 +164,15 @@ class VersionService:
         
         return result.count or 0
     
-    async def _update_agent_current_version(self, agent_id: str, version_id: str, version_count: int):
+    async def _update_agent_current_version(self, agent_id: str, version_id: str, version_count: int,
+                                            tool_summary: Dict[str, Any]):
         client = await self._get_client()
         
+        # 工具摘要随当前版本一起写入，保证 agents 上的筛选/排序列与当前版本一致
         data = {
             'current_version_id': version_id,
-            'version_count': version_count
+            'version_count': version_count,
+            **tool_summary
         }
         
         result = await client.table('agents').eq('agent_id', agent_id).update(data)
@@ -284,7 +316,10 @@ class VersionService:
             raise Exception("Failed to create version")
         
         version_count = await self._count_versions(agent_id)
-        await self._update_agent_current_version(agent_id, version.version_id, version_count)
+        await self._update_agent_current_version(
+            agent_id, version.version_id, version_count,
+            summarize_tools(version.configured_mcps, version.agentpress_tools)
+        )
         
         logger.info(f"Created version {version.version_name} for agent {agent_id}")
         return version
@@ -350,6 +385,7 @@ class VersionService:
             raise VersionNotFoundError(f"Version {version_id} not found")
         
         version = version_result.data[0]
+        activated = self._version_from_db_row(version)
         
         await client.table('agent_versions').eq('agent_id', agent_id).eq('is_active', True).update({
             'is_active': False,
@@ -362,7 +398,10 @@ class VersionService:
         })
         
         version_count = await self._count_versions(agent_id)
-        await self._update_agent_current_version(agent_id, version_id, version_count)
+        await self._update_agent_current_version(
+            agent_id, version_id, version_count,
+            summarize_tools(activated.configured_mcps, activated.agentpress_tools)
+        )
         
         logger.info(f"Activated version {version['version_name']} for agent {agent_id}")
     
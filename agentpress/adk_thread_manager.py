@@ -9,7 +9,7 @@ from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Liter
 from services.postgresql import DBConnection
 from utils.logger import logger
 from agentpress.tool_registry import ToolRegistry
-from agentpress.context_manager import ContextManager
+from agentpress.context_manager import ContextManager, TEMPORARY_CONTEXT_TYPES, record_context_message
 from agentpress.response_processor import ResponseProcessor, ProcessorConfig
 from agentpress.tool import Tool
 
@@ -75,6 +75,8 @@ class ADKThreadManager:
             agent_config=self.agent_config
         )
         self.context_manager = ContextManager()
+        # thread_id -> {'cursor': (timestamp, id), 'messages': [...]}，增量加载消息用
+        self._llm_message_cache: Dict[str, Dict[str, Any]] = {}
         
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
@@ -105,6 +107,9 @@ class ADKThreadManager:
         This method fetches messages from the events table and formats them
         to match the original messages table format for downstream compatibility.
 
+        已解析的消息按线程缓存，并记录最后一条事件的 (timestamp, id) 游标；
+        后续轮次只按键集分页拉取游标之后的新事件并追加到缓存列表。
+
         Args:
             thread_id: The ID of the thread to get messages for.
 
@@ -112,102 +117,118 @@ class ADKThreadManager:
             List of message objects in the same format as original messages table.
         """
         client = await self.db.client
+
+        cached = self._llm_message_cache.get(thread_id)
+        cursor = cached['cursor'] if cached else None
+
         try:
-            # 获取事件，分批获取，避免数据库过载
-            all_events = []
+            # 按 (timestamp, id) 键集分页获取游标之后的事件，避免 OFFSET 扫描
+            new_events = []
             batch_size = 1000
-            offset = 0
-            
+
             while True:
                 # 从 events 表获取消息，按时间戳排序
-                result = await client.table('events').select(
+                query = client.table('events').select(
                     'id, author, content, timestamp, session_id, user_id, app_name, invocation_id'
                 ).eq('session_id', thread_id).in_(
                     'author', ['user', 'assistant']
-                ).order('timestamp').range(offset, offset + batch_size - 1).execute()
-                
+                )
+                if cursor:
+                    query = query.after(['timestamp', 'id'], list(cursor))
+                result = await query.order('timestamp').order('id').limit(batch_size).execute()
+
                 if not result.data or len(result.data) == 0:
                     break
-                    
-                all_events.extend(result.data)
-                
+
+                new_events.extend(result.data)
+                last_event = result.data[-1]
+                cursor = (last_event.get('timestamp'), last_event.get('id'))
+
                 # 如果获取的记录数小于 batch_size，则表示已经到达末尾
                 if len(result.data) < batch_size:
                     break
-                    
-                offset += batch_size
-            
-            # 使用 all_events 而不是 result.data 
-            result_data = all_events
-
-            # 解析返回的数据，并转换为原始消息格式
-            if not result_data:
-                return []
 
-            # 将事件转换为原始消息格式，用于下游兼容
-            messages = []
-            for event in result_data:
-                try:
-                    # 确保event是字典格式
-                    if hasattr(event, '__dict__'):
-                        event = dict(event)
-                    
-                    # 解析事件内容
-                    content = event.get('content', {})
-                    if isinstance(content, str):
-                        try:
-                            content = json.loads(content)
-                        except json.JSONDecodeError:
-                            # 如果不是JSON，当作纯文本处理
-                            content = {"content": content}
-                    
-                    # 构建与原始 messages 表格式兼容的消息对象
-                    message = {
-                        "role": event.get('author', 'user'),
-                        "message_id": event.get('id'),
-                        "timestamp": event.get('timestamp'),
-                        "app_name": event.get('app_name'),
-                        "user_id": event.get('user_id'),
-                        "session_id": event.get('session_id'),
-                        "invocation_id": event.get('invocation_id')
-                    }
-                    
-                    # 处理timestamp字段，确保datetime对象被转换为字符串
-                    if message.get('timestamp') and hasattr(message['timestamp'], 'isoformat'):
-                        message['timestamp'] = message['timestamp'].isoformat()
-                    
-                    # 处理内容格式 - 兼容原始格式和ADK格式
-                    if isinstance(content, dict):
-                        # 处理ADK格式 {"role": "user", "parts": [{"text": "..."}]}
-                        if 'parts' in content and isinstance(content['parts'], list):
-                            # 提取ADK parts中的文本内容
-                            text_parts = []
-                            for part in content['parts']:
-                                if isinstance(part, dict) and 'text' in part:
-                                    text_parts.append(part['text'])
-                            message["content"] = ' '.join(text_parts).strip()
-                        # 如果存在：处理原始格式 {"role": "user", "content": "..."}
-                        elif 'content' in content:
-                            message["content"] = content['content']
-                        else:
-                            # 如果都没有，将整个对象转为字符串（向后兼容）
-                            message["content"] = json.dumps(content)
-                    else:
-                        message["content"] = str(content)
-                    
+            # 将新事件转换为原始消息格式，追加到已缓存的消息列表
+            messages = cached['messages'] if cached else []
+            for event in new_events:
+                message = self._event_to_llm_message(event)
+                if message is not None:
                     messages.append(message)
-                    
-                except Exception as e:
-                    logger.error(f"Failed to parse event {event.get('id')}: {e}")
-                    continue
 
-            logger.debug(f"Retrieved {len(messages)} messages from events table for thread {thread_id}")
-            return messages
+            if cursor:
+                self._llm_message_cache[thread_id] = {'cursor': cursor, 'messages': messages}
+
+            logger.debug(f"Retrieved {len(messages)} messages ({len(new_events)} new) from events table for thread {thread_id}")
+            # 返回逐条浅拷贝：上下文压缩会原地改写 msg["content"]，不能污染缓存
+            return [dict(message) for message in messages]
 
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
             return []
 
+    def invalidate_llm_messages(self, thread_id: Optional[str] = None):
+        """清除线程（或全部线程）的消息缓存，下次访问时全量重新加载"""
+        if thread_id is None:
+            self._llm_message_cache.clear()
+        else:
+            self._llm_message_cache.pop(thread_id, None)
+
+    def _event_to_llm_message(self, event: Any) -> Optional[Dict[str, Any]]:
+        """将单条 events 记录转换为原始消息格式，解析失败时返回 None"""
+        try:
+            # 确保event是字典格式
+            if hasattr(event, '__dict__'):
+                event = dict(event)
+
+            # 解析事件内容
+            content = event.get('content', {})
+            if isinstance(content, str):
+                try:
+                    content = json.loads(content)
+                except json.JSONDecodeError:
+                    # 如果不是JSON，当作纯文本处理
+                    content = {"content": content}
+
+            # 构建与原始 messages 表格式兼容的消息对象
+            message = {
+                "role": event.get('author', 'user'),
+                "message_id": event.get('id'),
+                "timestamp": event.get('timestamp'),
+                "app_name": event.get('app_name'),
+                "user_id": event.get('user_id'),
+                "session_id": event.get('session_id'),
+                "invocation_id": event.get('invocation_id')
+            }
+
+            # 处理timestamp字段，确保datetime对象被转换为字符串
+            if message.get('timestamp') and hasattr(message['timestamp'], 'isoformat'):
+                message['timestamp'] = message['timestamp'].isoformat()
+
+            # 处理内容格式 - 兼容原始格式和ADK格式
+            if isinstance(content, dict):
+                # 处理ADK格式 {"role": "user", "parts": [{"text": "..."}]}
+                if 'parts' in content and isinstance(content['parts'], list):
+                    # 提取ADK parts中的文本内容
+                    text_parts = []
+                    for part in content['parts']:
+                        if isinstance(part, dict) and 'text' in part:
+                            text_parts.append(part['text'])
+                    message["content"] = ' '.join(text_parts).strip()
+                # 如果存在：处理原始格式 {"role": "user", "content": "..."}
+                elif 'content' in content:
+                    message["content"] = content['content']
+                else:
+                    # 如果都没有，将整个对象转为字符串（向后兼容）
+                    message["content"] = json.dumps(content)
+            else:
+                message["content"] = str(content)
+
+            return message
+
+        except Exception as e:
+            logger.error(f"Failed to parse event {event.get('id')}: {e}")
+            return None
+
     async def run_thread(
         self,
         thread_id: str,
@@ -608,14 +629,22 @@ class ADKThreadManager:
 
         try:
             # 插入消息
-            result = await client.table('messages').insert(data_to_insert)
+            if type == 'assistant_response_end':
+                # 消息写入和月度用量账本累加在同一事务里完成
+                from services.billing import insert_usage_message
+                rows = await insert_usage_message(thread_id, data_to_insert, content)
+            else:
+                rows = (await client.table('messages').insert(data_to_insert)).data
             logger.info(f"Successfully added message to thread {thread_id}")
 
-            if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
-                return result.data[0]
+            if type in TEMPORARY_CONTEXT_TYPES and rows:
+                record_context_message(thread_id, type, rows[0].get('message_id'))
+
+            if rows and len(rows) > 0 and isinstance(rows[0], dict) and 'message_id' in rows[0]:
+                return rows[0]
             
             else:
-                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
+                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {rows}")
                 return None
         except Exception as e:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
@@ -5,8 +5,10 @@ This module handles token counting and thread summarization to prevent
 reaching the context window limitations of LLM models.
 """
 
+import hashlib
 import json
-from typing import List, Dict, Any, Optional, Union
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Union
 
 from litellm.utils import token_counter
 from services.postgresql import DBConnection
@@ -14,6 +16,64 @@ from utils.logger import logger
 
 DEFAULT_TOKEN_THRESHOLD = 120000
 
+# 单条消息 token 数的进程级缓存：键为 (模型, message_id, 内容哈希)，内容被压缩后哈希变化自动失效
+MESSAGE_TOKEN_CACHE_SIZE = 20000
+_message_token_cache: "OrderedDict[Tuple[str, Optional[str], str], int]" = OrderedDict()
+
+
+# 临时上下文消息（浏览器状态、图像）的写入记录：thread_id -> {type: 最新 message_id}
+# 由 add_message 在本进程内写入，MessageManager 据此判断是否需要重新查询
+TEMPORARY_CONTEXT_TYPES = ('browser_state', 'image_context')
+MAX_TRACKED_CONTEXT_THREADS = 1000
+_context_message_writes: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+
+
+def record_context_message(thread_id: str, message_type: str, message_id: Optional[str]):
+    """Remember the newest browser_state / image_context message written for a thread."""
+    if message_type not in TEMPORARY_CONTEXT_TYPES or not message_id:
+        return
+    writes = _context_message_writes.setdefault(thread_id, {})
+    writes[message_type] = str(message_id)
+    _context_message_writes.move_to_end(thread_id)
+    while len(_context_message_writes) > MAX_TRACKED_CONTEXT_THREADS:
+        _context_message_writes.popitem(last=False)
+
+
+def get_context_message_writes(thread_id: str) -> Dict[str, str]:
+    return _context_message_writes.get(thread_id, {})
+
+
+def _message_content_hash(msg: Dict[str, Any]) -> str:
+    """对参与 token 计数的字段求哈希（比分词便宜得多）"""
+    counted = {key: msg.get(key) for key in ('role', 'content', 'name', 'tool_calls', 'tool_call_id') if key in msg}
+    payload = json.dumps(counted, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def count_message_tokens(msg: Dict[str, Any], llm_model: str) -> int:
+    """Token count of a single message, memoized by message_id and content hash."""
+    if not isinstance(msg, dict):
+        return token_counter(model=llm_model, messages=[msg])
+    key = (llm_model, msg.get('message_id'), _message_content_hash(msg))
+    count = _message_token_cache.get(key)
+    if count is not None:
+        _message_token_cache.move_to_end(key)
+        return count
+    count = token_counter(model=llm_model, messages=[msg])
+    _message_token_cache[key] = count
+    if len(_message_token_cache) > MESSAGE_TOKEN_CACHE_SIZE:
+        _message_token_cache.popitem(last=False)
+    return count
+
+
+def count_tokens(messages: List[Dict[str, Any]], llm_model: str) -> int:
+    """Token count of a message list as the sum of memoized per-message counts.
+
+    每条消息单独计数会重复计入回复前缀的固定开销，结果比整表计数略大，用于阈值判断是偏保守的。
+    """
+    return sum(count_message_tokens(msg, llm_model) for msg in messages)
+
+
 class ContextManager:
     """Manages thread context including token counting and summarization."""
     
@@ -107,21 +167,21 @@ class ContextManager:
             else:
                 return msg_content
   
-    def compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
-        """Compress the tool result messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+    def _compress_matching_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int, predicate) -> List[Dict[str, Any]]:
+        """Compress the messages matching ``predicate`` except the most recent one."""
+        uncompressed_total_token_count = count_tokens(messages, llm_model)
         max_tokens_value = max_tokens or (100 * 1000)
 
         if uncompressed_total_token_count > max_tokens_value:
-            _i = 0  # Count the number of ToolResult messages
+            _i = 0  # Count the number of matching messages
             for msg in reversed(messages):  # Start from the end and work backwards
                 if not isinstance(msg, dict):
                     continue  # Skip non-dict messages
-                if self.is_tool_result_message(msg):  # Only compress ToolResult messages
-                    _i += 1  # Count the number of ToolResult messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
+                if predicate(msg):  # Only compress matching messages
+                    _i += 1  # Count the number of matching messages
+                    msg_token_count = count_message_tokens(msg, llm_model)  # Count the number of tokens in the message
                     if msg_token_count > token_threshold:  # If the message is too long
-                        if _i > 1:  # If this is not the most recent ToolResult message
+                        if _i > 1:  # If this is not the most recent matching message
                             message_id = msg.get('message_id')  # Get the message_id
                             if message_id:
                                 msg["content"] = self.compress_message(msg["content"], message_id, token_threshold * 3)
@@ -131,54 +191,17 @@ class ContextManager:
                             msg["content"] = self.safe_truncate(msg["content"], int(max_tokens_value * 2))
         return messages
 
+    def compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
+        """Compress the tool result messages except the most recent one."""
+        return self._compress_matching_messages(messages, llm_model, max_tokens, token_threshold, self.is_tool_result_message)
+
     def compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the user messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-        max_tokens_value = max_tokens or (100 * 1000)
-
-        if uncompressed_total_token_count > max_tokens_value:
-            _i = 0  # Count the number of User messages
-            for msg in reversed(messages):  # Start from the end and work backwards
-                if not isinstance(msg, dict):
-                    continue  # Skip non-dict messages
-                if msg.get('role') == 'user':  # Only compress User messages
-                    _i += 1  # Count the number of User messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
-                    if msg_token_count > token_threshold:  # If the message is too long
-                        if _i > 1:  # If this is not the most recent User message
-                            message_id = msg.get('message_id')  # Get the message_id
-                            if message_id:
-                                msg["content"] = self.compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self.safe_truncate(msg["content"], int(max_tokens_value * 2))
-        return messages
+        return self._compress_matching_messages(messages, llm_model, max_tokens, token_threshold, lambda msg: msg.get('role') == 'user')
 
     def compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int = 1000) -> List[Dict[str, Any]]:
         """Compress the assistant messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-        max_tokens_value = max_tokens or (100 * 1000)
-        
-        if uncompressed_total_token_count > max_tokens_value:
-            _i = 0  # Count the number of Assistant messages
-            for msg in reversed(messages):  # Start from the end and work backwards
-                if not isinstance(msg, dict):
-                    continue  # Skip non-dict messages
-                if msg.get('role') == 'assistant':  # Only compress Assistant messages
-                    _i += 1  # Count the number of Assistant messages
-                    msg_token_count = token_counter(messages=[msg])  # Count the number of tokens in the message
-                    if msg_token_count > token_threshold:  # If the message is too long
-                        if _i > 1:  # If this is not the most recent Assistant message
-                            message_id = msg.get('message_id')  # Get the message_id
-                            if message_id:
-                                msg["content"] = self.compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self.safe_truncate(msg["content"], int(max_tokens_value * 2))
-                            
-        return messages
+        return self._compress_matching_messages(messages, llm_model, max_tokens, token_threshold, lambda msg: msg.get('role') == 'assistant')
 
     def remove_meta_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Remove meta messages from the messages, but preserve ADK metadata fields."""
@@ -250,13 +273,14 @@ class ContextManager:
         result = messages
         # result = self.remove_meta_messages(result)
 
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=result)
+        # 单条消息的 token 数有缓存，这里和每一轮递归只对内容变化过的消息重新分词
+        uncompressed_total_token_count = count_tokens(result, llm_model)
 
         result = self.compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
         result = self.compress_user_messages(result, llm_model, max_tokens, token_threshold)
         result = self.compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
 
-        compressed_token_count = token_counter(model=llm_model, messages=result)
+        compressed_token_count = count_tokens(result, llm_model)
 
         logger.info(f"compress_messages: {uncompressed_total_token_count} -> {compressed_token_count}")  # Log the token compression for debugging later
 
@@ -294,16 +318,20 @@ class ContextManager:
         result = messages
         result = self.remove_meta_messages(result)
 
-        # Early exit if no compression needed
-        initial_token_count = token_counter(model=llm_model, messages=result)
+        # 每条消息只计数一次（有缓存），之后删除消息时直接减去其 token 数，不再反复对整表分词
+        token_counts = [count_message_tokens(msg, llm_model) for msg in result]
+        initial_token_count = sum(token_counts)
         max_allowed_tokens = max_tokens or (100 * 1000)
         
+        # Early exit if no compression needed
         if initial_token_count <= max_allowed_tokens:
             return result
 
         # Separate system message (assumed to be first) from conversation messages
-        system_message = messages[0] if messages and isinstance(messages[0], dict) and messages[0].get('role') == 'system' else None
-        conversation_messages = result[1:] if system_message else result
+        system_message = result[0] if messages and isinstance(messages[0], dict) and messages[0].get('role') == 'system' else None
+        offset = 1 if system_message else 0
+        # 对话消息用原始下标表示，删除时按下标扣减 token 数
+        kept = list(range(offset, len(result)))
         
         safety_limit = 500
         current_token_count = initial_token_count
@@ -311,34 +339,34 @@ class ContextManager:
         while current_token_count > max_allowed_tokens and safety_limit > 0:
             safety_limit -= 1
             
-            if len(conversation_messages) <= min_messages_to_keep:
-                logger.warning(f"Cannot compress further: only {len(conversation_messages)} messages remain (min: {min_messages_to_keep})")
+            if len(kept) <= min_messages_to_keep:
+                logger.warning(f"Cannot compress further: only {len(kept)} messages remain (min: {min_messages_to_keep})")
                 break
 
             # Calculate removal strategy based on current message count
-            if len(conversation_messages) > (removal_batch_size * 2):
+            if len(kept) > (removal_batch_size * 2):
                 # Remove from middle, keeping recent and early context
-                middle_start = len(conversation_messages) // 2 - (removal_batch_size // 2)
+                middle_start = len(kept) // 2 - (removal_batch_size // 2)
                 middle_end = middle_start + removal_batch_size
-                conversation_messages = conversation_messages[:middle_start] + conversation_messages[middle_end:]
+                removed = kept[middle_start:middle_end]
+                kept = kept[:middle_start] + kept[middle_end:]
             else:
                 # Remove from earlier messages, preserving recent context
-                messages_to_remove = min(removal_batch_size, len(conversation_messages) // 2)
+                messages_to_remove = min(removal_batch_size, len(kept) // 2)
                 if messages_to_remove > 0:
-                    conversation_messages = conversation_messages[messages_to_remove:]
+                    removed = kept[:messages_to_remove]
+                    kept = kept[messages_to_remove:]
                 else:
                     # Can't remove any more messages
                     break
 
-            # Recalculate token count
-            messages_to_count = ([system_message] + conversation_messages) if system_message else conversation_messages
-            current_token_count = token_counter(model=llm_model, messages=messages_to_count)
+            current_token_count -= sum(token_counts[i] for i in removed)
 
         # Prepare final result
+        conversation_messages = [result[i] for i in kept]
         final_messages = ([system_message] + conversation_messages) if system_message else conversation_messages
-        final_token_count = token_counter(model=llm_model, messages=final_messages)
         
-        logger.info(f"compress_messages_by_omitting_messages: {initial_token_count} -> {final_token_count} tokens ({len(messages)} -> {len(final_messages)} messages)")
+        logger.info(f"compress_messages_by_omitting_messages: {initial_token_count} -> {current_token_count} tokens ({len(messages)} -> {len(final_messages)} messages)")
             
         return final_messages
     
@@ -351,4 +379,109 @@ class ContextManager:
         keep_start = max_messages // 2
         keep_end = max_messages - keep_start
         
-        return messages[:keep_start] + messages[-keep_end:] 
\ No newline at end of file
+        return messages[:keep_start] + messages[-keep_end:] 
+
+# ---- 摘要检查点压缩 ----
+# 会话事件的 token 数超过 CONTEXT_COMPACTION_TOKEN_BUDGET 时，把尾部之外的事件（连同上一个检查点）
+# 总结成一个新的检查点事件写入 events 表；之后的轮次只加载 检查点 + 尾部。
+
+SUMMARY_EVENT_TEXT_LIMIT = 2000
+
+SUMMARY_SYSTEM_PROMPT = """You are compacting the history of a conversation between a user and an AI agent.
+Write a concise but complete summary that lets the agent continue the work without the original messages:
+- the user's goals, requirements and preferences;
+- decisions made, facts learned and important tool results (file paths, URLs, IDs, numbers);
+- the current state of the task and what remains to be done.
+If a previous summary is included, merge it into the new one. Reply with the summary only."""
+
+
+def _event_to_text(event: Any, limit: Optional[int] = None) -> str:
+    """把 ADK 事件渲染成纯文本，函数调用/结果也一并展开"""
+    content = getattr(event, 'content', None)
+    parts = getattr(content, 'parts', None) or []
+    texts = []
+    for part in parts:
+        text = getattr(part, 'text', None)
+        function_call = getattr(part, 'function_call', None)
+        function_response = getattr(part, 'function_response', None)
+        if text:
+            texts.append(text)
+        elif function_call is not None:
+            args = json.dumps(getattr(function_call, 'args', None) or {}, ensure_ascii=False, default=str)
+            texts.append(f"[tool call {function_call.name}] {args}")
+        elif function_response is not None:
+            response = json.dumps(getattr(function_response, 'response', None) or {}, ensure_ascii=False, default=str)
+            texts.append(f"[tool result {function_response.name}] {response}")
+    text = '\n'.join(texts)
+    if limit and len(text) > limit:
+        text = text[:limit] + "... (truncated)"
+    return text
+
+
+def _event_to_counting_message(event: Any) -> Dict[str, Any]:
+    role = 'user' if getattr(event, 'author', None) == 'user' else 'assistant'
+    return {'role': role, 'content': _event_to_text(event), 'message_id': getattr(event, 'id', None)}
+
+
+async def write_summary_checkpoint_if_needed(session_service: Any, session: Any, llm_model: str) -> bool:
+    """Summarize everything before the recent tail into a checkpoint event once over budget.
+
+    ``session`` 应来自 ModelOnlyDBSessionService.get_session，即已经按最新检查点裁剪过的视图。
+    只在用户消息处切分，保证尾部不会以孤立的工具结果开头。失败时不影响本轮调用。
+
+    Returns:
+        True if a new checkpoint was written.
+    """
+    from utils.config import config
+
+    events = list(getattr(session, 'events', None) or [])
+    tail_size = max(1, config.CONTEXT_COMPACTION_TAIL_EVENTS)
+    if len(events) <= tail_size:
+        return False
+
+    counting_messages = [_event_to_counting_message(event) for event in events]
+    total_tokens = count_tokens(counting_messages, llm_model)
+    if total_tokens <= config.CONTEXT_COMPACTION_TOKEN_BUDGET:
+        return False
+
+    # 从默认切分点向前找到最近的用户消息作为尾部的起点
+    cut = len(events) - tail_size
+    while cut > 0 and getattr(events[cut], 'author', None) != 'user':
+        cut -= 1
+    if cut <= 1:
+        # 前缀里只有（上一个）检查点，没有可以再压缩的内容
+        return False
+
+    transcript = '\n\n'.join(
+        f"{getattr(event, 'author', 'unknown')}: {_event_to_text(event, SUMMARY_EVENT_TEXT_LIMIT)}"
+        for event in events[:cut]
+    )
+    try:
+        from services.llm import make_llm_api_call
+        response = await make_llm_api_call(
+            messages=[
+                {'role': 'system', 'content': SUMMARY_SYSTEM_PROMPT},
+                {'role': 'user', 'content': transcript},
+            ],
+            model_name=config.CONTEXT_COMPACTION_MODEL or llm_model,
+            temperature=0,
+            max_tokens=config.CONTEXT_COMPACTION_SUMMARY_MAX_TOKENS,
+            stream=False,
+        )
+        summary = (response.choices[0].message.content or '').strip()
+    except Exception as e:
+        logger.warning(f"Failed to summarize session {session.id} for context checkpoint: {e}")
+        return False
+    if not summary:
+        return False
+
+    # 检查点时间戳取被摘要的最后一个事件与尾部第一个事件的中点
+    timestamp = (events[cut - 1].timestamp + events[cut].timestamp) / 2
+    try:
+        await session_service.append_checkpoint(session, summary, timestamp)
+    except Exception as e:
+        logger.warning(f"Failed to write context checkpoint for session {session.id}: {e}")
+        return False
+
+    logger.info(f"Context checkpoint written for session {session.id}: {total_tokens} tokens, {cut} events summarized, {len(events) - cut} kept")
+    return True
@@ -19,7 +19,8 @@ from utils.logger import logger
 from utils.json_helpers import to_json_string
 from agentpress.tool import ToolResult
 from agentpress.tool_registry import ToolRegistry
-from agentpress.xml_tool_parser import XMLToolParser
+from agentpress.tool_scheduler import ToolScheduler
+from agentpress.xml_tool_parser import XMLToolParser, StreamingXMLChunkExtractor
 try:
     from langfuse.client import StatefulTraceClient
 except ImportError:
@@ -68,7 +69,10 @@ class ProcessorConfig:
         native_tool_calling: Enable OpenAI-style function calling format
         execute_tools: Whether to automatically execute detected tool calls
         execute_on_stream: For streaming, execute tools as they appear vs. at the end
-        tool_execution_strategy: How to execute multiple tools ("sequential" or "parallel")
+        tool_execution_strategy: How to execute multiple tools ("sequential" or "parallel").
+            "parallel" uses the dependency-aware ToolScheduler (resource keys, concurrency classes)
+        max_parallel_tools: Maximum number of tool calls running at once with the "parallel" strategy
+        tool_timeout: Default per-call timeout in seconds for tools that do not declare one (None = no limit)
         xml_adding_strategy: How to add XML tool results to the conversation
         max_xml_tool_calls: Maximum number of XML tool calls to process (0 = no limit)
     """
@@ -81,6 +85,8 @@ class ProcessorConfig:
     tool_execution_strategy: ToolExecutionStrategy = "sequential"
     xml_adding_strategy: XmlAddingStrategy = "assistant_message"
     max_xml_tool_calls: int = 0  # 0 means no limit
+    max_parallel_tools: int = 8
+    tool_timeout: Optional[float] = None
     
     def __post_init__(self):
         """Validate configuration after initialization."""
@@ -93,6 +99,9 @@ class ProcessorConfig:
         if self.max_xml_tool_calls < 0:
             raise ValueError("max_xml_tool_calls must be a non-negative integer (0 = no limit)")
 
+        if self.max_parallel_tools < 1:
+            raise ValueError("max_parallel_tools must be a positive integer")
+
 class ResponseProcessor:
     """Processes LLM responses, extracting and executing tool calls."""
     
@@ -110,6 +119,8 @@ class ResponseProcessor:
         self.trace = trace or langfuse.trace(name="anonymous:response_processor")
         # Initialize the XML parser
         self.xml_parser = XMLToolParser()
+        self._legacy_tag_names_key: Optional[Tuple[str, ...]] = None
+        self._legacy_tag_names: Tuple[str, ...] = ()
         self.is_agent_builder = is_agent_builder
         self.target_agent_id = target_agent_id
         self.agent_config = agent_config
@@ -667,11 +678,12 @@ class ResponseProcessor:
                                     self.trace.event(name="xml_tool_call_limit_reached", level="DEFAULT", status_message=(f"XML tool call limit reached - not yielding more content chunks"))
                                 
                                 # # --- 处理 XML 的工具调用  (如果启用了XML工具调用 并且 还没达到调用次数上限) ---
+                                # 启用时在进入流式循环前为本次响应创建一个增量解析器（跨 chunk 保存状态）：
+                                #     xml_chunk_extractor = self._create_xml_chunk_extractor()
                                 # if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                                #     # 提取XML工具调用
-                                #     xml_chunks = self._extract_xml_chunks(current_xml_content)
+                                #     # 提取XML工具调用：增量解析器只扫描新到达的 chunk_content，闭合标签一到就产出完整调用
+                                #     xml_chunks = xml_chunk_extractor.feed(chunk_content)
                                 #     for xml_chunk in xml_chunks:
-                                #         current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
                                 #         xml_chunks_buffer.append(xml_chunk)
                                 #         result = self._parse_xml_tool_call(xml_chunk)
                                 #         if result:
@@ -1584,9 +1596,11 @@ class ResponseProcessor:
             if config.execute_tools and tool_calls_to_execute:
                 logger.info(f"Executing {len(tool_calls_to_execute)} tools with strategy: {config.tool_execution_strategy}")
                 self.trace.event(name="executing_tools_with_strategy", level="DEFAULT", status_message=(f"Executing {len(tool_calls_to_execute)} tools with strategy: {config.tool_execution_strategy}"))
-                tool_results = await self._execute_tools(tool_calls_to_execute, config.tool_execution_strategy)
-
-                for i, (returned_tool_call, result) in enumerate(tool_results):
+                # 按完成顺序逐个保存并推送结果，不等待整批工具结束
+                async for i, returned_tool_call, result in self._iter_tool_results(
+                    tool_calls_to_execute, config.tool_execution_strategy,
+                    max_parallel=config.max_parallel_tools, default_timeout=config.tool_timeout
+                ):
                     original_data = all_tool_data[i]
                     tool_call_from_data = original_data['tool_call']
                     parsing_details = original_data['parsing_details']
@@ -1675,94 +1689,31 @@ class ResponseProcessor:
             )
             if end_msg_obj: yield format_for_yield(end_msg_obj)
 
+    def _legacy_xml_tag_names(self) -> Tuple[str, ...]:
+        """Legacy XML tag names (underscores → dashes) for every registered function, cached per tool set."""
+        function_names = tuple(self.tool_registry.tools.keys())
+        if self._legacy_tag_names_key != function_names:
+            self._legacy_tag_names_key = function_names
+            self._legacy_tag_names = tuple(name.replace('_', '-') for name in function_names)
+        return self._legacy_tag_names
+
+    def _create_xml_chunk_extractor(self, legacy: bool = False) -> StreamingXMLChunkExtractor:
+        """Create a resumable extractor; legacy=True matches registered tool tags instead of <function_calls>."""
+        if legacy:
+            return StreamingXMLChunkExtractor(self._legacy_xml_tag_names(), function_calls=False)
+        return StreamingXMLChunkExtractor()
+
     def _extract_xml_chunks(self, content: str) -> List[str]:
         """Extract complete XML chunks using start and end pattern matching."""
         chunks = []
-        pos = 0
         
         try:
             # First, look for new format <function_calls> blocks
-            start_pattern = '<function_calls>'
-            end_pattern = '</function_calls>'
-            
-            while pos < len(content):
-                # Find the next function_calls block
-                start_pos = content.find(start_pattern, pos)
-                if start_pos == -1:
-                    break
-                
-                # Find the matching end tag
-                end_pos = content.find(end_pattern, start_pos)
-                if end_pos == -1:
-                    break
-                
-                # Extract the complete block including tags
-                chunk_end = end_pos + len(end_pattern)
-                chunk = content[start_pos:chunk_end]
-                chunks.append(chunk)
-                
-                # Move position past this chunk
-                pos = chunk_end
+            chunks = self._create_xml_chunk_extractor().feed(content)
             
             # If no new format found, fall back to old format for backwards compatibility
             if not chunks:
-                pos = 0
-                while pos < len(content):
-                    # Find the next tool tag
-                    next_tag_start = -1
-                    current_tag = None
-                    
-                    # Find the earliest occurrence of any registered tool function name
-                    # Check for available function names
-                    available_functions = self.tool_registry.get_available_functions()
-                    for func_name in available_functions.keys():
-                        # Convert function name to potential tag name (underscore to dash)
-                        tag_name = func_name.replace('_', '-')
-                        start_pattern = f'<{tag_name}'
-                        tag_pos = content.find(start_pattern, pos)
-                        
-                        if tag_pos != -1 and (next_tag_start == -1 or tag_pos < next_tag_start):
-                            next_tag_start = tag_pos
-                            current_tag = tag_name
-                    
-                    if next_tag_start == -1 or not current_tag:
-                        break
-                    
-                    # Find the matching end tag
-                    end_pattern = f'</{current_tag}>'
-                    tag_stack = []
-                    chunk_start = next_tag_start
-                    current_pos = next_tag_start
-                    
-                    while current_pos < len(content):
-                        # Look for next start or end tag of the same type
-                        next_start = content.find(f'<{current_tag}', current_pos + 1)
-                        next_end = content.find(end_pattern, current_pos)
-                        
-                        if next_end == -1:  # No closing tag found
-                            break
-                        
-                        if next_start != -1 and next_start < next_end:
-                            # Found nested start tag
-                            tag_stack.append(next_start)
-                            current_pos = next_start + 1
-                        else:
-                            # Found end tag
-                            if not tag_stack:  # This is our matching end tag
-                                chunk_end = next_end + len(end_pattern)
-                                chunk = content[chunk_start:chunk_end]
-                                chunks.append(chunk)
-                                pos = chunk_end
-                                break
-                            else:
-                                # Pop nested tag
-                                tag_stack.pop()
-                                current_pos = next_end + 1
-                    
-                    if current_pos >= len(content):  # Reached end without finding closing tag
-                        break
-                    
-                    pos = max(pos + 1, current_pos)
+                chunks = self._create_xml_chunk_extractor(legacy=True).feed(content)
         
         except Exception as e:
             logger.error(f"Error extracting XML chunks: {e}")
@@ -1882,7 +1833,9 @@ class ResponseProcessor:
     async def _execute_tools(
         self, 
         tool_calls: List[Dict[str, Any]], 
-        execution_strategy: ToolExecutionStrategy = "sequential"
+        execution_strategy: ToolExecutionStrategy = "sequential",
+        max_parallel: int = 8,
+        default_timeout: Optional[float] = None
     ) -> List[Tuple[Dict[str, Any], ToolResult]]:
         """Execute tool calls with the specified strategy.
         
@@ -1893,7 +1846,9 @@ class ResponseProcessor:
             tool_calls: List of tool calls to execute
             execution_strategy: Strategy for executing tools:
                 - "sequential": Execute tools one after another, waiting for each to complete
-                - "parallel": Execute all tools simultaneously for better performance 
+                - "parallel": Execute independent tools concurrently via the ToolScheduler
+            max_parallel: Maximum number of concurrently running tools ("parallel" only)
+            default_timeout: Timeout for tools that do not declare one ("parallel" only)
                 
         Returns:
             List of tuples containing the original tool call and its result
@@ -1904,7 +1859,7 @@ class ResponseProcessor:
         if execution_strategy == "sequential":
             return await self._execute_tools_sequentially(tool_calls)
         elif execution_strategy == "parallel":
-            return await self._execute_tools_in_parallel(tool_calls)
+            return await self._execute_tools_in_parallel(tool_calls, max_parallel, default_timeout)
         else:
             logger.warning(f"Unknown execution strategy: {execution_strategy}, falling back to sequential")
             return await self._execute_tools_sequentially(tool_calls)
@@ -1968,54 +1923,66 @@ class ResponseProcessor:
                             
             return completed_results + error_results
 
-    async def _execute_tools_in_parallel(self, tool_calls: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], ToolResult]]:
-        """Execute tool calls in parallel and return results.
+    async def _execute_tools_in_parallel(
+        self,
+        tool_calls: List[Dict[str, Any]],
+        max_parallel: int = 8,
+        default_timeout: Optional[float] = None
+    ) -> List[Tuple[Dict[str, Any], ToolResult]]:
+        """Execute tool calls concurrently through the ToolScheduler and return results.
         
-        This method executes all tool calls simultaneously using asyncio.gather, which
-        can significantly improve performance when executing multiple independent tools.
+        Independent tools run at the same time, calls contending for the same resource
+        (e.g. browser actions on one sandbox) run one at a time, and SERIAL / terminating
+        tools act as barriers. Results are returned in the original call order.
         
         Args:
             tool_calls: List of tool calls to execute
+            max_parallel: Maximum number of concurrently running tools
+            default_timeout: Timeout for tools that do not declare one
             
         Returns:
             List of tuples containing the original tool call and its result
         """
         if not tool_calls:
             return []
-            
-        try:
-            tool_names = [t.get('function_name', 'unknown') for t in tool_calls]
-            logger.info(f"Executing {len(tool_calls)} tools in parallel: {tool_names}")
-            self.trace.event(name="executing_tools_in_parallel", level="DEFAULT", status_message=(f"Executing {len(tool_calls)} tools in parallel: {tool_names}"))
-            
-            # Create tasks for all tool calls
-            tasks = [self._execute_tool(tool_call) for tool_call in tool_calls]
-            
-            # Execute all tasks concurrently with error handling
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Process results and handle any exceptions
-            processed_results = []
-            for i, (tool_call, result) in enumerate(zip(tool_calls, results)):
-                if isinstance(result, Exception):
-                    logger.error(f"Error executing tool {tool_call.get('function_name', 'unknown')}: {str(result)}")
-                    self.trace.event(name="error_executing_tool", level="ERROR", status_message=(f"Error executing tool {tool_call.get('function_name', 'unknown')}: {str(result)}"))
-                    # Create error result
-                    error_result = ToolResult(success=False, output=f"Error executing tool: {str(result)}")
-                    processed_results.append((tool_call, error_result))
-                else:
-                    processed_results.append((tool_call, result))
-            
-            logger.info(f"Parallel execution completed for {len(tool_calls)} tools")
-            self.trace.event(name="parallel_execution_completed", level="DEFAULT", status_message=(f"Parallel execution completed for {len(tool_calls)} tools"))
-            return processed_results
+
+        results: Dict[int, Tuple[Dict[str, Any], ToolResult]] = {}
+        async for index, tool_call, result in self._iter_tool_results(tool_calls, "parallel", max_parallel, default_timeout):
+            results[index] = (tool_call, result)
+        return [results[index] for index in sorted(results)]
+
+    async def _iter_tool_results(
+        self,
+        tool_calls: List[Dict[str, Any]],
+        execution_strategy: ToolExecutionStrategy = "sequential",
+        max_parallel: int = 8,
+        default_timeout: Optional[float] = None
+    ) -> AsyncGenerator[Tuple[int, Dict[str, Any], ToolResult], None]:
+        """Execute tool calls and yield (index, tool_call, result) as each one completes.
         
-        except Exception as e:
-            logger.error(f"Error in parallel tool execution: {str(e)}", exc_info=True)
-            self.trace.event(name="error_in_parallel_tool_execution", level="ERROR", status_message=(f"Error in parallel tool execution: {str(e)}"))
-            # Return error results for all tools if the gather itself fails
-            return [(tool_call, ToolResult(success=False, output=f"Execution error: {str(e)}")) 
-                    for tool_call in tool_calls]
+        With the "parallel" strategy results arrive in completion order; otherwise they
+        arrive in call order.
+        """
+        if not tool_calls:
+            return
+
+        if execution_strategy != "parallel":
+            for index, (tool_call, result) in enumerate(await self._execute_tools(tool_calls, execution_strategy)):
+                yield index, tool_call, result
+            return
+
+        tool_names = [t.get('function_name', 'unknown') for t in tool_calls]
+        logger.info(f"Scheduling {len(tool_calls)} tools (max parallel {max_parallel}): {tool_names}")
+        self.trace.event(name="executing_tools_in_parallel", level="DEFAULT", status_message=(f"Scheduling {len(tool_calls)} tools (max parallel {max_parallel}): {tool_names}"))
+
+        scheduler = ToolScheduler(self.tool_registry, self._execute_tool, max_parallel=max_parallel, default_timeout=default_timeout)
+        completed = 0
+        async for index, tool_call, result in scheduler.run(tool_calls):
+            completed += 1
+            yield index, tool_call, result
+
+        logger.info(f"Parallel execution completed for {completed} tools (out of {len(tool_calls)} total)")
+        self.trace.event(name="parallel_execution_completed", level="DEFAULT", status_message=(f"Parallel execution completed for {completed} tools (out of {len(tool_calls)} total)"))
 
     async def _add_tool_result(
         self, 
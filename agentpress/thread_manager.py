@@ -10,12 +10,15 @@ This module provides comprehensive conversation management, including:
 - Context summarization to manage token limits
 """
 
+import copy
+import hashlib
 import json
-from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal, cast
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Type, Union, AsyncGenerator, Literal, cast
 from services.llm import make_llm_api_call
 from agentpress.tool import Tool
-from agentpress.tool_registry import ToolRegistry
-from agentpress.context_manager import ContextManager
+from agentpress.tool_registry import ToolRegistry, ToolSchemaBundle
+from agentpress.context_manager import ContextManager, TEMPORARY_CONTEXT_TYPES, record_context_message
 from agentpress.response_processor import (
     ResponseProcessor,
     ProcessorConfig
@@ -40,6 +43,57 @@ from litellm.utils import token_counter # type: ignore
 # Type alias for tool choice
 ToolChoice = Literal["auto", "required", "none"]
 
+RENDERED_PROMPT_CACHE_SIZE = 128
+_rendered_prompt_cache: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+
+
+def _append_xml_instructions(system_prompt: Dict[str, Any], xml_instructions: str) -> Dict[str, Any]:
+    working_system_prompt = copy.deepcopy(system_prompt)
+    if not xml_instructions:
+        return working_system_prompt
+
+    system_content = working_system_prompt.get('content')
+
+    if isinstance(system_content, str):
+        working_system_prompt['content'] += xml_instructions
+        logger.debug("Appended XML examples to string system prompt content.")
+    elif isinstance(system_content, list):
+        appended = False
+        for item in working_system_prompt['content']: # Modify the copy
+            if isinstance(item, dict) and item.get('type') == 'text' and 'text' in item:
+                item['text'] += xml_instructions
+                logger.debug("Appended XML examples to the first text block in list system prompt content.")
+                appended = True
+                break
+        if not appended:
+            logger.warning("System prompt content is a list but no text block found to append XML examples.")
+    else:
+        logger.warning(f"System prompt content is of unexpected type ({type(system_content)}), cannot add XML examples.")
+    return working_system_prompt
+
+
+def render_system_prompt(system_prompt: Dict[str, Any], schema_bundle: ToolSchemaBundle) -> Dict[str, Any]:
+    """Return the system prompt with the tool set's XML instructions appended, cached per (prompt, tool set).
+
+    返回副本，调用方可以随意修改。
+    """
+    prompt_hash = hashlib.sha1(json.dumps(system_prompt, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    key = (prompt_hash, schema_bundle.fingerprint)
+
+    rendered = _rendered_prompt_cache.get(key)
+    if rendered is None:
+        rendered = _append_xml_instructions(system_prompt, schema_bundle.xml_instructions)
+        _rendered_prompt_cache[key] = rendered
+        while len(_rendered_prompt_cache) > RENDERED_PROMPT_CACHE_SIZE:
+            _rendered_prompt_cache.popitem(last=False)
+    else:
+        _rendered_prompt_cache.move_to_end(key)
+
+    if isinstance(rendered.get('content'), str):
+        return dict(rendered)
+    return copy.deepcopy(rendered)
+
+
 class ThreadManager:
     """
     管理与大型语言模型的对话线程以及工具的执行过程。
@@ -72,6 +126,8 @@ class ThreadManager:
             agent_config=self.agent_config
         )
         self.context_manager = ContextManager()
+        # thread_id -> {'cursor': (timestamp, id), 'messages': [...]}，增量加载消息用
+        self._llm_message_cache: Dict[str, Dict[str, Any]] = {}
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
@@ -173,13 +229,21 @@ class ThreadManager:
 
         try:
             # Insert the message and get the inserted row data including the id
-            result = await client.table('messages').insert(data_to_insert)
+            if type == 'assistant_response_end':
+                # 消息写入和月度用量账本累加在同一事务里完成
+                from services.billing import insert_usage_message
+                rows = await insert_usage_message(thread_id, data_to_insert, content)
+            else:
+                rows = (await client.table('messages').insert(data_to_insert)).data
             logger.info(f"Successfully added message to thread {thread_id}")
 
-            if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
-                return result.data[0]
+            if type in TEMPORARY_CONTEXT_TYPES and rows:
+                record_context_message(thread_id, type, rows[0].get('message_id'))
+
+            if rows and len(rows) > 0 and isinstance(rows[0], dict) and 'message_id' in rows[0]:
+                return rows[0]
             else:
-                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
+                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {rows}")
                 return None
         except Exception as e:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
@@ -191,6 +255,9 @@ class ThreadManager:
         This method fetches messages from the events table and formats them
         for LLM consumption.
 
+        已解析的消息按线程缓存在当前实例上，并记录最后一条事件的 (timestamp, id) 游标；
+        后续轮次只按键集分页拉取游标之后的新事件并追加，避免每轮重新读取和解析全部历史。
+
         Args:
             thread_id: The ID of the thread to get messages for.
 
@@ -200,87 +267,105 @@ class ThreadManager:
         logger.debug(f"Getting messages for thread {thread_id} from events table")
         client = await self.db.client
 
+        cached = self._llm_message_cache.get(thread_id)
+        cursor = cached['cursor'] if cached else None
+
         try:
-            # Fetch events in batches of 1000 to avoid overloading the database
-            all_events = []
+            # Fetch events in keyset-paginated batches of 1000 to avoid overloading the database
+            new_events = []
             batch_size = 1000
-            offset = 0
-            
+
             while True:
-                # 从 events 表获取消息，按时间戳排序
-                result = await client.table('events').select(
+                # 从 events 表获取游标之后的消息，按 (timestamp, id) 排序
+                query = client.table('events').select(
                     'id, author, content, timestamp'
                 ).eq('session_id', thread_id).in_(
                     'author', ['user', 'assistant']
-                ).order('timestamp').range(offset, offset + batch_size - 1).execute()
-                
+                )
+                if cursor:
+                    query = query.after(['timestamp', 'id'], list(cursor))
+                result = await query.order('timestamp').order('id').limit(batch_size).execute()
+
                 if not result.data or len(result.data) == 0:
                     break
-                    
-                all_events.extend(result.data)
-                
+
+                new_events.extend(result.data)
+                last_event = result.data[-1]
+                cursor = (last_event.get('timestamp'), last_event.get('id'))
+
                 # If we got fewer than batch_size records, we've reached the end
                 if len(result.data) < batch_size:
                     break
-                    
-                offset += batch_size
-            
-            # Parse the returned data and convert to LLM message format
-            if not all_events:
-                return []
 
-            # Convert events to LLM message format
-            messages = []
-            for event in all_events:
-                try:
-                    # 确保event是字典格式
-                    if hasattr(event, '__dict__'):
-                        event = dict(event)
-                    
-                    # 解析事件内容
-                    content = event.get('content', {})
-                    if isinstance(content, str):
-                        try:
-                            content = json.loads(content)
-                        except json.JSONDecodeError:
-                            # 如果不是JSON，当作纯文本处理
-                            content = {"content": content}
-                    
-                    # 构建LLM消息格式
-                    message = {
-                        "role": event.get('author', 'user'),
-                        "message_id": event.get('id'),
-                        "timestamp": event.get('timestamp')
-                    }
-                    
-                    # 处理timestamp字段，确保datetime对象被转换为字符串
-                    if message.get('timestamp') and hasattr(message['timestamp'], 'isoformat'):
-                        message['timestamp'] = message['timestamp'].isoformat()
-                    
-                    # 处理内容格式
-                    if isinstance(content, dict):
-                        # 如果content是对象，提取文本内容
-                        if 'content' in content:
-                            message["content"] = content['content']
-                        else:
-                            # 如果没有content字段，将整个对象转为字符串
-                            message["content"] = json.dumps(content)
-                    else:
-                        message["content"] = str(content)
-                    
+            # Convert new events to LLM message format and append to the retained list
+            messages = cached['messages'] if cached else []
+            for event in new_events:
+                message = self._event_to_llm_message(event)
+                if message is not None:
                     messages.append(message)
-                    
-                except Exception as e:
-                    logger.error(f"Failed to parse event {event.get('id')}: {e}")
-                    continue
 
-            logger.debug(f"Retrieved {len(messages)} messages from events table for thread {thread_id}")
-            return messages
+            if cursor:
+                self._llm_message_cache[thread_id] = {'cursor': cursor, 'messages': messages}
+
+            logger.debug(f"Retrieved {len(messages)} messages ({len(new_events)} new) from events table for thread {thread_id}")
+            # 返回逐条浅拷贝：上下文压缩会原地改写 msg["content"]，不能污染缓存
+            return [dict(message) for message in messages]
 
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
             return []
 
+    def invalidate_llm_messages(self, thread_id: Optional[str] = None):
+        """Drop cached LLM messages for a thread (or all threads), forcing a full reload on next access."""
+        if thread_id is None:
+            self._llm_message_cache.clear()
+        else:
+            self._llm_message_cache.pop(thread_id, None)
+
+    def _event_to_llm_message(self, event: Any) -> Optional[Dict[str, Any]]:
+        """Convert a single events row to LLM message format, or None if it cannot be parsed."""
+        try:
+            # 确保event是字典格式
+            if hasattr(event, '__dict__'):
+                event = dict(event)
+
+            # 解析事件内容
+            content = event.get('content', {})
+            if isinstance(content, str):
+                try:
+                    content = json.loads(content)
+                except json.JSONDecodeError:
+                    # 如果不是JSON，当作纯文本处理
+                    content = {"content": content}
+
+            # 构建LLM消息格式
+            message = {
+                "role": event.get('author', 'user'),
+                "message_id": event.get('id'),
+                "timestamp": event.get('timestamp')
+            }
+
+            # 处理timestamp字段，确保datetime对象被转换为字符串
+            if message.get('timestamp') and hasattr(message['timestamp'], 'isoformat'):
+                message['timestamp'] = message['timestamp'].isoformat()
+
+            # 处理内容格式
+            if isinstance(content, dict):
+                # 如果content是对象，提取文本内容
+                if 'content' in content:
+                    message["content"] = content['content']
+                else:
+                    # 如果没有content字段，将整个对象转为字符串
+                    message["content"] = json.dumps(content)
+            else:
+                message["content"] = str(content)
+
+            return message
+
+        except Exception as e:
+            logger.error(f"Failed to parse event {event.get('id')}: {e}")
+            return None
+
     async def run_thread(
         self,
         thread_id: str,
@@ -337,77 +422,12 @@ class ThreadManager:
         if max_xml_tool_calls > 0 and not config.max_xml_tool_calls:
             config.max_xml_tool_calls = max_xml_tool_calls
 
-        # Create a working copy of the system prompt to potentially modify
-        working_system_prompt = system_prompt.copy()
-
-        # Add XML tool calling instructions to system prompt if requested
+        # Add XML tool calling instructions to system prompt if requested.
+        # 渲染结果按 (系统提示词内容, 工具集指纹) 缓存，相同输入得到逐字节相同的提示词，便于命中模型提供方的 prompt cache
         if config.xml_tool_calling:
-            openapi_schemas = self.tool_registry.get_openapi_schemas()
-            usage_examples = self.tool_registry.get_usage_examples()
-            
-            if openapi_schemas:
-                # Convert schemas to JSON string
-                schemas_json = json.dumps(openapi_schemas, indent=2)
-                
-                # Build usage examples section if any exist
-                usage_examples_section = ""
-                if usage_examples:
-                    usage_examples_section = "\n\nUsage Examples:\n"
-                    for func_name, example in usage_examples.items():
-                        usage_examples_section += f"\n{func_name}:\n{example}\n"
-                
-                examples_content = f"""
-In this environment you have access to a set of tools you can use to answer the user's question.
-
-You can invoke functions by writing a <function_calls> block like the following as part of your reply to the user:
-
-<function_calls>
-<invoke name="function_name">
-<parameter name="param_name">param_value</parameter>
-...
-</invoke>
-</function_calls>
-
-String and scalar parameters should be specified as-is, while lists and objects should use JSON format.
-
-Here are the functions available in JSON Schema format:
-
-```json
-{schemas_json}
-```
-
-When using the tools:
-- Use the exact function names from the JSON schema above
-- Include all required parameters as specified in the schema
-- Format complex data (objects, arrays) as JSON strings within the parameter tags
-- Boolean values should be "true" or "false" (lowercase)
-{usage_examples_section}"""
-
-                # # Save examples content to a file
-                # try:
-                #     with open('xml_examples.txt', 'w') as f:
-                #         f.write(examples_content)
-                #     logger.debug("Saved XML examples to xml_examples.txt")
-                # except Exception as e:
-                #     logger.error(f"Failed to save XML examples to file: {e}")
-
-                system_content = working_system_prompt.get('content')
-
-                if isinstance(system_content, str):
-                    working_system_prompt['content'] += examples_content
-                    logger.debug("Appended XML examples to string system prompt content.")
-                elif isinstance(system_content, list):
-                    appended = False
-                    for item in working_system_prompt['content']: # Modify the copy
-                        if isinstance(item, dict) and item.get('type') == 'text' and 'text' in item:
-                            item['text'] += examples_content
-                            logger.debug("Appended XML examples to the first text block in list system prompt content.")
-                            appended = True
-                            break
-                    if not appended:
-                        logger.warning("System prompt content is a list but no text block found to append XML examples.")
-                else:
-                    logger.warning(f"System prompt content is of unexpected type ({type(system_content)}), cannot add XML examples.")
+            working_system_prompt = render_system_prompt(system_prompt, self.tool_registry.get_schema_bundle())
+        else:
+            working_system_prompt = system_prompt.copy()
         
         # Control whether we need to auto-continue due to tool_calls finish reason
         auto_continue = True
@@ -4,6 +4,7 @@ Core tool system providing the foundation for creating and managing tools.
 This module defines the base classes and decorators for creating tools in AgentPress:
 - Tool base class for implementing tool functionality
 - Schema decorators for OpenAPI tool definitions
+- Scheduling attributes (concurrency class, resource key, timeout) for the tool scheduler
 - Result containers for standardized tool outputs
 """
 
@@ -20,6 +21,30 @@ class SchemaType(Enum):
     OPENAPI = "openapi"
     USAGE_EXAMPLE = "usage_example"
 
+class ToolConcurrency(Enum):
+    """Concurrency class used by the tool scheduler.
+
+    SHARED: may run alongside any other call (stateless, e.g. web search)
+    EXCLUSIVE: calls on the same resource key run one at a time, in order (e.g. browser actions on one sandbox)
+    SERIAL: barrier - waits for all earlier calls and blocks all later ones
+    """
+    SHARED = "shared"
+    EXCLUSIVE = "exclusive"
+    SERIAL = "serial"
+
+@dataclass
+class ToolSchedulingSpec:
+    """Resolved scheduling attributes for one registered tool function.
+
+    Attributes:
+        concurrency (ToolConcurrency): Concurrency class of the function
+        resource_key (str): Resource the function contends for (used by EXCLUSIVE)
+        timeout (Optional[float]): Per-call timeout in seconds, None for no limit
+    """
+    concurrency: ToolConcurrency
+    resource_key: str
+    timeout: Optional[float] = None
+
 @dataclass
 class ToolSchema:
     """Container for tool schemas with type information.
@@ -56,6 +81,10 @@ class Tool(ABC):
         success_response: Create a successful result
         fail_response: Create a failed result
     """
+
+    # 调度属性：子类可覆盖，单个方法可以用 @tool_scheduling 单独声明
+    tool_concurrency: ToolConcurrency = ToolConcurrency.EXCLUSIVE
+    tool_timeout: Optional[float] = None
     
     def __init__(self):
         """Initialize tool with empty schema registry."""
@@ -78,6 +107,10 @@ class Tool(ABC):
         """
         return self._schemas
 
+    def _get_resource_key(self) -> str:
+        """Resource that EXCLUSIVE calls of this tool contend for (default: the tool class)."""
+        return self.__class__.__name__
+
     def success_response(self, data: Union[Dict[str, Any], str]) -> ToolResult:
         """Create a successful tool result.
         
@@ -134,6 +167,13 @@ def usage_example(example: str):
         ))
     return decorator
 
+def tool_scheduling(concurrency: Optional[ToolConcurrency] = None, timeout: Optional[float] = None):
+    """Decorator overriding the tool-level scheduling attributes for a single method."""
+    def decorator(func):
+        func.tool_scheduling = {"concurrency": concurrency, "timeout": timeout}
+        return func
+    return decorator
+
 # def xml_schema(**kwargs):
 #     """Deprecated decorator - does nothing, kept for compatibility."""
 #     def decorator(func):
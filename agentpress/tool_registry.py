@@ -1,8 +1,74 @@
-from typing import Dict, Type, Any, List, Optional, Callable
-from agentpress.tool import Tool, SchemaType
+from typing import Dict, Type, Any, List, Optional, Callable, Tuple
+from agentpress.tool import Tool, SchemaType, ToolConcurrency, ToolSchedulingSpec
 from utils.logger import logger
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+import hashlib
 import json
 
+# 按工具集指纹缓存编译好的 schema bundle；每次运行都会新建 ToolRegistry，相同工具集复用同一份
+SCHEMA_BUNDLE_CACHE_SIZE = 64
+_schema_bundle_cache: "OrderedDict[str, ToolSchemaBundle]" = OrderedDict()
+
+XML_TOOL_INSTRUCTIONS_TEMPLATE = """
+In this environment you have access to a set of tools you can use to answer the user's question.
+
+You can invoke functions by writing a <function_calls> block like the following as part of your reply to the user:
+
+<function_calls>
+<invoke name="function_name">
+<parameter name="param_name">param_value</parameter>
+...
+</invoke>
+</function_calls>
+
+String and scalar parameters should be specified as-is, while lists and objects should use JSON format.
+
+Here are the functions available in JSON Schema format:
+
+```json
+{schemas_json}
+```
+
+When using the tools:
+- Use the exact function names from the JSON schema above
+- Include all required parameters as specified in the schema
+- Format complex data (objects, arrays) as JSON strings within the parameter tags
+- Boolean values should be "true" or "false" (lowercase)
+{usage_examples_section}"""
+
+
+@dataclass(frozen=True)
+class ToolSchemaBundle:
+    """Schemas, usage examples and the rendered XML tool instructions of one tool set.
+
+    fingerprint 由工具名、工具类以及 schema 对象身份决定；_sources 持有这些 schema 对象，
+    保证缓存存活期间它们的 id 不会被复用。
+    """
+    fingerprint: str
+    openapi_schemas: Tuple[Dict[str, Any], ...]
+    usage_examples: "MappingProxyType[str, str]"
+    xml_instructions: str
+    _sources: Tuple[Any, ...] = ()
+
+
+def _render_xml_instructions(openapi_schemas: List[Dict[str, Any]], usage_examples: Dict[str, str]) -> str:
+    if not openapi_schemas:
+        return ""
+
+    # Build usage examples section if any exist
+    usage_examples_section = ""
+    if usage_examples:
+        usage_examples_section = "\n\nUsage Examples:\n"
+        for func_name, example in usage_examples.items():
+            usage_examples_section += f"\n{func_name}:\n{example}\n"
+
+    return XML_TOOL_INSTRUCTIONS_TEMPLATE.format(
+        schemas_json=json.dumps(openapi_schemas, indent=2),
+        usage_examples_section=usage_examples_section,
+    )
+
 
 class ToolRegistry:
     """Registry for managing and accessing tools.
@@ -22,6 +88,7 @@ class ToolRegistry:
     def __init__(self):
         """Initialize a new ToolRegistry instance."""
         self.tools = {}
+        self._schema_bundle: Optional[ToolSchemaBundle] = None
         logger.debug("Initialized new ToolRegistry instance")
     
     def register_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
@@ -38,6 +105,7 @@ class ToolRegistry:
         """
         logger.debug(f"Registering tool class: {tool_class.__name__}")
         tool_instance = tool_class(**kwargs)
+        self._schema_bundle = None
         
         # 只存储工具实例，不处理复杂的schema
         # ADK会自动从函数签名和docstring推断schema
@@ -75,12 +143,50 @@ class ToolRegistry:
                     self.tools[method_name] = {
                         "instance": tool_instance,
                         "method": method,  # 直接存储可调用的方法
-                        "tool_class": tool_class.__name__
+                        "tool_class": tool_class.__name__,
+                        "scheduling": self._resolve_scheduling(tool_instance, method)
                     }
                     logger.debug(f"Registered method '{method_name}' from {tool_class.__name__}")
         
         logger.debug(f"Tool registration complete for {tool_class.__name__}: {len([k for k in self.tools.keys() if self.tools[k]['tool_class'] == tool_class.__name__])} methods")
 
+    def register_instance_methods(self, tool_instance: Tool, methods: Dict[str, Callable]):
+        """Register bound methods of an already-initialized tool instance.
+
+        用于运行期间才发现的工具（例如 MCPToolWrapper 在启动截止时间之后才完成发现的服务器）。
+        """
+        self._schema_bundle = None
+        for method_name, method in methods.items():
+            self.tools[method_name] = {
+                "instance": tool_instance,
+                "method": method,
+                "tool_class": tool_instance.__class__.__name__,
+                "scheduling": self._resolve_scheduling(tool_instance, method)
+            }
+        logger.debug(f"Registered {len(methods)} methods from {tool_instance.__class__.__name__} instance")
+
+    @staticmethod
+    def _resolve_scheduling(tool_instance: Any, method: Callable) -> ToolSchedulingSpec:
+        """Resolve scheduling attributes: method-level @tool_scheduling overrides tool-level defaults."""
+        overrides = getattr(method, 'tool_scheduling', None) or {}
+        get_resource_key = getattr(tool_instance, '_get_resource_key', None)
+        return ToolSchedulingSpec(
+            concurrency=overrides.get('concurrency') or getattr(tool_instance, 'tool_concurrency', ToolConcurrency.EXCLUSIVE),
+            resource_key=get_resource_key() if callable(get_resource_key) else tool_instance.__class__.__name__,
+            timeout=overrides.get('timeout') or getattr(tool_instance, 'tool_timeout', None)
+        )
+
+    def get_scheduling_spec(self, function_name: str) -> ToolSchedulingSpec:
+        """Get scheduling attributes for a tool function.
+        
+        Unknown functions are treated as EXCLUSIVE on their own name so they never
+        run concurrently with themselves.
+        """
+        tool = self.tools.get(function_name)
+        if tool and tool.get('scheduling'):
+            return tool['scheduling']
+        return ToolSchedulingSpec(concurrency=ToolConcurrency.EXCLUSIVE, resource_key=function_name)
+
     def get_available_functions(self) -> Dict[str, Callable]:
         """Get all available tool functions.
         
@@ -127,6 +233,9 @@ class ToolRegistry:
         Returns:
             Dict mapping function names to their usage examples
         """
+        return dict(self.get_schema_bundle().usage_examples)
+
+    def _collect_usage_examples(self) -> Dict[str, str]:
         examples = {}
         
         # Get all registered tools and their schemas
@@ -145,6 +254,53 @@ class ToolRegistry:
         logger.debug(f"Retrieved {len(examples)} usage examples")
         return examples
 
+    def _schema_sources(self) -> Tuple[Any, ...]:
+        return tuple(
+            tool_info['instance'].get_schemas().get(tool_name)
+            for tool_name, tool_info in sorted(self.tools.items())
+        )
+
+    def get_tool_set_fingerprint(self) -> str:
+        """Stable identifier of the registered tool set (names, classes and schema objects)."""
+        return self.get_schema_bundle().fingerprint
+
+    def get_schema_bundle(self) -> ToolSchemaBundle:
+        """Compile the schemas of the registered tools once per tool set.
+
+        注册新工具会使当前 bundle 失效；工具集相同的 registry 之间通过指纹共享编译结果，
+        重复调用不再遍历 get_schemas() 或重新序列化 JSON。
+        """
+        if self._schema_bundle is not None:
+            return self._schema_bundle
+
+        sources = self._schema_sources()
+        key_parts = [
+            (tool_name, tool_info['tool_class'], id(source))
+            for (tool_name, tool_info), source in zip(sorted(self.tools.items()), sources)
+        ]
+        fingerprint = hashlib.sha1(repr(key_parts).encode('utf-8')).hexdigest()
+
+        bundle = _schema_bundle_cache.get(fingerprint)
+        if bundle is not None:
+            _schema_bundle_cache.move_to_end(fingerprint)
+        else:
+            openapi_schemas = self.get_openapi_schemas()
+            usage_examples = self._collect_usage_examples()
+            bundle = ToolSchemaBundle(
+                fingerprint=fingerprint,
+                openapi_schemas=tuple(openapi_schemas),
+                usage_examples=MappingProxyType(usage_examples),
+                xml_instructions=_render_xml_instructions(openapi_schemas, usage_examples),
+                _sources=sources,
+            )
+            _schema_bundle_cache[fingerprint] = bundle
+            while len(_schema_bundle_cache) > SCHEMA_BUNDLE_CACHE_SIZE:
+                _schema_bundle_cache.popitem(last=False)
+            logger.debug(f"Compiled tool schema bundle {fingerprint[:12]} for {len(self.tools)} functions")
+
+        self._schema_bundle = bundle
+        return bundle
+
     def get_tool_methods(self) -> Dict[str, Callable]:
         """Get all tool methods for ADK (直接获取可调用方法)
         
@@ -0,0 +1,115 @@
+"""
+Dependency-aware tool call scheduler.
+
+Runs the tool calls of one assistant turn concurrently where it is safe to do so:
+
+- SHARED calls run alongside anything else;
+- EXCLUSIVE calls on the same resource key run one at a time, in call order;
+- SERIAL calls (and terminating tools such as ask/complete) act as barriers.
+
+All calls share a global concurrency cap, each call may carry a timeout, and results
+are yielded in completion order so callers can persist/stream them as soon as they
+are ready. A turn with independent tools therefore takes max(latency) instead of
+sum(latency).
+"""
+
+import asyncio
+from contextlib import AsyncExitStack
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from agentpress.tool import ToolConcurrency, ToolResult, ToolSchedulingSpec
+from agentpress.tool_registry import ToolRegistry
+from utils.logger import logger
+
+# 终止类工具：作为屏障执行，其后的调用不再执行（与顺序执行策略保持一致）
+TERMINATING_TOOLS = ('ask', 'complete')
+
+
+class ToolScheduler:
+    """Schedules one batch of tool calls according to their declared scheduling specs."""
+
+    def __init__(
+        self,
+        tool_registry: ToolRegistry,
+        execute: Callable[[Dict[str, Any]], Awaitable[ToolResult]],
+        max_parallel: int = 8,
+        default_timeout: Optional[float] = None,
+    ):
+        self.tool_registry = tool_registry
+        self._execute = execute
+        self._semaphore = asyncio.Semaphore(max(1, max_parallel))
+        self._default_timeout = default_timeout
+        self._resource_locks: Dict[str, asyncio.Lock] = {}
+
+    def _spec_for(self, tool_call: Dict[str, Any]) -> ToolSchedulingSpec:
+        function_name = tool_call.get('function_name', 'unknown')
+        spec = self.tool_registry.get_scheduling_spec(function_name)
+        if function_name in TERMINATING_TOOLS and spec.concurrency != ToolConcurrency.SERIAL:
+            spec = ToolSchedulingSpec(ToolConcurrency.SERIAL, spec.resource_key, spec.timeout)
+        return spec
+
+    async def run(self, tool_calls: Sequence[Dict[str, Any]]) -> AsyncGenerator[Tuple[int, Dict[str, Any], ToolResult], None]:
+        """Execute the calls and yield (index, tool_call, result) in completion order."""
+        tasks: List[asyncio.Task] = []
+        barrier: Optional[asyncio.Task] = None
+        since_barrier: List[asyncio.Task] = []
+
+        for index, tool_call in enumerate(tool_calls):
+            spec = self._spec_for(tool_call)
+            if spec.concurrency == ToolConcurrency.SERIAL:
+                depends_on = since_barrier + ([barrier] if barrier else [])
+                task = asyncio.create_task(self._run_one(index, tool_call, spec, depends_on, None))
+                barrier, since_barrier = task, []
+            else:
+                lock = None
+                if spec.concurrency == ToolConcurrency.EXCLUSIVE:
+                    lock = self._resource_locks.setdefault(spec.resource_key, asyncio.Lock())
+                task = asyncio.create_task(self._run_one(index, tool_call, spec, [barrier] if barrier else [], lock))
+                since_barrier.append(task)
+            tasks.append(task)
+
+            if tool_call.get('function_name') in TERMINATING_TOOLS:
+                skipped = len(tool_calls) - index - 1
+                if skipped:
+                    logger.info(f"Terminating tool '{tool_call.get('function_name')}' scheduled, skipping {skipped} later tool calls")
+                break
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 调用方提前停止迭代时，取消尚未完成的调用
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _run_one(
+        self,
+        index: int,
+        tool_call: Dict[str, Any],
+        spec: ToolSchedulingSpec,
+        depends_on: List[asyncio.Task],
+        lock: Optional[asyncio.Lock],
+    ) -> Tuple[int, Dict[str, Any], ToolResult]:
+        function_name = tool_call.get('function_name', 'unknown')
+        if depends_on:
+            await asyncio.wait(depends_on)
+
+        timeout = spec.timeout or self._default_timeout
+        async with AsyncExitStack() as stack:
+            # 先取资源锁再占全局并发名额，避免排队的调用白白占用名额
+            if lock is not None:
+                await stack.enter_async_context(lock)
+            await stack.enter_async_context(self._semaphore)
+            try:
+                if timeout:
+                    result = await asyncio.wait_for(self._execute(tool_call), timeout=timeout)
+                else:
+                    result = await self._execute(tool_call)
+            except asyncio.TimeoutError:
+                logger.warning(f"Tool {function_name} timed out after {timeout}s")
+                result = ToolResult(success=False, output=f"Tool '{function_name}' timed out after {timeout} seconds")
+            except Exception as e:
+                logger.error(f"Error executing tool {function_name}: {str(e)}")
+                result = ToolResult(success=False, output=f"Error executing tool: {str(e)}")
+        return index, tool_call, result
@@ -7,7 +7,7 @@ the XML format with structured function_calls blocks.
 
 import re
 import xml.etree.ElementTree as ET
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable
 from dataclasses import dataclass
 import json
 import logging
@@ -221,6 +221,105 @@ class XMLToolParser:
         return True, None
 
 
+class StreamingXMLChunkExtractor:
+    """
+    Resumable extractor for complete tool call XML chunks in streamed text.
+
+    Feed it content deltas; it returns every chunk whose closing tag has arrived.
+    Only the unconsumed tail is buffered and each character is scanned a bounded
+    number of times, so the cost per delta is proportional to the delta rather
+    than to the whole accumulated response.
+
+    Recognised chunks:
+        - <function_calls> ... </function_calls> blocks
+        - legacy tool tags (e.g. <create-file ...> ... </create-file>, nesting aware),
+          matched with a single precompiled alternation over all registered tag names
+    """
+
+    FUNCTION_CALLS_START = '<function_calls>'
+    FUNCTION_CALLS_END = '</function_calls>'
+
+    def __init__(self, legacy_tag_names: Optional[Iterable[str]] = None, function_calls: bool = True):
+        self._buffer = ""
+        self._scan_pos = 0
+        self._block_start = 0
+        self._depth = 0
+        self._current_tag: Optional[str] = None
+        self._tag_pattern: Optional[re.Pattern] = None
+
+        alternatives = []
+        if function_calls:
+            alternatives.append(re.escape(self.FUNCTION_CALLS_START))
+        tag_names = sorted(set(legacy_tag_names or ()), key=len, reverse=True)
+        self._has_legacy_tags = bool(tag_names)
+        if tag_names:
+            alternatives.append(r'<(?P<tag>' + '|'.join(re.escape(name) for name in tag_names) + r')(?=[\s>/])')
+        self._start_pattern = re.compile('|'.join(alternatives)) if alternatives else None
+
+        # 最长起始标记的长度：缓冲区末尾这么多字符可能是被截断的起始标签，需要保留到下一个增量
+        longest = max([len(self.FUNCTION_CALLS_START)] + [len(name) + 2 for name in tag_names])
+        self._start_holdback = longest
+
+    @staticmethod
+    def compile_tag_pattern(tag_name: str) -> re.Pattern:
+        return re.compile(r'<' + re.escape(tag_name) + r'(?=[\s>/])|</' + re.escape(tag_name) + r'>')
+
+    def feed(self, delta: str) -> List[str]:
+        """Consume a content delta and return the chunks completed by it."""
+        if not delta or self._start_pattern is None:
+            return []
+        self._buffer += delta
+        chunks = []
+
+        while True:
+            if self._current_tag is None:
+                match = self._start_pattern.search(self._buffer, self._scan_pos)
+                if match is None:
+                    # 丢弃确定不含起始标签的前缀，只保留可能被截断的尾部
+                    keep_from = max(0, len(self._buffer) - self._start_holdback)
+                    self._buffer = self._buffer[keep_from:]
+                    self._scan_pos = 0
+                    return chunks
+                self._block_start = match.start()
+                self._scan_pos = match.end()
+                legacy_tag = match.group('tag') if self._has_legacy_tags else None
+                if legacy_tag:
+                    self._current_tag = legacy_tag
+                    self._tag_pattern = self.compile_tag_pattern(legacy_tag)
+                    self._depth = 1
+                else:
+                    self._current_tag = self.FUNCTION_CALLS_START
+                    self._tag_pattern = None
+
+            if self._tag_pattern is None:
+                end_pos = self._buffer.find(self.FUNCTION_CALLS_END, self._scan_pos)
+                if end_pos == -1:
+                    self._scan_pos = max(self._scan_pos, len(self._buffer) - len(self.FUNCTION_CALLS_END) + 1)
+                    return chunks
+                chunk_end = end_pos + len(self.FUNCTION_CALLS_END)
+            else:
+                chunk_end = None
+                for match in self._tag_pattern.finditer(self._buffer, self._scan_pos):
+                    self._scan_pos = match.end()
+                    if match.group(0).startswith('</'):
+                        self._depth -= 1
+                        if self._depth == 0:
+                            chunk_end = match.end()
+                            break
+                    else:
+                        self._depth += 1
+                if chunk_end is None:
+                    # 末尾可能是被截断的开/闭标签，回退到它可能开始的位置
+                    self._scan_pos = max(self._scan_pos, len(self._buffer) - len(self._current_tag) - 3)
+                    return chunks
+
+            chunks.append(self._buffer[self._block_start:chunk_end])
+            self._buffer = self._buffer[chunk_end:]
+            self._scan_pos = 0
+            self._current_tag = None
+            self._tag_pattern = None
+
+
 # Convenience function for quick parsing
 def parse_xml_tool_calls(content: str) -> List[XMLToolCall]:
     """
@@ -13,7 +13,7 @@ import time
 import uuid
 import sys
 
-from fastapi import FastAPI, Request, HTTPException, Response, Depends, APIRouter # type: ignore
+from fastapi import FastAPI, Request, HTTPException, Response, Depends, APIRouter, Header # type: ignore
 from utils.logger import logger, structlog
 from datetime import datetime, timezone
 
@@ -21,6 +21,7 @@ from fastapi.middleware.cors import CORSMiddleware # type: ignore
 from fastapi.responses import JSONResponse, FileResponse
 from fastapi.security import HTTPBearer
 from utils.config import config, EnvMode
+from utils.screenshot_store import MEDIA_TYPES_BY_SUFFIX
 from collections import OrderedDict
 from flags import api as feature_flags_api
 from agent import api as agent_api
@@ -337,6 +338,48 @@ async def health_check():
         # "instance_id": instance_id
     }
 
+@api_router.get("/health/db-queries")
+async def db_query_metrics(limit: Optional[int] = 50, x_admin_api_key: Optional[str] = Header(None)):
+    """按查询形状导出数据库延迟统计（非本地环境需要管理员 API Key）"""
+    if config.ENV_MODE != EnvMode.LOCAL:
+        from utils.auth_utils_new import verify_admin_api_key
+        await verify_admin_api_key(x_admin_api_key)
+
+    from services.postgresql import get_query_metrics
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "instance_id": instance_id,
+        "shapes": get_query_metrics(limit=limit),
+    }
+
+@api_router.get("/health/db-pool")
+async def db_pool_metrics(x_admin_api_key: Optional[str] = Header(None)):
+    """导出数据库连接池的在用连接数与获取连接等待时间（非本地环境需要管理员 API Key）"""
+    if config.ENV_MODE != EnvMode.LOCAL:
+        from utils.auth_utils_new import verify_admin_api_key
+        await verify_admin_api_key(x_admin_api_key)
+
+    from services.postgresql import get_pool_metrics
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "instance_id": instance_id,
+        "pools": get_pool_metrics(),
+    }
+
+@api_router.get("/health/cache")
+async def cache_metrics(x_admin_api_key: Optional[str] = Header(None)):
+    """按键前缀导出两级缓存的命中率与延迟（非本地环境需要管理员 API Key）"""
+    if config.ENV_MODE != EnvMode.LOCAL:
+        from utils.auth_utils_new import verify_admin_api_key
+        await verify_admin_api_key(x_admin_api_key)
+
+    from utils.cache import Cache
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "instance_id": instance_id,
+        "prefixes": Cache.stats(),
+    }
+
 # 添加全局 OPTIONS 处理器来解决 CORS 问题
 @app.options("/{path:path}")
 async def options_handler(request: Request, path: str):
@@ -387,7 +430,7 @@ async def health_check_docker():
 async def get_screenshot(filename: str):
     """获取截图文件"""
     try:
-        screenshots_dir = Path("screenshots")
+        screenshots_dir = Path(config.SCREENSHOT_LOCAL_DIR)
         file_path = screenshots_dir / filename
         
         # 检查文件是否存在
@@ -403,9 +446,10 @@ async def get_screenshot(filename: str):
         # 返回文件
         return FileResponse(
             path=str(file_path),
-            media_type="image/png",
+            media_type=MEDIA_TYPES_BY_SUFFIX.get(file_path.suffix.lower(), "image/png"),
             headers={
-                "Cache-Control": "public, max-age=3600",  # 缓存1小时
+                # 文件名是内容哈希，内容不会变化，可长期缓存
+                "Cache-Control": "public, max-age=86400, immutable",
                 "Content-Disposition": f"inline; filename={filename}"
             }
         )
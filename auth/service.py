@@ -6,7 +6,7 @@ import json
 from datetime import datetime
 from typing import Optional
 from fastapi import HTTPException # type: ignore
-from services.postgresql import DBConnection
+from services.postgresql import DBConnection, mark_read_your_writes
 from utils.auth_utils import AuthUtils
 from utils.logger import logger
 from .models import (
@@ -64,6 +64,7 @@ class AuthService:
                 """,
                 request.email, hashed_password, request.name, 'local', 'active', datetime.now()
             )
+        mark_read_your_writes()
         
         user = dict(user_record)
         
@@ -137,6 +138,7 @@ class AuthService:
                 "DELETE FROM refresh_tokens WHERE user_id = $1",
                 str(user['id'])
             )
+        mark_read_your_writes()
         old_tokens_count = int(old_tokens_result.split()[-1]) if old_tokens_result else 0
         logger.info(f"Login: Cleared {old_tokens_count} old refresh tokens for user {user['id']}")
         
@@ -153,6 +155,7 @@ class AuthService:
                 "UPDATE users SET last_login_at = $1 WHERE id = $2",
                 datetime.now(), user['id']
             )
+        mark_read_your_writes()
         
         # 使用默认应用名称
         app_name = self.default_app_name
@@ -206,6 +209,7 @@ class AuthService:
                 "DELETE FROM refresh_tokens WHERE token_hash = $1",
                 token_hash
             )
+        mark_read_your_writes()
         
         # 生成新的tokens
         access_token = self.auth.create_access_token(user_id)
@@ -243,6 +247,7 @@ class AuthService:
                 "DELETE FROM refresh_tokens WHERE user_id = $1",
                 user_id
             )
+        mark_read_your_writes()
         
         # 提取删除的行数
         deleted_count = int(result.split()[-1]) if result else 0
@@ -278,6 +283,7 @@ class AuthService:
                 """,
                 user_id, token_hash, expires_at, datetime.now()
             )
+        mark_read_your_writes()
     
     async def _update_user_state(self, client, user_id: str, state_data: dict, app_name: str = "fufanmanus"):
         """Update user state"""
@@ -310,6 +316,7 @@ class AuthService:
                         """,
                         json.dumps(current_state), datetime.now(), app_name, user_id
                     )
+                mark_read_your_writes()
             else:
                 # 创建新的用户状态
                 async with client.pool.acquire() as conn:
@@ -320,6 +327,7 @@ class AuthService:
                         """,
                         app_name, user_id, json.dumps(state_data), datetime.now()
                     )
+                mark_read_your_writes()
             
             logger.info(f"Updated user state for {user_id} in {app_name}")
             
@@ -342,6 +350,7 @@ class AuthService:
                     """,
                     app_name, user_id, session_id, json.dumps(session_data), datetime.now(), datetime.now()
                 )
+            mark_read_your_writes()
             
             logger.info(f"Created ADK session {session_id} for user {user_id} in app {app_name}")
             return session_id
@@ -372,6 +381,7 @@ class AuthService:
                         event_id, app_name, user_id, session_id, invocation_id,
                         "auth_service", datetime.now(), json.dumps(event_data), b''  # actions为空字节
                     )
+                mark_read_your_writes()
                 
                 logger.info(f"Logged ADK event {event_type} for user {user_id} with session {session_id}")
             else:
@@ -491,6 +501,7 @@ class AuthService:
                     """,
                     datetime.now(), app_name, user_id
                 )
+            mark_read_your_writes()
                 
             closed_count = int(result.split()[-1]) if result else 0
             logger.info(f"Closed {closed_count} ADK sessions for user {user_id}")
@@ -3,8 +3,10 @@ from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, BackgroundTasks
 from pydantic import BaseModel, Field, HttpUrl
 from utils.auth_utils import get_current_user_id_from_jwt, verify_agent_access
+from utils.simple_auth_middleware import verify_thread_access
 from services.supabase import DBConnection
 from knowledge_base.file_processor import FileProcessor
+from knowledge_base import retrieval
 from utils.logger import logger
 from flags.flags import is_enabled
 
@@ -159,6 +161,7 @@ async def create_agent_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to create agent knowledge base entry")
         
         created_entry = result.data[0]
+        retrieval.schedule_refresh(agent_id)
         
         return KnowledgeBaseEntryResponse(
             entry_id=created_entry['entry_id'],
@@ -287,6 +290,7 @@ async def update_knowledge_base_entry(
             raise HTTPException(status_code=500, detail="Failed to update knowledge base entry")
         
         updated_entry = result.data[0]
+        retrieval.schedule_refresh(agent_id)
         
         logger.info(f"Updated agent knowledge base entry {entry_id} for agent {agent_id}")
         
@@ -462,7 +466,18 @@ async def process_file_background(
     """Background task to process uploaded files"""
     
     processor = FileProcessor()
-    client = await processor.db.client
+    client = await db.client
+
+    async def report_progress(progress: dict):
+        # ZIP 导入每写入一批条目更新一次任务进度，processing-jobs 接口可以看到已完成的数量
+        await client.rpc('update_agent_kb_job_status', {
+            'p_job_id': job_id,
+            'p_status': 'processing',
+            'p_result_info': progress,
+            'p_entries_created': progress['entries_created'],
+            'p_total_files': progress['total_files']
+        }).execute()
+
     try:
         await client.rpc('update_agent_kb_job_status', {
             'p_job_id': job_id,
@@ -470,16 +485,18 @@ async def process_file_background(
         }).execute()
         
         result = await processor.process_file_upload(
-            agent_id, account_id, file_content, filename, mime_type
+            agent_id, account_id, file_content, filename, mime_type,
+            progress_callback=report_progress
         )
         
         if result['success']:
+            is_zip = 'zip_entry_id' in result
             await client.rpc('update_agent_kb_job_status', {
                 'p_job_id': job_id,
                 'p_status': 'completed',
                 'p_result_info': result,
-                'p_entries_created': 1,
-                'p_total_files': 1
+                'p_entries_created': result['total_extracted'] + 1 if is_zip else 1,
+                'p_total_files': result['total_extracted'] + result['total_failed'] if is_zip else 1
             }).execute()
         else:
             await client.rpc('update_agent_kb_job_status', {
@@ -504,6 +521,9 @@ async def process_file_background(
 async def get_agent_knowledge_base_context(
     agent_id: str,
     max_tokens: int = 4000,
+    query: Optional[str] = None,
+    thread_id: Optional[str] = None,
+    top_k: int = 8,
     user_id: str = Depends(get_current_user_id_from_jwt)
 ):
     if not await is_enabled("knowledge_base"):
@@ -512,13 +532,29 @@ async def get_agent_knowledge_base_context(
             detail="This feature is not available at the moment."
         )
     
-    """Get knowledge base context for agent prompts"""
+    """Get knowledge base context for agent prompts
+
+    传入 query（或 thread_id，取该线程最近一条用户消息）时只返回与之相关的 top_k 个 chunk；
+    两者都没有时沿用按条目拼接的旧行为。
+    """
     try:
         client = await db.client
         
         # Verify agent access
         await verify_agent_access(client, agent_id, user_id)
         
+        if not query and thread_id:
+            await verify_thread_access(client, thread_id, user_id)
+            query = await retrieval.get_latest_user_message(thread_id)
+        
+        if query:
+            context = await retrieval.build_context(agent_id, query, max_tokens=max_tokens, top_k=top_k)
+            return {
+                "context": context,
+                "max_tokens": max_tokens,
+                "agent_id": agent_id
+            }
+        
         result = await client.rpc('get_agent_knowledge_base_context', {
             'p_agent_id': agent_id,
             'p_max_tokens': max_tokens
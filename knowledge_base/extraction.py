@@ -0,0 +1,96 @@
+"""
+Document text extraction for the knowledge base.
+
+这些函数运行在 FileProcessor 的进程池里（spawn 方式启动），因此只依赖解析库本身，
+不引入数据库、日志等重量级模块。所有提取函数在内容达到 max_length 后提前停止。
+"""
+
+import io
+import re
+from typing import List
+
+import chardet
+import PyPDF2
+import docx
+
+# 保留 \t \n \r，去掉其余 C0 控制字符和 BOM（与逐字符过滤 ord(char) >= 32 的结果一致）
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\ufeff]+')
+_EXCESS_NEWLINES_RE = re.compile(r'\n{4,}')
+
+# 编码检测最多读取的字节数；UniversalDetector 通常在这之前就能给出结论
+_ENCODING_SAMPLE_SIZE = 256 * 1024
+_ENCODING_CHUNK_SIZE = 16 * 1024
+
+
+def sanitize_content(content: str) -> str:
+    if not content:
+        return content
+
+    sanitized = _CONTROL_CHARS_RE.sub('', content)
+    sanitized = sanitized.replace('\r\n', '\n').replace('\r', '\n')
+    sanitized = _EXCESS_NEWLINES_RE.sub('\n\n\n', sanitized)
+
+    return sanitized.strip()
+
+
+def _detect_encoding(file_content: bytes) -> str:
+    detector = chardet.UniversalDetector()
+    sample = memoryview(file_content)[:_ENCODING_SAMPLE_SIZE]
+    for start in range(0, len(sample), _ENCODING_CHUNK_SIZE):
+        detector.feed(bytes(sample[start:start + _ENCODING_CHUNK_SIZE]))
+        if detector.done:
+            break
+    detector.close()
+    return detector.result.get('encoding') or 'utf-8'
+
+
+def extract_text_content(file_content: bytes, max_length: int) -> str:
+    encoding = _detect_encoding(file_content)
+
+    try:
+        raw_text = file_content.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        raw_text = file_content.decode('utf-8', errors='replace')
+
+    return sanitize_content(raw_text)[:max_length]
+
+
+def _collect_until(pieces, separator: str, max_length: int) -> str:
+    """逐段清洗并累加，超过 max_length 后不再读取后续段落/页面"""
+    collected: List[str] = []
+    total = 0
+    for piece in pieces:
+        piece = sanitize_content(piece or '')
+        if not piece:
+            continue
+        collected.append(piece)
+        total += len(piece) + len(separator)
+        if total >= max_length:
+            break
+    return sanitize_content(separator.join(collected))[:max_length]
+
+
+def extract_pdf_content(file_content: bytes, max_length: int) -> str:
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+    # 按页惰性提取：达到长度上限后剩余页面不会被解析
+    return _collect_until((page.extract_text() for page in pdf_reader.pages), '\n\n', max_length)
+
+
+def extract_docx_content(file_content: bytes, max_length: int) -> str:
+    doc = docx.Document(io.BytesIO(file_content))
+    return _collect_until((paragraph.text for paragraph in doc.paragraphs), '\n', max_length)
+
+
+def extract_content(file_content: bytes, file_extension: str, mime_type: str, text_extensions: frozenset, max_length: int) -> str:
+    """Extract sanitized text from one file; runs inside the extraction process pool."""
+    if file_extension in text_extensions or mime_type.startswith('text/'):
+        return extract_text_content(file_content, max_length)
+
+    elif file_extension == '.pdf':
+        return extract_pdf_content(file_content, max_length)
+
+    elif file_extension == '.docx':
+        return extract_docx_content(file_content, max_length)
+
+    else:
+        raise ValueError(f"Unsupported file format: {file_extension}. Only .txt, .pdf, and .docx files are supported.")
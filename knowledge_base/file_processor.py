@@ -5,17 +5,51 @@ import tempfile
 import shutil
 import asyncio
 import subprocess
-import re
-from typing import List, Dict, Any, Optional, Tuple
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Callable, Awaitable, Set
 from pathlib import Path
 import mimetypes
-import chardet
-
-import PyPDF2
-import docx
 
 from utils.logger import logger
-from services.supabase import DBConnection
+from services.postgresql import DBConnection
+from knowledge_base import extraction, retrieval
+
+# 文档解析（编码检测、PDF/DOCX 解析、清洗）都是 CPU 密集的同步操作，放到独立进程中执行，
+# 避免大文件或大 ZIP 阻塞 API 的事件循环。
+#
+# 每个工作进程是一个 max_workers=1 的 ProcessPoolExecutor，一次只借给一个提取任务：
+# 超时的任务无法取消，只能终止它所在的进程，这样只影响超时的那个文件，同时进行的其他提取
+# （包括同一个 ZIP 的其他成员）不受牵连。空闲进程留在 _idle_extraction_workers 里复用，
+# 同时借出的进程数由 _extraction_slots 限制为 EXTRACTION_WORKERS。
+_idle_extraction_workers: List[ProcessPoolExecutor] = []
+_extraction_slots: Optional[asyncio.Semaphore] = None
+
+# 归档导入的进度回调，参数为 processed_files / total_files / entries_created / failed_files
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def _get_extraction_slots(max_workers: int) -> asyncio.Semaphore:
+    global _extraction_slots
+    if _extraction_slots is None:
+        _extraction_slots = asyncio.Semaphore(max_workers)
+    return _extraction_slots
+
+
+def _lease_extraction_worker() -> ProcessPoolExecutor:
+    if _idle_extraction_workers:
+        return _idle_extraction_workers.pop()
+    # spawn：API 进程里有事件循环和其他线程，fork 出的子进程可能继承被占用的锁
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _kill_extraction_worker(worker: ProcessPoolExecutor):
+    """终止一个工作进程；它只运行过借用它的那一个任务"""
+    for process in list(getattr(worker, '_processes', {}).values()):
+        process.terminate()
+    worker.shutdown(wait=False, cancel_futures=True)
+
 
 class FileProcessor:
     SUPPORTED_TEXT_EXTENSIONS = {
@@ -29,6 +63,10 @@ class FileProcessor:
     MAX_FILE_SIZE = 50 * 1024 * 1024
     MAX_ZIP_ENTRIES = 1000
     MAX_CONTENT_LENGTH = 100000
+    EXTRACTION_WORKERS = 2
+    EXTRACTION_TIMEOUT = 60
+    INGEST_CONCURRENCY = 4
+    INSERT_BATCH_SIZE = 100
     
     def __init__(self):
         self.db = DBConnection()
@@ -39,7 +77,8 @@ class FileProcessor:
         account_id: str, 
         file_content: bytes, 
         filename: str, 
-        mime_type: str
+        mime_type: str,
+        progress_callback: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
         try:
             file_size = len(file_content)
@@ -49,7 +88,7 @@ class FileProcessor:
             file_extension = Path(filename).suffix.lower()
 
             if file_extension == '.zip':
-                return await self._process_zip_file(agent_id, account_id, file_content, filename)
+                return await self._process_zip_file(agent_id, account_id, file_content, filename, progress_callback)
             
             content = await self._extract_file_content(file_content, filename, mime_type)
             
@@ -77,11 +116,13 @@ class FileProcessor:
                 'is_active': True
             }
             
-            result = await client.table('agent_knowledge_base_entries').insert(entry_data).execute()
+            result = await client.table('agent_knowledge_base_entries').insert(entry_data)
             
             if not result.data:
                 raise Exception("Failed to create knowledge base entry")
             
+            await self._index_entries(result.data)
+            
             return {
                 'success': True,
                 'entry_id': result.data[0]['entry_id'],
@@ -98,103 +139,184 @@ class FileProcessor:
                 'error': str(e)
             }
     
+    async def _index_entries(self, entries: List[Dict[str, Any]]):
+        """写入后立即切分建立检索索引；失败时由检索侧在下次查询时补建"""
+        try:
+            await retrieval.index_entries(entries)
+        except Exception as e:
+            logger.warning(f"Failed to index {len(entries)} knowledge base entries for retrieval: {str(e)}")
+
+    async def _ingest_members(
+        self,
+        members: Iterable[Dict[str, Any]],
+        build_entry: Callable[[Dict[str, Any], str, int, str], Dict[str, Any]],
+        total_files: int,
+        progress_callback: Optional[ProgressCallback] = None
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Extract archive members concurrently and bulk-insert the resulting entries.
+
+        members 是惰性迭代的成员描述（filename / path / read 协程函数，可带 error 表示已跳过），
+        同时在处理中的成员数不超过 INGEST_CONCURRENCY；提取结果攒够 INSERT_BATCH_SIZE 条后
+        通过 insert_many 一次写入，每次写入后回调进度。
+        """
+        client = await self.db.client
+        semaphore = asyncio.Semaphore(self.INGEST_CONCURRENCY)
+        tasks: Set[asyncio.Task] = set()
+        pending: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+        extracted_files: List[Dict[str, Any]] = []
+        failed_files: List[Dict[str, Any]] = []
+        processed = 0
+
+        async def report_progress():
+            if progress_callback:
+                try:
+                    await progress_callback({
+                        'processed_files': processed,
+                        'total_files': total_files,
+                        'entries_created': len(extracted_files),
+                        'failed_files': len(failed_files)
+                    })
+                except Exception as e:
+                    logger.warning(f"Failed to report ingestion progress: {str(e)}")
+
+        async def flush():
+            if not pending:
+                return
+            batch = pending[:]
+            pending.clear()
+            try:
+                result = await client.table('agent_knowledge_base_entries').insert_many(
+                    [entry for _, entry in batch], batch_size=self.INSERT_BATCH_SIZE
+                )
+                for (info, _), row in zip(batch, result.data):
+                    extracted_files.append({**info, 'entry_id': row['entry_id']})
+            except Exception as e:
+                logger.error(f"Error inserting {len(batch)} knowledge base entries: {str(e)}")
+                failed_files.extend({**info, 'error': str(e)} for info, _ in batch)
+            else:
+                await self._index_entries(result.data)
+            await report_progress()
+
+        async def handle(member: Dict[str, Any]):
+            nonlocal processed
+            info = {'filename': member['filename'], 'path': member['path']}
+            try:
+                if member.get('error'):
+                    raise ValueError(member['error'])
+
+                file_content = await member['read']()
+                mime_type, _ = mimetypes.guess_type(member['filename'])
+                if not mime_type:
+                    mime_type = 'application/octet-stream'
+
+                content = await self._extract_file_content(file_content, member['filename'], mime_type)
+
+                if content and content.strip():
+                    entry = build_entry(member, content, len(file_content), mime_type)
+                    pending.append(({**info, 'content_length': len(content)}, entry))
+
+            except Exception as e:
+                logger.error(f"Error extracting {member['path']}: {str(e)}")
+                failed_files.append({**info, 'error': str(e)})
+            finally:
+                processed += 1
+                semaphore.release()
+
+        for member in members:
+            await semaphore.acquire()
+            task = asyncio.create_task(handle(member))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            if len(pending) >= self.INSERT_BATCH_SIZE:
+                await flush()
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        await flush()
+
+        return extracted_files, failed_files
+
     async def _process_zip_file(
         self, 
         agent_id: str, 
         account_id: str, 
         zip_content: bytes, 
-        zip_filename: str
+        zip_filename: str,
+        progress_callback: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
         try:
             client = await self.db.client
             
-            zip_entry_data = {
-                'agent_id': agent_id,
-                'account_id': account_id,
-                'name': f"📦 {zip_filename}",
-                'description': f"ZIP archive: {zip_filename}",
-                'content': f"ZIP archive containing multiple files. Extracted files will appear as separate entries.",
-                'source_type': 'file',
-                'source_metadata': {
-                    'filename': zip_filename,
-                    'mime_type': 'application/zip',
-                    'file_size': len(zip_content),
-                    'is_zip_container': True
-                },
-                'file_size': len(zip_content),
-                'file_mime_type': 'application/zip',
-                'usage_context': 'always',
-                'is_active': True
-            }
-            
-            zip_result = await client.table('agent_knowledge_base_entries').insert(zip_entry_data).execute()
-            zip_entry_id = zip_result.data[0]['entry_id']
-            
-            extracted_files = []
-            failed_files = []
-            
             with zipfile.ZipFile(io.BytesIO(zip_content), 'r') as zip_ref:
-                file_list = zip_ref.namelist()
+                # infolist 只读取中央目录，不解压任何成员
+                file_infos = [info for info in zip_ref.infolist() if not info.is_dir()]
                 
-                if len(file_list) > self.MAX_ZIP_ENTRIES:
-                    raise ValueError(f"ZIP contains too many files: {len(file_list)} (max: {self.MAX_ZIP_ENTRIES})")
+                if len(file_infos) > self.MAX_ZIP_ENTRIES:
+                    raise ValueError(f"ZIP contains too many files: {len(file_infos)} (max: {self.MAX_ZIP_ENTRIES})")
                 
-                for file_path in file_list:
-                    if file_path.endswith('/'):
-                        continue
-                    
-                    try:
-                        file_content = zip_ref.read(file_path)
-                        filename = os.path.basename(file_path)
-                        
+                zip_entry_data = {
+                    'agent_id': agent_id,
+                    'account_id': account_id,
+                    'name': f"📦 {zip_filename}",
+                    'description': f"ZIP archive: {zip_filename}",
+                    'content': f"ZIP archive containing multiple files. Extracted files will appear as separate entries.",
+                    'source_type': 'file',
+                    'source_metadata': {
+                        'filename': zip_filename,
+                        'mime_type': 'application/zip',
+                        'file_size': len(zip_content),
+                        'is_zip_container': True
+                    },
+                    'file_size': len(zip_content),
+                    'file_mime_type': 'application/zip',
+                    'usage_context': 'always',
+                    'is_active': True
+                }
+                
+                zip_result = await client.table('agent_knowledge_base_entries').insert(zip_entry_data)
+                zip_entry_id = zip_result.data[0]['entry_id']
+                
+                def iter_members():
+                    for info in file_infos:
+                        filename = os.path.basename(info.filename)
                         if not filename:
                             continue
-                        
-                        mime_type, _ = mimetypes.guess_type(filename)
-                        if not mime_type:
-                            mime_type = 'application/octet-stream'
-                        
-                        content = await self._extract_file_content(file_content, filename, mime_type)
-                        
-                        if content and content.strip():
-                            extracted_entry_data = {
-                                'agent_id': agent_id,
-                                'account_id': account_id,
-                                'name': f"📄 {filename}",
-                                'description': f"Extracted from {zip_filename}: {file_path}",
-                                'content': content[:self.MAX_CONTENT_LENGTH],
-                                'source_type': 'zip_extracted',
-                                'source_metadata': {
-                                    'filename': filename,
-                                    'original_path': file_path,
-                                    'zip_filename': zip_filename,
-                                    'mime_type': mime_type,
-                                    'file_size': len(file_content),
-                                    'extraction_method': self._get_extraction_method(Path(filename).suffix.lower(), mime_type)
-                                },
-                                'file_size': len(file_content),
-                                'file_mime_type': mime_type,
-                                'extracted_from_zip_id': zip_entry_id,
-                                'usage_context': 'always',
-                                'is_active': True
-                            }
-                            
-                            extracted_result = await client.table('agent_knowledge_base_entries').insert(extracted_entry_data).execute()
-                            
-                            extracted_files.append({
-                                'filename': filename,
-                                'path': file_path,
-                                'entry_id': extracted_result.data[0]['entry_id'],
-                                'content_length': len(content)
-                            })
-                        
-                    except Exception as e:
-                        logger.error(f"Error extracting {file_path} from ZIP: {str(e)}")
-                        failed_files.append({
-                            'filename': os.path.basename(file_path),
-                            'path': file_path,
-                            'error': str(e)
-                        })
+                        member = {
+                            'filename': filename,
+                            'path': info.filename,
+                            # 成员在处理时才解压，同一时刻内存中最多 INGEST_CONCURRENCY 个成员
+                            'read': lambda info=info: asyncio.to_thread(zip_ref.read, info)
+                        }
+                        if info.file_size > self.MAX_FILE_SIZE:
+                            member['error'] = f"File too large: {info.file_size} bytes (max: {self.MAX_FILE_SIZE})"
+                        yield member
+                
+                def build_entry(member: Dict[str, Any], content: str, file_size: int, mime_type: str) -> Dict[str, Any]:
+                    return {
+                        'agent_id': agent_id,
+                        'account_id': account_id,
+                        'name': f"📄 {member['filename']}",
+                        'description': f"Extracted from {zip_filename}: {member['path']}",
+                        'content': content[:self.MAX_CONTENT_LENGTH],
+                        'source_type': 'zip_extracted',
+                        'source_metadata': {
+                            'filename': member['filename'],
+                            'original_path': member['path'],
+                            'zip_filename': zip_filename,
+                            'mime_type': mime_type,
+                            'file_size': file_size,
+                            'extraction_method': self._get_extraction_method(Path(member['filename']).suffix.lower(), mime_type)
+                        },
+                        'file_size': file_size,
+                        'file_mime_type': mime_type,
+                        'extracted_from_zip_id': zip_entry_id,
+                        'usage_context': 'always',
+                        'is_active': True
+                    }
+                
+                extracted_files, failed_files = await self._ingest_members(
+                    iter_members(), build_entry, len(file_infos), progress_callback
+                )
             
             return {
                 'success': True,
@@ -221,7 +343,8 @@ class FileProcessor:
         git_url: str,
         branch: str = 'main',
         include_patterns: List[str] = None,
-        exclude_patterns: List[str] = None
+        exclude_patterns: List[str] = None,
+        progress_callback: Optional[ProgressCallback] = None
     ) -> Dict[str, Any]:
         if include_patterns is None:
             include_patterns = ['*.txt', '*.pdf', '*.docx']
@@ -264,12 +387,11 @@ class FileProcessor:
                 'is_active': True
             }
             
-            repo_result = await client.table('agent_knowledge_base_entries').insert(repo_entry_data).execute()
+            repo_result = await client.table('agent_knowledge_base_entries').insert(repo_entry_data)
             repo_entry_id = repo_result.data[0]['entry_id']
             
-            processed_files = []
-            failed_files = []
-            
+            # 先只收集路径（不读内容），得到总数用于进度汇报
+            candidate_paths = []
             for root, dirs, files in os.walk(temp_dir):
                 if '.git' in dirs:
                     dirs.remove('.git')
@@ -277,64 +399,58 @@ class FileProcessor:
                 for file in files:
                     file_path = os.path.join(root, file)
                     relative_path = os.path.relpath(file_path, temp_dir)
-                    
-                    if not self._should_include_file(relative_path, include_patterns, exclude_patterns):
-                        continue
-                    
+                    if self._should_include_file(relative_path, include_patterns, exclude_patterns):
+                        candidate_paths.append((file_path, relative_path))
+            
+            def iter_members():
+                for file_path, relative_path in candidate_paths:
                     try:
-                        with open(file_path, 'rb') as f:
-                            file_content = f.read()
-                        
-                        if len(file_content) > self.MAX_FILE_SIZE:
+                        if os.path.getsize(file_path) > self.MAX_FILE_SIZE:
                             continue
-                        
-                        mime_type, _ = mimetypes.guess_type(file)
-                        if not mime_type:
-                            mime_type = 'application/octet-stream'
-                        
-                        content = await self._extract_file_content(file_content, file, mime_type)
-                        
-                        if content and content.strip():
-                            file_entry_data = {
-                                'agent_id': agent_id,
-                                'account_id': account_id,
-                                'name': f"📄 {file}",
-                                'description': f"From {repo_name}: {relative_path}",
-                                'content': content[:self.MAX_CONTENT_LENGTH],
-                                'source_type': 'git_repo',
-                                'source_metadata': {
-                                    'filename': file,
-                                    'relative_path': relative_path,
-                                    'git_url': git_url,
-                                    'branch': branch,
-                                    'repo_name': repo_name,
-                                    'mime_type': mime_type,
-                                    'file_size': len(file_content),
-                                    'extraction_method': self._get_extraction_method(Path(file).suffix.lower(), mime_type)
-                                },
-                                'file_size': len(file_content),
-                                'file_mime_type': mime_type,
-                                'extracted_from_zip_id': repo_entry_id,
-                                'usage_context': 'always',
-                                'is_active': True
-                            }
-                            
-                            file_result = await client.table('agent_knowledge_base_entries').insert(file_entry_data).execute()
-                            
-                            processed_files.append({
-                                'filename': file,
-                                'relative_path': relative_path,
-                                'entry_id': file_result.data[0]['entry_id'],
-                                'content_length': len(content)
-                            })
-                    
-                    except Exception as e:
-                        logger.error(f"Error processing {relative_path} from git repo: {str(e)}")
-                        failed_files.append({
-                            'filename': file,
-                            'relative_path': relative_path,
-                            'error': str(e)
-                        })
+                    except OSError:
+                        continue
+                    yield {
+                        'filename': os.path.basename(file_path),
+                        'path': relative_path,
+                        'read': lambda file_path=file_path: asyncio.to_thread(Path(file_path).read_bytes)
+                    }
+            
+            def build_entry(member: Dict[str, Any], content: str, file_size: int, mime_type: str) -> Dict[str, Any]:
+                return {
+                    'agent_id': agent_id,
+                    'account_id': account_id,
+                    'name': f"📄 {member['filename']}",
+                    'description': f"From {repo_name}: {member['path']}",
+                    'content': content[:self.MAX_CONTENT_LENGTH],
+                    'source_type': 'git_repo',
+                    'source_metadata': {
+                        'filename': member['filename'],
+                        'relative_path': member['path'],
+                        'git_url': git_url,
+                        'branch': branch,
+                        'repo_name': repo_name,
+                        'mime_type': mime_type,
+                        'file_size': file_size,
+                        'extraction_method': self._get_extraction_method(Path(member['filename']).suffix.lower(), mime_type)
+                    },
+                    'file_size': file_size,
+                    'file_mime_type': mime_type,
+                    'extracted_from_zip_id': repo_entry_id,
+                    'usage_context': 'always',
+                    'is_active': True
+                }
+            
+            extracted_files, failed_files = await self._ingest_members(
+                iter_members(), build_entry, len(candidate_paths), progress_callback
+            )
+            processed_files = [
+                {'filename': info['filename'], 'relative_path': info['path'], 'entry_id': info['entry_id'], 'content_length': info['content_length']}
+                for info in extracted_files
+            ]
+            failed_files = [
+                {'filename': info['filename'], 'relative_path': info['path'], 'error': info['error']}
+                for info in failed_files
+            ]
             
             return {
                 'success': True,
@@ -364,70 +480,53 @@ class FileProcessor:
         file_extension = Path(filename).suffix.lower()
         
         try:
-            if file_extension in self.SUPPORTED_TEXT_EXTENSIONS or mime_type.startswith('text/'):
-                return self._extract_text_content(file_content)
-            
-            elif file_extension == '.pdf':
-                return self._extract_pdf_content(file_content)
-            
-            elif file_extension == '.docx':
-                return self._extract_docx_content(file_content)
-            
-            else:
-                raise ValueError(f"Unsupported file format: {file_extension}. Only .txt, .pdf, and .docx files are supported.")
+            return await self._run_extraction(file_content, file_extension, mime_type)
         
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out extracting content from {filename} after {self.EXTRACTION_TIMEOUT}s")
+            return f"Error extracting content: timed out after {self.EXTRACTION_TIMEOUT} seconds"
         except Exception as e:
             logger.error(f"Error extracting content from {filename}: {str(e)}")
             return f"Error extracting content: {str(e)}"
     
-    def _extract_text_content(self, file_content: bytes) -> str:
-        detected = chardet.detect(file_content)
-        encoding = detected.get('encoding', 'utf-8')
-        
-        try:
-            raw_text = file_content.decode(encoding)
-        except UnicodeDecodeError:
-            raw_text = file_content.decode('utf-8', errors='replace')
-        
-        return self._sanitize_content(raw_text)
-    
-    def _extract_pdf_content(self, file_content: bytes) -> str:
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-        text_content = []
-        
-        for page in pdf_reader.pages:
-            text_content.append(page.extract_text())
-        
-        raw_text = '\n\n'.join(text_content)
-        return self._sanitize_content(raw_text)
-    
-    def _extract_docx_content(self, file_content: bytes) -> str:
-        doc = docx.Document(io.BytesIO(file_content))
-        text_content = []
+    async def _run_extraction(self, file_content: bytes, file_extension: str, mime_type: str) -> str:
+        loop = asyncio.get_running_loop()
+        args = (
+            extraction.extract_content,
+            file_content,
+            file_extension,
+            mime_type,
+            frozenset(self.SUPPORTED_TEXT_EXTENSIONS),
+            self.MAX_CONTENT_LENGTH
+        )
         
-        for paragraph in doc.paragraphs:
-            text_content.append(paragraph.text)
+        async with _get_extraction_slots(self.EXTRACTION_WORKERS):
+            for attempt in range(2):
+                worker = _lease_extraction_worker()
+                try:
+                    result = await asyncio.wait_for(loop.run_in_executor(worker, *args), timeout=self.EXTRACTION_TIMEOUT)
+                except asyncio.TimeoutError:
+                    _kill_extraction_worker(worker)
+                    raise
+                except BrokenProcessPool:
+                    # 只可能是这个任务自己的进程崩溃（或空闲时被系统杀掉），换一个新进程重试一次
+                    _kill_extraction_worker(worker)
+                    if attempt:
+                        raise
+                    continue
+                except asyncio.CancelledError:
+                    # 调用方取消时进程可能仍在运行，不能再借给其他任务
+                    _kill_extraction_worker(worker)
+                    raise
+                except Exception:
+                    # 解析本身抛出的异常，进程仍然可用
+                    _idle_extraction_workers.append(worker)
+                    raise
+                _idle_extraction_workers.append(worker)
+                return result
         
-        raw_text = '\n'.join(text_content)
-        return self._sanitize_content(raw_text)
-    
-    
     def _sanitize_content(self, content: str) -> str:
-        if not content:
-            return content
-
-        sanitized = ''.join(char for char in content if ord(char) >= 32 or char in '\n\r\t')
-
-        sanitized = sanitized.replace('\x00', '')
-        sanitized = sanitized.replace('\u0000', '')
-        
-        sanitized = sanitized.replace('\ufeff', '')
-        
-        sanitized = sanitized.replace('\r\n', '\n').replace('\r', '\n')
-
-        sanitized = re.sub(r'\n{4,}', '\n\n\n', sanitized)
-
-        return sanitized.strip()
+        return extraction.sanitize_content(content)
 
     def _get_extraction_method(self, file_extension: str, mime_type: str) -> str:
         if file_extension == '.pdf':
@@ -0,0 +1,376 @@
+"""
+Query-time retrieval for agent knowledge bases.
+
+知识库条目在写入时切分为 chunk 存入 agent_knowledge_base_chunks；组装上下文时只取与
+当前问题最相关的 top-k 个 chunk，而不是按创建时间把整条条目拼进提示词。
+
+    - 词法检索：进程内 BM25 倒排索引。英文/数字按单词切分，中日韩文本按字符二元组切分，
+      不依赖 Postgres 的分词配置。
+    - 向量检索（可选）：配置 KB_EMBEDDING_MODEL 后 chunk 写入时计算 embedding，
+      检索时与 BM25 结果做倒数排名融合（RRF）。
+    - 每个 agent 的索引按 (chunk 数, 最近切分时间, 条目最近更新时间) 做版本校验后缓存在进程内；
+      手动创建或修改过的条目（chunked_at 落后于 updated_at）在检索时由后台任务补切分。
+"""
+
+import asyncio
+import json
+import math
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.postgresql import DBConnection, _build_insert_query, mark_read_your_writes
+from utils.config import config
+from utils.logger import logger
+
+CHUNK_MAX_CHARS = 1500
+CHUNK_OVERLAP_CHARS = 200
+EMBEDDING_BATCH_SIZE = 64
+INDEX_CACHE_SIZE = 64
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r'[a-z0-9_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+
+db = DBConnection()
+
+# agent_id -> (版本, 索引)
+_indexes: "OrderedDict[str, Tuple[Tuple, KnowledgeBaseIndex]]" = OrderedDict()
+# agent_id -> 正在运行的补切分任务
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """与 get_agent_knowledge_base_context 相同的粗略估计"""
+    return max(1, len(text) // 4)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        term = match.group()
+        if term.isascii():
+            tokens.append(term)
+        elif len(term) == 1:
+            tokens.append(term)
+        else:
+            tokens.extend(term[i:i + 2] for i in range(len(term) - 1))
+    return tokens
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_MAX_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> List[str]:
+    """按段落贪心打包成不超过 max_chars 的 chunk；超长段落按固定窗口切分并保留重叠"""
+    chunks: List[str] = []
+    current = ''
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            step = max(1, max_chars - overlap)
+            for start in range(0, len(paragraph), step):
+                chunks.append(paragraph[start:start + max_chars])
+                if start + max_chars >= len(paragraph):
+                    break
+            continue
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _normalize(vector: Optional[List[float]]) -> Optional[List[float]]:
+    if not vector:
+        return None
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else None
+
+
+class KnowledgeBaseIndex:
+    """In-process BM25 inverted index over one agent's chunks, with optional vectors."""
+
+    def __init__(self, chunks: List[Dict[str, Any]]):
+        self.chunks = chunks
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._doc_lengths: List[int] = []
+        for doc_id, chunk in enumerate(chunks):
+            terms = Counter(tokenize(chunk['content']))
+            self._doc_lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self._postings.setdefault(term, []).append((doc_id, frequency))
+        self._avg_length = (sum(self._doc_lengths) / len(chunks)) if chunks else 0.0
+        self._vectors = [_normalize(chunk.get('embedding')) for chunk in chunks]
+        self.has_vectors = any(vector is not None for vector in self._vectors)
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        scores: Dict[int, float] = {}
+        total = len(self.chunks)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self._doc_lengths[doc_id] / (self._avg_length or 1)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def vector_search(self, query_vector: List[float], limit: int) -> List[Tuple[int, float]]:
+        query_vector = _normalize(query_vector)
+        if not query_vector:
+            return []
+        scores = [
+            (doc_id, sum(a * b for a, b in zip(query_vector, vector)))
+            for doc_id, vector in enumerate(self._vectors)
+            if vector is not None
+        ]
+        return sorted(scores, key=lambda item: item[1], reverse=True)[:limit]
+
+
+async def _embed(texts: List[str]) -> Optional[List[List[float]]]:
+    if not config.KB_EMBEDDING_MODEL or not texts:
+        return None
+    try:
+        import litellm
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            response = await litellm.aembedding(model=config.KB_EMBEDDING_MODEL, input=texts[start:start + EMBEDDING_BATCH_SIZE])
+            vectors.extend(item['embedding'] for item in response.data)
+        return vectors
+    except Exception as e:
+        logger.warning(f"Failed to compute knowledge base embeddings, using lexical retrieval only: {e}")
+        return None
+
+
+async def index_entries(entries: List[Dict[str, Any]]) -> int:
+    """(Re)build the chunks of the given entries; each needs entry_id, agent_id and content.
+
+    切分和 embedding 在事务外完成；写入时在同一个事务里先把条目的 chunked_at 推进到
+    updated_at（行锁让并发的索引请求按条目串行，后到的请求看到已切分直接跳过），再删除旧
+    chunk 写入新 chunk。没有内容或切不出 chunk 的条目同样会被标记，不会一直被当作待切分。
+    """
+    if not entries:
+        return 0
+
+    records_by_entry: Dict[Any, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        records_by_entry[entry['entry_id']] = [
+            {
+                'entry_id': entry['entry_id'],
+                'agent_id': entry['agent_id'],
+                'chunk_index': chunk_index,
+                'content': content,
+                'token_count': estimate_tokens(content),
+            }
+            for chunk_index, content in enumerate(chunk_text(entry.get('content') or ''))
+        ]
+
+    records = [record for entry_records in records_by_entry.values() for record in entry_records]
+    vectors = await _embed([record['content'] for record in records])
+    if vectors:
+        for record, vector in zip(records, vectors):
+            record['embedding'] = vector
+
+    count = 0
+    client = await db.client
+    async with client.pool.acquire() as conn, conn.transaction():
+        # 固定加锁顺序，避免两个批次互相等待
+        for entry in sorted(entries, key=lambda entry: str(entry['entry_id'])):
+            claimed = await conn.fetchval(
+                """
+                UPDATE agent_knowledge_base_entries
+                SET chunked_at = updated_at
+                WHERE entry_id = $1
+                  AND ($2::timestamptz IS NULL OR updated_at = $2)
+                  AND chunked_at IS DISTINCT FROM updated_at
+                RETURNING entry_id
+                """,
+                entry['entry_id'], entry.get('updated_at')
+            )
+            if not claimed:
+                # 已被其他请求切分，或读取之后又被修改（由下一次刷新处理）
+                continue
+            await conn.execute("DELETE FROM agent_knowledge_base_chunks WHERE entry_id = $1", entry['entry_id'])
+            entry_records = records_by_entry[entry['entry_id']]
+            if entry_records:
+                columns = list(entry_records[0].keys())
+                query, params = _build_insert_query('agent_knowledge_base_chunks', columns, entry_records, returning=None)
+                await conn.execute(query, *params)
+                count += len(entry_records)
+    mark_read_your_writes()
+    return count
+
+
+async def _refresh_stale_entries(agent_id: str):
+    """补切分在上次切分之后新建或被修改过的条目"""
+    client = await db.client
+    async with client.pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT e.entry_id, e.agent_id, e.content, e.updated_at
+            FROM agent_knowledge_base_entries e
+            WHERE e.agent_id = $1
+              AND e.is_active = TRUE
+              AND e.chunked_at IS DISTINCT FROM e.updated_at
+            """,
+            agent_id
+        )
+    if rows:
+        count = await index_entries([dict(row) for row in rows])
+        logger.info(f"Indexed {len(rows)} stale knowledge base entries for agent {agent_id} ({count} chunks)")
+
+
+def schedule_refresh(agent_id: str):
+    """在后台补切分该 agent 的过期条目；同一 agent 同时只跑一个刷新任务"""
+    task = _refresh_tasks.get(agent_id)
+    if task and not task.done():
+        return
+
+    async def refresh():
+        try:
+            await _refresh_stale_entries(agent_id)
+        except Exception as e:
+            logger.warning(f"Failed to refresh knowledge base chunks for agent {agent_id}: {e}")
+        finally:
+            _refresh_tasks.pop(agent_id, None)
+
+    _refresh_tasks[agent_id] = asyncio.create_task(refresh())
+
+
+async def _get_index(agent_id: str) -> KnowledgeBaseIndex:
+    client = await db.client
+    async with client.pool.acquire() as conn:
+        version_row = await conn.fetchrow(
+            """
+            SELECT COUNT(c.chunk_id) AS chunk_count, MAX(c.created_at) AS chunked_at, MAX(e.updated_at) AS updated_at,
+                   BOOL_OR(e.chunked_at IS DISTINCT FROM e.updated_at) AS stale
+            FROM agent_knowledge_base_entries e
+            LEFT JOIN agent_knowledge_base_chunks c ON c.entry_id = e.entry_id
+            WHERE e.agent_id = $1 AND e.is_active = TRUE AND e.usage_context IN ('always', 'contextual')
+            """,
+            agent_id
+        )
+        version = tuple(version_row.values()) if version_row else ()
+        if version_row and version_row['stale']:
+            # 查询路径不等待切分，先用现有 chunk 回答
+            schedule_refresh(agent_id)
+
+        cached = _indexes.get(agent_id)
+        if cached and cached[0] == version:
+            _indexes.move_to_end(agent_id)
+            return cached[1]
+
+        rows = await conn.fetch(
+            """
+            SELECT c.chunk_id, c.entry_id, c.chunk_index, c.content, c.token_count, c.embedding, e.name
+            FROM agent_knowledge_base_chunks c
+            JOIN agent_knowledge_base_entries e ON e.entry_id = c.entry_id
+            WHERE c.agent_id = $1 AND e.is_active = TRUE AND e.usage_context IN ('always', 'contextual')
+            ORDER BY e.created_at DESC, c.chunk_index
+            """,
+            agent_id
+        )
+
+    index = KnowledgeBaseIndex([dict(row) for row in rows])
+    _indexes[agent_id] = (version, index)
+    _indexes.move_to_end(agent_id)
+    while len(_indexes) > INDEX_CACHE_SIZE:
+        _indexes.popitem(last=False)
+    return index
+
+
+async def retrieve_chunks(agent_id: str, query: str, top_k: int = 8) -> List[Dict[str, Any]]:
+    """Top-k chunks for the query; BM25, fused with vector similarity when embeddings exist."""
+    index = await _get_index(agent_id)
+    if not index.chunks or not query.strip():
+        return []
+
+    candidates = max(top_k * 4, 20)
+    rankings = [index.search(query, candidates)]
+    if index.has_vectors:
+        query_vectors = await _embed([query])
+        if query_vectors:
+            rankings.append(index.vector_search(query_vectors[0], candidates))
+
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+
+    top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [{**index.chunks[doc_id], 'score': score} for doc_id, score in top]
+
+
+async def build_context(agent_id: str, query: str, max_tokens: int = 4000, top_k: int = 8) -> Optional[str]:
+    """Assemble the knowledge base prompt section from the chunks relevant to ``query``."""
+    chunks = await retrieve_chunks(agent_id, query, top_k)
+
+    selected = []
+    used_tokens = 0
+    for chunk in chunks:
+        if used_tokens + chunk['token_count'] > max_tokens:
+            continue
+        selected.append(chunk)
+        used_tokens += chunk['token_count']
+    if not selected:
+        return None
+
+    # 同一条目的 chunk 放在一起并按原文顺序排列
+    by_entry: "OrderedDict[Any, List[Dict[str, Any]]]" = OrderedDict()
+    for chunk in selected:
+        by_entry.setdefault(chunk['entry_id'], []).append(chunk)
+
+    sections = []
+    usage_log = []
+    for entry_id, entry_chunks in by_entry.items():
+        entry_chunks.sort(key=lambda chunk: chunk['chunk_index'])
+        sections.append(f"## {entry_chunks[0]['name']}\n" + '\n\n...\n\n'.join(chunk['content'] for chunk in entry_chunks))
+        usage_log.append({
+            'entry_id': entry_id,
+            'agent_id': agent_id,
+            'usage_type': 'context_injection',
+            'tokens_used': sum(chunk['token_count'] for chunk in entry_chunks),
+        })
+
+    try:
+        client = await db.client
+        await client.table('agent_knowledge_base_usage_log').insert_many(usage_log, returning='log_id')
+    except Exception as e:
+        logger.warning(f"Failed to log knowledge base usage for agent {agent_id}: {e}")
+
+    return (
+        "# AGENT KNOWLEDGE BASE\n\n"
+        "The following excerpts from your specialized knowledge base are relevant to the current request. "
+        "Use this information as context when responding:\n\n" + '\n\n'.join(sections)
+    )
+
+
+async def get_latest_user_message(thread_id: str) -> Optional[str]:
+    """线程中最近一条用户消息的文本，用作检索查询"""
+    client = await db.client
+    result = await client.table('events').select('content').eq('session_id', thread_id).eq('author', 'user')\
+        .order('timestamp', desc=True).limit(1).execute()
+    if not result.data:
+        return None
+    content = result.data[0].get('content')
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except json.JSONDecodeError:
+            return content
+    if isinstance(content, dict):
+        parts = content.get('parts')
+        if isinstance(parts, list):
+            return ' '.join(part.get('text', '') for part in parts if isinstance(part, dict)).strip()
+        return content.get('content')
+    return None
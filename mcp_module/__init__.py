@@ -15,6 +15,7 @@ from .mcp_service import (
     MCPAuthenticationError,
     CustomMCPError,
 )
+from .session_pool import MCPSessionPool, get_mcp_session_pool
 
 __all__ = [
     "MCPService",
@@ -29,5 +30,7 @@ __all__ = [
     "MCPProviderError",
     "MCPConfigurationError",
     "MCPAuthenticationError",
-    "CustomMCPError"
+    "CustomMCPError",
+    "MCPSessionPool",
+    "get_mcp_session_pool"
 ] 
\ No newline at end of file
@@ -8,12 +8,10 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from collections import OrderedDict
 
-from mcp import ClientSession
-from mcp.client.sse import sse_client
-from mcp.client.streamable_http import streamablehttp_client
 
 from utils.logger import logger
 from credentials import EncryptionService
+from .session_pool import get_mcp_session_pool
 
 
 class MCPException(Exception):
@@ -49,7 +47,9 @@ class MCPConnection:
     enabled_tools: List[str]
     provider: str = 'custom'
     external_user_id: Optional[str] = None
-    session: Optional[ClientSession] = field(default=None, compare=False)
+    # 会话本身由 session_pool 持有，这里只记录定位池中会话所需的 URL 和 headers
+    url: Optional[str] = field(default=None, compare=False)
+    headers: Optional[Dict[str, str]] = field(default=None, compare=False)
     tools: Optional[List[Any]] = field(default=None, compare=False)
 
 
@@ -101,11 +101,12 @@ class MCPService:
         self._connections: Dict[str, MCPConnection] = {}
         self._encryption_service = EncryptionService()
 
-    async def connect_server(self, mcp_config: Dict[str, Any], external_user_id: Optional[str] = None) -> MCPConnection:
+    @staticmethod
+    def _build_request(mcp_config: Dict[str, Any], external_user_id: Optional[str] = None) -> MCPConnectionRequest:
         # Determine provider from type field
         provider = mcp_config.get('type', mcp_config.get('provider', 'custom'))
         
-        request = MCPConnectionRequest(
+        return MCPConnectionRequest(
             qualified_name=mcp_config.get('qualifiedName', mcp_config.get('name', '')),
             name=mcp_config.get('name', ''),
             config=mcp_config.get('config', {}),
@@ -113,7 +114,39 @@ class MCPService:
             provider=provider,  # Use the determined provider
             external_user_id=external_user_id
         )
-        return await self._connect_server_internal(request)
+    
+    async def connect_server(self, mcp_config: Dict[str, Any], external_user_id: Optional[str] = None) -> MCPConnection:
+        return await self._connect_server_internal(self._build_request(mcp_config, external_user_id))
+    
+    async def restore_connection(self, mcp_config: Dict[str, Any], tools: List[Dict[str, Any]],
+                                 external_user_id: Optional[str] = None) -> MCPConnection:
+        """Register a connection from cached tool definitions without contacting the server.
+
+        会话在第一次调用工具时才由 session_pool 建立。
+        """
+        from mcp.types import Tool
+        
+        request = self._build_request(mcp_config, external_user_id)
+        server_url = await self._get_server_url(request.qualified_name, request.config, request.provider)
+        headers = self._get_headers(request.qualified_name, request.config, request.provider, request.external_user_id)
+        
+        connection = MCPConnection(
+            qualified_name=request.qualified_name,
+            name=request.name,
+            config=request.config,
+            enabled_tools=request.enabled_tools,
+            provider=request.provider,
+            external_user_id=request.external_user_id,
+            url=server_url,
+            headers=headers,
+            tools=[
+                Tool(name=tool['name'], description=tool.get('description'), inputSchema=tool.get('input_schema') or {})
+                for tool in tools
+            ]
+        )
+        self._connections[request.qualified_name] = connection
+        self._logger.info(f"Restored {request.qualified_name} from cached schemas ({len(tools)} tools)")
+        return connection
     
     async def _connect_server_internal(self, request: MCPConnectionRequest) -> MCPConnection:
         self._logger.info(f"Connecting to MCP server: {request.qualified_name}")
@@ -127,30 +160,24 @@ class MCPService:
             
             # Add timeout to prevent hanging
             async with asyncio.timeout(30):
-                async with streamablehttp_client(server_url, headers=headers) as (
-                    read_stream, write_stream, _
-                ):
-                    session = ClientSession(read_stream, write_stream)
-                    await session.initialize()
-                    
-                    tool_result = await session.list_tools()
-                    tools = tool_result.tools if tool_result else []
-                    
-                    connection = MCPConnection(
-                        qualified_name=request.qualified_name,
-                        name=request.name,
-                        config=request.config,
-                        enabled_tools=request.enabled_tools,
-                        provider=request.provider,
-                        external_user_id=request.external_user_id,
-                        session=session,
-                        tools=tools
-                    )
-                    
-                    self._connections[request.qualified_name] = connection
-                    self._logger.info(f"Connected to {request.qualified_name} ({len(tools)} tools available)")
-                    
-                    return connection
+                tools = await get_mcp_session_pool().list_tools('http', url=server_url, headers=headers) or []
+            
+            connection = MCPConnection(
+                qualified_name=request.qualified_name,
+                name=request.name,
+                config=request.config,
+                enabled_tools=request.enabled_tools,
+                provider=request.provider,
+                external_user_id=request.external_user_id,
+                url=server_url,
+                headers=headers,
+                tools=tools
+            )
+            
+            self._connections[request.qualified_name] = connection
+            self._logger.info(f"Connected to {request.qualified_name} ({len(tools)} tools available)")
+            
+            return connection
                     
         except asyncio.TimeoutError:
             error_msg = f"Connection timeout for {request.qualified_name} after 30 seconds"
@@ -185,9 +212,10 @@ class MCPService:
     
     async def disconnect_server(self, qualified_name: str) -> None:
         connection = self._connections.get(qualified_name)
-        if connection and connection.session:
+        if connection and connection.url:
             try:
-                await connection.session.close()
+                pool = get_mcp_session_pool()
+                await pool.discard(pool.make_key('http', connection.url, connection.headers))
                 self._logger.info(f"Disconnected from {qualified_name}")
             except Exception as e:
                 self._logger.warning(f"Error disconnecting from {qualified_name}: {str(e)}")
@@ -244,14 +272,16 @@ class MCPService:
         if not connection:
             raise MCPToolNotFoundError(f"Tool not found: {request.tool_name}")
         
-        if not connection.session:
+        if not connection.url:
             raise MCPToolExecutionError(f"No active session for tool: {request.tool_name}")
         
         if request.tool_name not in connection.enabled_tools:
             raise MCPToolExecutionError(f"Tool not enabled: {request.tool_name}")
         
         try:
-            result = await connection.session.call_tool(request.tool_name, request.arguments)
+            result = await get_mcp_session_pool().call_tool(
+                'http', request.tool_name, request.arguments, url=connection.url, headers=connection.headers
+            )
             
             self._logger.info(f"Tool {request.tool_name} executed successfully")
             
@@ -307,28 +337,25 @@ class MCPService:
             raise CustomMCPError("URL is required for HTTP MCP connections")
         
         try:
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tool_result = await session.list_tools()
-                    
-                    tools_info = []
-                    for tool in tool_result.tools:
-                        tools_info.append({
-                            "name": tool.name,
-                            "description": tool.description,
-                            "inputSchema": tool.inputSchema
-                        })
-                    
-                    return CustomMCPConnectionResult(
-                        success=True,
-                        qualified_name=f"custom_http_{url.split('/')[-1]}",
-                        display_name=f"Custom HTTP MCP ({url})",
-                        tools=tools_info,
-                        config=config,
-                        url=url,
-                        message=f"Connected via HTTP ({len(tools_info)} tools)"
-                    )
+            tools = await get_mcp_session_pool().list_tools('http', url=url)
+            
+            tools_info = []
+            for tool in tools:
+                tools_info.append({
+                    "name": tool.name,
+                    "description": tool.description,
+                    "inputSchema": tool.inputSchema
+                })
+            
+            return CustomMCPConnectionResult(
+                success=True,
+                qualified_name=f"custom_http_{url.split('/')[-1]}",
+                display_name=f"Custom HTTP MCP ({url})",
+                tools=tools_info,
+                config=config,
+                url=url,
+                message=f"Connected via HTTP ({len(tools_info)} tools)"
+            )
         
         except Exception as e:
             self._logger.error(f"Error connecting to HTTP MCP server: {str(e)}")
@@ -348,28 +375,25 @@ class MCPService:
             raise CustomMCPError("URL is required for SSE MCP connections")
         
         try:
-            async with sse_client(url) as (read_stream, write_stream):
-                async with ClientSession(read_stream, write_stream) as session:
-                    await session.initialize()
-                    tool_result = await session.list_tools()
-                    
-                    tools_info = []
-                    for tool in tool_result.tools:
-                        tools_info.append({
-                            "name": tool.name,
-                            "description": tool.description,
-                            "inputSchema": tool.inputSchema
-                        })
-                    
-                    return CustomMCPConnectionResult(
-                        success=True,
-                        qualified_name=f"custom_sse_{url.split('/')[-1]}",
-                        display_name=f"Custom SSE MCP ({url})",
-                        tools=tools_info,
-                        config=config,
-                        url=url,
-                        message=f"Connected via SSE ({len(tools_info)} tools)"
-                    )
+            tools = await get_mcp_session_pool().list_tools('sse', url=url)
+            
+            tools_info = []
+            for tool in tools:
+                tools_info.append({
+                    "name": tool.name,
+                    "description": tool.description,
+                    "inputSchema": tool.inputSchema
+                })
+            
+            return CustomMCPConnectionResult(
+                success=True,
+                qualified_name=f"custom_sse_{url.split('/')[-1]}",
+                display_name=f"Custom SSE MCP ({url})",
+                tools=tools_info,
+                config=config,
+                url=url,
+                message=f"Connected via SSE ({len(tools_info)} tools)"
+            )
         
         except Exception as e:
             self._logger.error(f"Error connecting to SSE MCP server: {str(e)}")
@@ -0,0 +1,285 @@
+"""
+Keep-alive MCP client sessions shared by MCPService, MCPToolExecutor and CustomMCPHandler.
+
+以前每次工具调用 / 列工具都要新建 sse_client / streamablehttp_client + ClientSession 并执行 initialize()，
+每次多出一整次握手（通常 300ms–2s）。会话池按 (传输方式, URL, headers 指纹) 复用已初始化的会话：
+
+    - 每个会话由一个后台任务持有：anyio 的传输上下文必须在同一个任务里进入和退出，
+      其他任务只通过 ClientSession 发请求；
+    - 同一服务器的并发请求数受 MCP_SESSION_MAX_CONCURRENCY 限制；
+    - 空闲超过 MCP_SESSION_HEALTH_CHECK_INTERVAL 的会话在复用前先 ping，失败则重连；
+    - 空闲超过 MCP_SESSION_IDLE_TTL 的会话由后台任务关闭；
+    - 请求因连接已断开而没能发出时（写入已关闭的流），丢弃会话并重连重试一次。
+      已经发出的 call_tool 不会重试，避免非幂等工具被执行两次。
+
+池按事件循环隔离：会话及其后台任务只能在创建它们的事件循环里使用。
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+import weakref
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import anyio
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from utils.config import config
+from utils.logger import logger
+
+# 请求还没发出去连接就已经断开时抛出的异常，可以安全地重连重试
+_STALE_CONNECTION_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError)
+
+_REAPER_INTERVAL = 30
+
+
+def _fingerprint(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+class _PooledSession:
+    """One initialized ClientSession kept open by its own owner task."""
+
+    def __init__(self, key: Tuple[str, ...], transport: str, url: Optional[str], headers: Optional[Dict[str, str]],
+                 server_params: Optional[StdioServerParameters], max_concurrency: int):
+        self.key = key
+        self.transport = transport
+        self.url = url
+        self.headers = headers
+        self.server_params = server_params
+        self.semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.session: Optional[ClientSession] = None
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self._ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._closing.is_set()
+
+    def describe(self) -> str:
+        if self.transport == 'stdio':
+            return f"stdio:{self.server_params.command}"
+        return f"{self.transport}:{self.url}"
+
+    async def start(self, timeout: float) -> ClientSession:
+        self._task = asyncio.create_task(self._run())
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._ready), timeout=timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _open_transport(self, stack: AsyncExitStack):
+        if self.transport == 'sse':
+            try:
+                streams = await stack.enter_async_context(sse_client(self.url, headers=self.headers or None))
+            except TypeError as e:
+                # 旧版本 sse_client 不支持 headers 参数
+                if "unexpected keyword argument" not in str(e):
+                    raise
+                streams = await stack.enter_async_context(sse_client(self.url))
+        elif self.transport == 'http':
+            if self.headers:
+                streams = await stack.enter_async_context(streamablehttp_client(self.url, headers=self.headers))
+            else:
+                streams = await stack.enter_async_context(streamablehttp_client(self.url))
+        elif self.transport == 'stdio':
+            streams = await stack.enter_async_context(stdio_client(self.server_params))
+        else:
+            raise ValueError(f"Unsupported MCP transport: {self.transport}")
+        return streams[0], streams[1]
+
+    async def _run(self):
+        try:
+            async with AsyncExitStack() as stack:
+                read_stream, write_stream = await self._open_transport(stack)
+                session = await stack.enter_async_context(ClientSession(read_stream, write_stream))
+                await session.initialize()
+                self.session = session
+                self._ready.set_result(session)
+                logger.info(f"Opened pooled MCP session {self.describe()}")
+                await self._closing.wait()
+        except asyncio.CancelledError:
+            if not self._ready.done():
+                self._ready.set_exception(ConnectionError(f"MCP session {self.describe()} was cancelled while connecting"))
+            raise
+        except BaseException as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            else:
+                logger.warning(f"Pooled MCP session {self.describe()} terminated: {e}")
+        finally:
+            self._closing.set()
+            logger.debug(f"Closed pooled MCP session {self.describe()}")
+
+    async def close(self):
+        self._closing.set()
+        if self._task is None or self._task.done():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=5)
+        except BaseException:
+            self._task.cancel()
+        # 没人等待的连接失败不应产生 "exception was never retrieved" 警告
+        if self._ready.done() and not self._ready.cancelled():
+            self._ready.exception()
+
+
+class MCPSessionPool:
+    def __init__(self):
+        self._entries: Dict[Tuple[str, ...], _PooledSession] = {}
+        self._connect_locks: Dict[Tuple[str, ...], asyncio.Lock] = {}
+        self._reaper_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def make_key(transport: str, url: Optional[str] = None, headers: Optional[Dict[str, str]] = None,
+                 server_params: Optional[StdioServerParameters] = None) -> Tuple[str, ...]:
+        if transport == 'stdio':
+            return (transport, _fingerprint([server_params.command, list(server_params.args or []), server_params.env or {}]))
+        return (transport, url or '', _fingerprint(headers or {}))
+
+    async def _get_entry(self, key: Tuple[str, ...], transport: str, url: Optional[str], headers: Optional[Dict[str, str]],
+                         server_params: Optional[StdioServerParameters]) -> _PooledSession:
+        entry = self._entries.get(key)
+        if entry is not None and entry.alive and await self._healthy(entry):
+            return entry
+
+        lock = self._connect_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # 等锁期间其他调用方可能已经建好了连接
+            entry = self._entries.get(key)
+            if entry is not None and entry.alive:
+                return entry
+            if entry is not None:
+                await self.discard(key)
+
+            entry = _PooledSession(key, transport, url, headers, server_params, config.MCP_SESSION_MAX_CONCURRENCY)
+            await entry.start(config.MCP_SESSION_CONNECT_TIMEOUT)
+            self._entries[key] = entry
+            self._ensure_reaper()
+            return entry
+
+    async def _healthy(self, entry: _PooledSession) -> bool:
+        interval = config.MCP_SESSION_HEALTH_CHECK_INTERVAL
+        if interval <= 0 or entry.in_use or time.monotonic() - entry.last_used < interval:
+            return True
+        try:
+            await asyncio.wait_for(entry.session.send_ping(), timeout=min(5, config.MCP_SESSION_CONNECT_TIMEOUT))
+            entry.last_used = time.monotonic()
+            return True
+        except Exception as e:
+            logger.info(f"Health check failed for MCP session {entry.describe()}, reconnecting: {e}")
+            await self._discard_entry(entry)
+            return False
+
+    @asynccontextmanager
+    async def _borrow(self, transport: str, url: Optional[str], headers: Optional[Dict[str, str]],
+                      server_params: Optional[StdioServerParameters]) -> AsyncIterator[_PooledSession]:
+        key = self.make_key(transport, url, headers, server_params)
+        entry = await self._get_entry(key, transport, url, headers, server_params)
+        async with entry.semaphore:
+            entry.in_use += 1
+            try:
+                yield entry
+            finally:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def session(self, transport: str, url: Optional[str] = None, headers: Optional[Dict[str, str]] = None,
+                      server_params: Optional[StdioServerParameters] = None) -> AsyncIterator[ClientSession]:
+        """Borrow a pooled, initialized session; concurrent borrowers of one server are capped by a semaphore."""
+        async with self._borrow(transport, url, headers, server_params) as entry:
+            yield entry.session
+
+    async def call_tool(self, transport: str, tool_name: str, arguments: Dict[str, Any], *, url: Optional[str] = None,
+                        headers: Optional[Dict[str, str]] = None, server_params: Optional[StdioServerParameters] = None):
+        for attempt in range(2):
+            entry = None
+            try:
+                async with self._borrow(transport, url, headers, server_params) as entry:
+                    return await entry.session.call_tool(tool_name, arguments)
+            except _STALE_CONNECTION_ERRORS as e:
+                if entry is not None:
+                    await self._discard_entry(entry)
+                if attempt:
+                    raise
+                logger.info(f"MCP connection for {tool_name} was closed before the call was sent, reconnecting: {e!r}")
+
+    async def list_tools(self, transport: str, *, url: Optional[str] = None, headers: Optional[Dict[str, str]] = None,
+                         server_params: Optional[StdioServerParameters] = None) -> List[Any]:
+        """List the server's tools; list_tools is idempotent, so a failure on an existing session is retried once."""
+        for attempt in range(2):
+            entry = None
+            try:
+                async with self._borrow(transport, url, headers, server_params) as entry:
+                    result = await entry.session.list_tools()
+                    return result.tools if hasattr(result, 'tools') else result
+            except Exception as e:
+                # 连接阶段的失败（entry 为 None）直接抛出，重试只针对复用的旧会话
+                if entry is None or attempt:
+                    raise
+                await self._discard_entry(entry)
+                logger.info(f"Listing MCP tools on a pooled session failed, reconnecting: {e!r}")
+
+    async def _discard_entry(self, entry: _PooledSession):
+        if self._entries.get(entry.key) is entry:
+            self._entries.pop(entry.key, None)
+        await entry.close()
+
+    async def discard(self, key: Tuple[str, ...]):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            await entry.close()
+
+    async def close_all(self):
+        for key in list(self._entries):
+            await self.discard(key)
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+
+    def _ensure_reaper(self):
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reap_idle_sessions())
+
+    async def _reap_idle_sessions(self):
+        while self._entries:
+            await asyncio.sleep(_REAPER_INTERVAL)
+            now = time.monotonic()
+            for key, entry in list(self._entries.items()):
+                if not entry.alive or (entry.in_use == 0 and now - entry.last_used > config.MCP_SESSION_IDLE_TTL):
+                    logger.debug(f"Evicting idle MCP session {entry.describe()}")
+                    await self._discard_entry(entry)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "server": entry.describe(),
+                "alive": entry.alive,
+                "in_use": entry.in_use,
+                "idle_seconds": round(now - entry.last_used, 1),
+            }
+            for entry in self._entries.values()
+        ]
+
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, MCPSessionPool]" = weakref.WeakKeyDictionary()
+
+
+def get_mcp_session_pool() -> MCPSessionPool:
+    """Session pool of the running event loop."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = MCPSessionPool()
+    return pool
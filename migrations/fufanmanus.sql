@@ -14,8 +14,12 @@ DROP TABLE IF EXISTS "app_states" CASCADE;
 DROP TABLE IF EXISTS "agent_runs" CASCADE;
 DROP TABLE IF EXISTS "agent_versions" CASCADE;
 DROP TABLE IF EXISTS "agent_workflows" CASCADE;
+DROP TABLE IF EXISTS "task_list_tasks" CASCADE;
+DROP TABLE IF EXISTS "task_list_sections" CASCADE;
+DROP TABLE IF EXISTS "task_lists" CASCADE;
 DROP TABLE IF EXISTS "threads" CASCADE;
 DROP TABLE IF EXISTS "messages" CASCADE;
+DROP TABLE IF EXISTS "usage_monthly_ledger" CASCADE;
 DROP TABLE IF EXISTS "projects" CASCADE;
 DROP TABLE IF EXISTS "agents" CASCADE;
 DROP TABLE IF EXISTS "user_activities" CASCADE;
@@ -140,6 +144,10 @@ CREATE TABLE "agents" (
   "profile_image_url" varchar(500) COLLATE "pg_catalog"."default",
   "current_version_id" varchar(128) COLLATE "pg_catalog"."default",
   "version_count" int4 DEFAULT 1,
+  "has_mcp_tools" bool DEFAULT false,
+  "has_agentpress_tools" bool DEFAULT false,
+  "tool_names" text[] COLLATE "pg_catalog"."default" DEFAULT '{}'::text[],
+  "tools_count" int4 DEFAULT 0,
   "metadata" jsonb DEFAULT '{}'::jsonb,
   "created_at" timestamptz(6) DEFAULT now(),
   "updated_at" timestamptz(6) DEFAULT now()
@@ -155,6 +163,10 @@ COMMENT ON COLUMN "agents"."agentpress_tools" IS 'AgentPress工具配置';
 COMMENT ON COLUMN "agents"."is_default" IS '是否为默认Agent';
 COMMENT ON COLUMN "agents"."current_version_id" IS '当前版本ID';
 COMMENT ON COLUMN "agents"."version_count" IS '版本数量';
+COMMENT ON COLUMN "agents"."has_mcp_tools" IS '当前版本是否配置了MCP工具';
+COMMENT ON COLUMN "agents"."has_agentpress_tools" IS '当前版本是否启用了AgentPress工具';
+COMMENT ON COLUMN "agents"."tool_names" IS '当前版本的工具列表（mcp:名称 / agentpress:工具名）';
+COMMENT ON COLUMN "agents"."tools_count" IS '当前版本的工具数量';
 COMMENT ON TABLE "agents" IS 'Agent管理表 - 存储用户的Agent配置';
 
 -- ----------------------------
@@ -293,6 +305,48 @@ CREATE TABLE "sessions" (
 COMMENT ON COLUMN "sessions"."id" IS '会话ID，与events表中的session_id对应';
 COMMENT ON TABLE "sessions" IS 'ADK框架会话管理';
 
+-- ----------------------------
+-- Table structure for task_lists
+-- ----------------------------
+CREATE TABLE "task_lists" (
+  "thread_id" varchar(128) COLLATE "pg_catalog"."default" NOT NULL,
+  "version" int4 NOT NULL DEFAULT 0,
+  "created_at" timestamptz(6) DEFAULT now(),
+  "updated_at" timestamptz(6) DEFAULT now()
+);
+COMMENT ON COLUMN "task_lists"."version" IS '乐观锁版本号，每次写入加一';
+COMMENT ON TABLE "task_lists" IS '任务清单表 - 每个线程一行，TaskListTool 写入时校验版本号';
+
+-- ----------------------------
+-- Table structure for task_list_sections
+-- ----------------------------
+CREATE TABLE "task_list_sections" (
+  "thread_id" varchar(128) COLLATE "pg_catalog"."default" NOT NULL,
+  "section_id" varchar(128) COLLATE "pg_catalog"."default" NOT NULL,
+  "title" text COLLATE "pg_catalog"."default" NOT NULL,
+  "position" int4 NOT NULL DEFAULT 0,
+  "created_at" timestamptz(6) DEFAULT now()
+);
+COMMENT ON COLUMN "task_list_sections"."position" IS '在清单中的顺序';
+COMMENT ON TABLE "task_list_sections" IS '任务清单分组表';
+
+-- ----------------------------
+-- Table structure for task_list_tasks
+-- ----------------------------
+CREATE TABLE "task_list_tasks" (
+  "thread_id" varchar(128) COLLATE "pg_catalog"."default" NOT NULL,
+  "task_id" varchar(128) COLLATE "pg_catalog"."default" NOT NULL,
+  "section_id" varchar(128) COLLATE "pg_catalog"."default" NOT NULL,
+  "content" text COLLATE "pg_catalog"."default" NOT NULL,
+  "status" varchar(20) COLLATE "pg_catalog"."default" NOT NULL DEFAULT 'pending'::character varying,
+  "position" int4 NOT NULL DEFAULT 0,
+  "created_at" timestamptz(6) DEFAULT now(),
+  "updated_at" timestamptz(6) DEFAULT now()
+);
+COMMENT ON COLUMN "task_list_tasks"."status" IS '任务状态：pending, completed, cancelled';
+COMMENT ON COLUMN "task_list_tasks"."position" IS '在清单中的顺序';
+COMMENT ON TABLE "task_list_tasks" IS '任务清单任务表 - 每个任务一行，状态更新只写一行';
+
 -- ----------------------------
 -- Table structure for threads
 -- ----------------------------
@@ -314,6 +368,27 @@ COMMENT ON COLUMN "threads"."status" IS '线程状态';
 COMMENT ON COLUMN "threads"."metadata" IS '线程元数据';
 COMMENT ON TABLE "threads" IS '线程表 - 存储项目中的对话线程';
 
+-- ----------------------------
+-- Table structure for usage_monthly_ledger
+-- ----------------------------
+CREATE TABLE "usage_monthly_ledger" (
+  "account_id" varchar(128) COLLATE "pg_catalog"."default" NOT NULL,
+  "month" date NOT NULL,
+  "total_cost" float8 NOT NULL DEFAULT 0,
+  "prompt_tokens" int8 NOT NULL DEFAULT 0,
+  "completion_tokens" int8 NOT NULL DEFAULT 0,
+  "message_count" int4 NOT NULL DEFAULT 0,
+  "last_message_at" timestamptz(6),
+  "reconciled_at" timestamptz(6),
+  "updated_at" timestamptz(6) DEFAULT now()
+);
+COMMENT ON COLUMN "usage_monthly_ledger"."account_id" IS '所属用户ID';
+COMMENT ON COLUMN "usage_monthly_ledger"."month" IS '统计月份（当月第一天，UTC）';
+COMMENT ON COLUMN "usage_monthly_ledger"."total_cost" IS '当月累计费用（美元，已乘价格系数）';
+COMMENT ON COLUMN "usage_monthly_ledger"."message_count" IS '计入的 assistant_response_end 消息数';
+COMMENT ON COLUMN "usage_monthly_ledger"."reconciled_at" IS '最近一次全量对账时间';
+COMMENT ON TABLE "usage_monthly_ledger" IS '月度用量账本 - 写入 assistant_response_end 时增量累加';
+
 -- ----------------------------
 -- Table structure for user_activities
 -- ----------------------------
@@ -374,7 +449,11 @@ ALTER TABLE "oauth_providers" ADD CONSTRAINT "oauth_providers_pkey" PRIMARY KEY
 ALTER TABLE "projects" ADD CONSTRAINT "projects_pkey" PRIMARY KEY ("project_id");
 ALTER TABLE "refresh_tokens" ADD CONSTRAINT "refresh_tokens_pkey" PRIMARY KEY ("id");
 ALTER TABLE "sessions" ADD CONSTRAINT "sessions_pkey" PRIMARY KEY ("app_name", "user_id", "id");
+ALTER TABLE "task_list_sections" ADD CONSTRAINT "task_list_sections_pkey" PRIMARY KEY ("thread_id", "section_id");
+ALTER TABLE "task_list_tasks" ADD CONSTRAINT "task_list_tasks_pkey" PRIMARY KEY ("thread_id", "task_id");
+ALTER TABLE "task_lists" ADD CONSTRAINT "task_lists_pkey" PRIMARY KEY ("thread_id");
 ALTER TABLE "threads" ADD CONSTRAINT "threads_pkey" PRIMARY KEY ("thread_id");
+ALTER TABLE "usage_monthly_ledger" ADD CONSTRAINT "usage_monthly_ledger_pkey" PRIMARY KEY ("account_id", "month");
 ALTER TABLE "user_activities" ADD CONSTRAINT "user_activities_pkey" PRIMARY KEY ("id");
 ALTER TABLE "user_sessions" ADD CONSTRAINT "user_sessions_pkey" PRIMARY KEY ("id");
 ALTER TABLE "user_states" ADD CONSTRAINT "user_states_pkey" PRIMARY KEY ("app_name", "user_id");
@@ -407,6 +486,8 @@ CREATE INDEX "idx_agents_is_default" ON "agents" USING btree ("is_default");
 CREATE INDEX "idx_agents_updated_at" ON "agents" USING btree ("updated_at");
 CREATE INDEX "idx_agents_user_default" ON "agents" USING btree ("user_id", "is_default");
 CREATE INDEX "idx_agents_user_id" ON "agents" USING btree ("user_id");
+CREATE INDEX "idx_agents_user_tools_count" ON "agents" USING btree ("user_id", "tools_count");
+CREATE INDEX "idx_agents_tool_names" ON "agents" USING gin ("tool_names");
 
 -- app_states 索引
 CREATE INDEX "idx_app_states_app_name" ON "app_states" USING btree ("app_name");
@@ -416,6 +497,8 @@ CREATE INDEX "idx_app_states_update_time" ON "app_states" USING btree ("update_t
 CREATE INDEX "idx_events_app_name_user_id_session_id" ON "events" USING btree ("app_name", "user_id", "session_id");
 CREATE INDEX "idx_events_author" ON "events" USING btree ("author");
 CREATE INDEX "idx_events_timestamp" ON "events" USING btree ("timestamp");
+CREATE INDEX "idx_events_session_timestamp_id" ON "events" USING btree ("session_id", "timestamp", "id");
+CREATE INDEX "idx_events_session_checkpoint" ON "events" USING btree ("session_id", "timestamp") WHERE author = 'context_checkpoint';
 
 -- messages 索引
 CREATE INDEX "idx_messages_agent_id" ON "messages" USING btree ("agent_id");
@@ -425,6 +508,7 @@ CREATE INDEX "idx_messages_created_at" ON "messages" USING btree ("created_at");
 CREATE INDEX "idx_messages_is_llm_message" ON "messages" USING btree ("is_llm_message");
 CREATE INDEX "idx_messages_project_id" ON "messages" USING btree ("project_id");
 CREATE INDEX "idx_messages_thread_id" ON "messages" USING btree ("thread_id");
+CREATE INDEX "idx_messages_thread_created" ON "messages" USING btree ("thread_id", "created_at", "message_id");
 CREATE INDEX "idx_messages_thread_type" ON "messages" USING btree ("thread_id", "type");
 CREATE INDEX "idx_messages_type" ON "messages" USING btree ("type");
 
@@ -452,8 +536,13 @@ CREATE INDEX "idx_sessions_create_time" ON "sessions" USING btree ("create_time"
 CREATE INDEX "idx_sessions_id" ON "sessions" USING btree ("id");
 CREATE INDEX "idx_sessions_update_time" ON "sessions" USING btree ("update_time");
 
+-- task_list 索引
+CREATE INDEX "idx_task_list_sections_position" ON "task_list_sections" USING btree ("thread_id", "position");
+CREATE INDEX "idx_task_list_tasks_position" ON "task_list_tasks" USING btree ("thread_id", "position");
+
 -- threads 索引
 CREATE INDEX "idx_threads_account_id" ON "threads" USING btree ("account_id");
+CREATE INDEX "idx_threads_account_created" ON "threads" USING btree ("account_id", "created_at" DESC, "thread_id" DESC);
 CREATE INDEX "idx_threads_created_at" ON "threads" USING btree ("created_at");
 CREATE INDEX "idx_threads_project_id" ON "threads" USING btree ("project_id");
 CREATE INDEX "idx_threads_status" ON "threads" USING btree ("status");
@@ -506,6 +595,8 @@ ALTER TABLE "users" ADD CONSTRAINT "valid_status" CHECK (status::text = ANY (ARR
 -- ----------------------------
 CREATE TRIGGER "update_oauth_providers_updated_at" BEFORE UPDATE ON "oauth_providers" FOR EACH ROW EXECUTE PROCEDURE "public"."update_updated_at"();
 CREATE TRIGGER "update_users_updated_at" BEFORE UPDATE ON "users" FOR EACH ROW EXECUTE PROCEDURE "public"."update_updated_at"();
+-- 消息原地修改时刷新 updated_at，线程消息接口的 ETag 依赖它
+CREATE TRIGGER "update_messages_updated_at" BEFORE UPDATE ON "messages" FOR EACH ROW EXECUTE PROCEDURE "public"."update_updated_at"();
 
 -- ----------------------------
 -- 外键约束
@@ -516,6 +607,9 @@ ALTER TABLE "events" ADD CONSTRAINT "events_app_name_user_id_session_id_fkey" FO
 ALTER TABLE "oauth_providers" ADD CONSTRAINT "oauth_providers_user_id_fkey" FOREIGN KEY ("user_id") REFERENCES "users" ("id") ON DELETE CASCADE ON UPDATE NO ACTION;
 ALTER TABLE "refresh_tokens" ADD CONSTRAINT "refresh_tokens_session_id_fkey" FOREIGN KEY ("session_id") REFERENCES "user_sessions" ("id") ON DELETE CASCADE ON UPDATE NO ACTION;
 ALTER TABLE "refresh_tokens" ADD CONSTRAINT "refresh_tokens_user_id_fkey" FOREIGN KEY ("user_id") REFERENCES "users" ("id") ON DELETE CASCADE ON UPDATE NO ACTION;
+ALTER TABLE "task_list_sections" ADD CONSTRAINT "fk_task_list_sections_thread_id" FOREIGN KEY ("thread_id") REFERENCES "task_lists" ("thread_id") ON DELETE CASCADE ON UPDATE NO ACTION;
+ALTER TABLE "task_list_tasks" ADD CONSTRAINT "fk_task_list_tasks_thread_id" FOREIGN KEY ("thread_id") REFERENCES "task_lists" ("thread_id") ON DELETE CASCADE ON UPDATE NO ACTION;
+ALTER TABLE "task_lists" ADD CONSTRAINT "fk_task_lists_thread_id" FOREIGN KEY ("thread_id") REFERENCES "threads" ("thread_id") ON DELETE CASCADE ON UPDATE NO ACTION;
 ALTER TABLE "threads" ADD CONSTRAINT "fk_threads_project_id" FOREIGN KEY ("project_id") REFERENCES "projects" ("project_id") ON DELETE CASCADE ON UPDATE NO ACTION;
 ALTER TABLE "user_activities" ADD CONSTRAINT "user_activities_session_id_fkey" FOREIGN KEY ("session_id") REFERENCES "user_sessions" ("id") ON DELETE SET NULL ON UPDATE NO ACTION;
 ALTER TABLE "user_activities" ADD CONSTRAINT "user_activities_user_id_fkey" FOREIGN KEY ("user_id") REFERENCES "users" ("id") ON DELETE CASCADE ON UPDATE NO ACTION;
@@ -20,9 +20,10 @@ from dramatiq.brokers.redis import RedisBroker # type: ignore
 import os
 from services.langfuse import langfuse
 from utils.retry import retry
+from utils.config import config
 
 import sentry_sdk # type: ignore
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 # 使用与 services/redis.py 相同的配置
 redis_host = os.getenv('REDIS_HOST', 'redis')
@@ -60,6 +61,8 @@ async def initialize():
     if not instance_id:
         instance_id = str(uuid.uuid4())[:8]
     await retry(lambda: redis.initialize_async())
+    # Worker 进程使用独立配置的连接池大小
+    db.set_role("worker")
     await db.initialize()
 
     _initialized = True
@@ -207,59 +210,24 @@ async def run_agent_background(
         logger.error(f"Database client acquisition failed, Error details: {db_error}")
         raise db_error
     
-    # 初始化时间、响应计数、Pub/Sub、停止信号检查器、待处理Redis操作
+    # 初始化时间、响应计数、停止信号、响应写入器
     start_time = datetime.now(timezone.utc)
     total_responses = 0
-    pubsub = None
-    stop_checker = None
-    stop_signal_received = False
-    pending_redis_operations = []  
+    control_listener = None
+    stop_event = None
+    response_writer = None
 
     # 定义 Redis keys 和 channels
     # 两层控制架构
     response_list_key = f"agent_run:{agent_run_id}:responses" 
-    response_channel = f"agent_run:{agent_run_id}:new_response"
-    instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}" # 精确控制
+    use_stream = use_response_stream()
     global_control_channel = f"agent_run:{agent_run_id}:control"  #  广播控制
     instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
     
     # 用户在前端点击"停止"按钮
     # 前端 → 后端API → Redis发布 "STOP" 消息
     # → instance_control_channel 或 global_control_channel
-    # → 正在运行的Agent接收到信号 → 立即停止执行
-
-    async def check_for_stop_signal():
-        """
-        实时监听Redis中的STOP信号
-        """
-        nonlocal stop_signal_received
-
-        if not pubsub: 
-            logger.warning(f"PubSub not initialized, exiting checker")
-            return
-        try:
-            while not stop_signal_received:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
-                if message and message.get("type") == "message":
-                    data = message.get("data")
-                    if isinstance(data, bytes): data = data.decode('utf-8')
-                    if data == "STOP":
-                        logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
-                        stop_signal_received = True
-                        break
-                # 持久化刷新活跃运行键的TTL
-                if total_responses % 50 == 0: # 每50个响应刷新一次
-                    try: 
-                        await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
-                        logger.info(f"TTL refreshed (response count: {total_responses})")
-                    except Exception as ttl_err: 
-                        logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
-                await asyncio.sleep(0.1) # Short sleep to prevent tight loop
-        except asyncio.CancelledError:
-            logger.info(f"Stop signal checker cancelled for {agent_run_id} (Instance: {instance_id})")
-        except Exception as e:
-            logger.error(f"Error in stop signal checker for {agent_run_id}: {e}", exc_info=True)
-            stop_signal_received = True # Stop the run if the checker fails
+    # → 进程内共享的 RunControlListener 收到信号 → 设置该运行的 stop_event → 立即停止执行
 
     # 创建 Langfuse 跟踪
     trace = langfuse.trace(name="agent_run", id=agent_run_id, session_id=thread_id, metadata={"project_id": project_id, "instance_id": instance_id})
@@ -277,20 +245,11 @@ async def run_agent_background(
         #          ↓
         # Agent: 优雅停止执行，清理资源 
 
-        # 创建 Pub/Sub 连接
-        pubsub = await redis.create_pubsub()
-        logger.info(f"PubSub connection created successfully")
-        try:
-            # 订阅控制频道
-            await retry(lambda: pubsub.subscribe(instance_control_channel, global_control_channel))
-            logger.info(f"Control channels subscribed successfully")
-        except Exception as e:
-            logger.error(f"Redis failed to subscribe to control channels: {e}", exc_info=True)
-            raise e
-
-        logger.debug(f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}")
-        stop_checker = asyncio.create_task(check_for_stop_signal())
-        logger.info(f"Stop signal checker started successfully")
+        # 向进程内共享的控制监听器注册：不再为每个运行单独订阅和轮询，
+        # 活跃运行键的TTL也由监听器的定时心跳统一批量刷新
+        control_listener = get_run_control_listener()
+        stop_event = await control_listener.register(agent_run_id)
+        logger.info(f"Registered with run control listener")
         # 确保活跃运行键存在并设置TTL
         await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
         logger.info(f"Active run key set successfully")
@@ -320,7 +279,10 @@ async def run_agent_background(
 
         final_status = "running"
         error_message = None
-        pending_redis_operations = []
+
+        # 按时间/数量窗口合并响应块，每批一次 pipeline 事务写入 Redis，保证顺序且有界
+        response_writer = BufferedResponseWriter(agent_run_id)
+        response_writer.start()
 
         response_count = 0
 
@@ -328,7 +290,7 @@ async def run_agent_background(
         async for response in agent_gen:
             response_count += 1
             # 检查是否收到STOP信号
-            if stop_signal_received:
+            if stop_event.is_set():
                 logger.info(f"Agent run {agent_run_id} stopped by signal.")
                 final_status = "stopped"
                 try:
@@ -344,8 +306,8 @@ async def run_agent_background(
             #    ↑                                    ↑
             # lpush                               rpush
             # (左入栈)                            (右入栈)
-            pending_redis_operations.append(asyncio.create_task(redis.rpush(response_list_key, response_json)))
-            pending_redis_operations.append(asyncio.create_task(redis.publish(response_channel, "new")))
+            # 写入器缓冲已满时这里会等待（背压），而不是无限堆积任务
+            await response_writer.write(response_json)
             total_responses += 1
             
             if total_responses % 10 == 1:  # 每10个响应打印一次进度
@@ -368,11 +330,14 @@ async def run_agent_background(
              logger.info(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
              trace.span(name="agent_run_completed").end(status_message="agent_run_completed")
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # 发布完成消息
+             await response_writer.write(json.dumps(completion_message)) # 发布完成消息
+
+        # 终止状态：先把缓冲中的响应全部落盘，再更新状态和发布控制信号
+        await response_writer.close()
 
         # 从Redis获取最终响应用于更新数据库状态
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
+        if not use_stream:
+            all_responses_json = await redis.lrange(response_list_key, 0, -1)
 
         # 更新数据库状态
         await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
@@ -382,6 +347,8 @@ async def run_agent_background(
         
         try:
             await redis.publish(global_control_channel, control_signal)
+            if use_stream:
+                await push_control_signal(agent_run_id, control_signal)
             # 不需要发布到实例频道，因为运行正在这个实例上结束
             logger.debug(f"Published final control signal '{control_signal}' to {global_control_channel}")
         except Exception as e:
@@ -403,17 +370,22 @@ async def run_agent_background(
         # 将错误消息推送到Redis列表
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            if response_writer and not response_writer.closed:
+                # 经由写入器保证错误消息排在已缓冲响应之后
+                await response_writer.write(json.dumps(error_response))
+                await response_writer.close()
+            else:
+                await push_response(agent_run_id, json.dumps(error_response))
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
         # 从Redis获取最终响应用于更新数据库状态
-        try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             logger.info(f"Fetched {len(all_responses_json)} responses from Redis for {agent_run_id}")
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
+        if not use_response_stream():
+            try:
+                 all_responses_json = await redis.lrange(response_list_key, 0, -1)
+                 logger.info(f"Fetched {len(all_responses_json)} responses from Redis for {agent_run_id}")
+            except Exception as fetch_err:
+                 logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
 
         # 更新数据库状态
         await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}")
@@ -421,28 +393,19 @@ async def run_agent_background(
         # 发布ERROR信号
         try:
             await redis.publish(global_control_channel, "ERROR")
+            if use_response_stream():
+                await push_control_signal(agent_run_id, "ERROR")
             logger.debug(f"Published ERROR signal to {global_control_channel}")
         except Exception as e:
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
     finally:
-        # 清理停止检查器任务
-        if stop_checker and not stop_checker.done():
-            stop_checker.cancel()
-            try: 
-                await stop_checker
-            except asyncio.CancelledError: 
-                pass
-            except Exception as e: 
-                logger.warning(f"Error during stop_checker cancellation: {e}")
-
-        # 关闭pubsub连接
-        if pubsub:
-            try:
-                await pubsub.unsubscribe()
-                await pubsub.close()
-                logger.debug(f"Closed pubsub connection for {agent_run_id}")
-            except Exception as e:
-                logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
+        # 确保缓冲中的响应在设置TTL之前全部写入，超时30秒
+        if response_writer and not response_writer.closed:
+            await response_writer.close(timeout=30.0)
+
+        # 从共享控制监听器注销
+        if control_listener:
+            control_listener.unregister(agent_run_id)
 
         # 设置Redis响应列表的TTL
         await _cleanup_redis_response_list(agent_run_id)
@@ -455,13 +418,145 @@ async def run_agent_background(
         # 清理运行锁
         await _cleanup_redis_run_lock(agent_run_id)
 
-        # 等待所有挂起的Redis操作完成，超时30秒
+        logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
+
+class RunControlListener:
+    """Process-wide listener dispatching control signals to the agent runs on this worker.
+
+    每个进程只维持一个 Pub/Sub 连接，按模式订阅全局控制频道 agent_run:*:control 和本实例频道
+    agent_run:*:control:{instance_id}；收到 STOP 时设置对应运行的 asyncio.Event。
+    Pub/Sub 不保留消息：订阅生效之前或断线重连期间发布的 STOP 会丢失，因此 stop_agent_run 同时写入
+    持久化的停止标记，注册完成和每次（重新）订阅后都会检查一遍。
+    另有一个定时心跳任务，用一个 pipeline 批量刷新本进程所有活跃运行键的 TTL。
+    """
+
+    def __init__(self, instance_id: str):
+        self.instance_id = instance_id
+        self._stop_events: Dict[str, asyncio.Event] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def register(self, agent_run_id: str) -> asyncio.Event:
+        """Register a run and return the event set when a STOP signal arrives for it.
+
+        Returns once the pattern subscription is active, after checking the run's persisted stop flag.
+        """
+        stop_event = asyncio.Event()
+        self._stop_events[agent_run_id] = stop_event
+        self._ensure_started()
         try:
-            await asyncio.wait_for(asyncio.gather(*pending_redis_operations), timeout=30.0)
+            await asyncio.wait_for(self._subscribed.wait(), timeout=CONTROL_LISTENER_SUBSCRIBE_TIMEOUT)
         except asyncio.TimeoutError:
-            logger.warning(f"Timeout waiting for pending Redis operations for {agent_run_id}")
+            logger.warning(f"Run control listener not subscribed yet, relying on the stop flag for {agent_run_id}")
+        await self._check_stop_flags([agent_run_id])
+        return stop_event
+
+    def unregister(self, agent_run_id: str):
+        """Stop dispatching signals to a finished run and drop it from the TTL heartbeat."""
+        self._stop_events.pop(agent_run_id, None)
+
+    @property
+    def active_run_ids(self) -> List[str]:
+        return list(self._stop_events.keys())
+
+    def _ensure_started(self):
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen())
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def _listen(self):
+        patterns = ["agent_run:*:control", f"agent_run:*:control:{self.instance_id}"]
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis.create_pubsub()
+                await pubsub.psubscribe(*patterns)
+                self._subscribed.set()
+                logger.info(f"Run control listener subscribed to {patterns}")
+                # 补上未订阅期间（首次连接前 / 重连间隙）发出的 STOP
+                await self._check_stop_flags(self.active_run_ids)
+                while True:
+                    # 阻塞等待消息；超时只是为了定期让出，空闲时每个进程每几秒才唤醒一次
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=CONTROL_LISTENER_READ_TIMEOUT)
+                    if message:
+                        self._dispatch(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._subscribed.clear()
+                logger.error(f"Run control listener failed, reconnecting: {e}", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                if pubsub:
+                    try:
+                        await pubsub.punsubscribe()
+                        await pubsub.close()
+                    except Exception as e:
+                        logger.warning(f"Error closing control listener pubsub: {e}")
+
+    def _dispatch(self, message: Dict[str, Any]):
+        if message.get("type") not in ("message", "pmessage"):
+            return
+        data = message.get("data")
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        if data != "STOP":
+            return
+        channel = message.get("channel")
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        # Channel format: agent_run:{agent_run_id}:control[:{instance_id}]
+        parts = (channel or "").split(":")
+        if len(parts) < 3:
+            return
+        self._set_stop(parts[1])
 
-        logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
+    def _set_stop(self, agent_run_id: str):
+        stop_event = self._stop_events.get(agent_run_id)
+        if stop_event and not stop_event.is_set():
+            logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {self.instance_id})")
+            stop_event.set()
+
+    async def _check_stop_flags(self, run_ids: List[str]):
+        if not run_ids:
+            return
+        try:
+            pipe = await redis.pipeline(transaction=False)
+            for run_id in run_ids:
+                pipe.get(get_run_stop_flag_key(run_id))
+            flags = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to check stop flags for {len(run_ids)} runs: {e}")
+            return
+        for run_id, flag in zip(run_ids, flags):
+            if flag:
+                self._set_stop(run_id)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(ACTIVE_RUN_HEARTBEAT_INTERVAL)
+            run_ids = self.active_run_ids
+            if not run_ids:
+                continue
+            try:
+                pipe = await redis.pipeline(transaction=False)
+                for run_id in run_ids:
+                    pipe.expire(f"active_run:{self.instance_id}:{run_id}", redis.REDIS_KEY_TTL)
+                await pipe.execute()
+                logger.debug(f"TTL refreshed for {len(run_ids)} active runs")
+            except Exception as e:
+                logger.warning(f"Failed to refresh TTL for active runs: {e}")
+
+_run_control_listener: Optional[RunControlListener] = None
+
+def get_run_control_listener() -> RunControlListener:
+    """Get the process-wide run control listener, creating it on first use."""
+    global _run_control_listener
+    if _run_control_listener is None:
+        _run_control_listener = RunControlListener(instance_id)
+    return _run_control_listener
 
 async def _cleanup_redis_instance_key(agent_run_id: str):
     """Clean up the instance-specific Redis key for an agent run."""
@@ -489,9 +584,19 @@ async def _cleanup_redis_run_lock(agent_run_id: str):
 # TTL for Redis response lists (24 hours)
 REDIS_RESPONSE_LIST_TTL = 3600 * 24
 
+# Response writer batching: flush window (seconds), early-flush batch size, max buffered responses before backpressure
+RESPONSE_WRITER_FLUSH_INTERVAL = 0.05
+RESPONSE_WRITER_MAX_BATCH_SIZE = 100
+RESPONSE_WRITER_MAX_PENDING = 2000
+
+# Run control: pub/sub read timeout for the shared listener, and how often active run keys get their TTL refreshed
+CONTROL_LISTENER_READ_TIMEOUT = 5.0
+CONTROL_LISTENER_SUBSCRIBE_TIMEOUT = 5.0
+ACTIVE_RUN_HEARTBEAT_INTERVAL = 300
+
 async def _cleanup_redis_response_list(agent_run_id: str):
-    """Set TTL on the Redis response list."""
-    response_list_key = f"agent_run:{agent_run_id}:responses"
+    """Set TTL on the Redis response list (or response stream)."""
+    response_list_key = get_response_stream_key(agent_run_id) if use_response_stream() else f"agent_run:{agent_run_id}:responses"
     try:
         # 销毁Redis响应列表
         await redis.expire(response_list_key, REDIS_RESPONSE_LIST_TTL)
@@ -499,6 +604,147 @@ async def _cleanup_redis_response_list(agent_run_id: str):
     except Exception as e:
         logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
 
+def get_response_stream_key(agent_run_id: str) -> str:
+    """Redis Stream key holding the responses of an agent run (stream transport)."""
+    return f"agent_run:{agent_run_id}:response_stream"
+
+def use_response_stream() -> bool:
+    """Whether agent run responses are transported via Redis Streams instead of List + Pub/Sub."""
+    return (config.AGENT_RESPONSE_TRANSPORT or "list").lower() == "stream"
+
+async def push_response(agent_run_id: str, response_json: str):
+    """Append a serialized response for an agent run using the configured transport.
+
+    list 模式：RPUSH 存储 + PUBLISH 通知，两次往返
+    stream 模式：一次 XADD，消费者通过 XREAD BLOCK 直接拿到数据
+    """
+    if use_response_stream():
+        await redis.xadd(get_response_stream_key(agent_run_id), {"data": response_json})
+    else:
+        await redis.rpush(f"agent_run:{agent_run_id}:responses", response_json)
+        await redis.publish(f"agent_run:{agent_run_id}:new_response", "new")
+
+class BufferedResponseWriter:
+    """Per-run buffered writer that coalesces streamed responses into pipelined Redis transactions.
+
+    生产者调用 write() 只是追加到内存缓冲；单个后台 flush 任务在 flush_interval 时间窗口内
+    （或缓冲达到 max_batch_size 时立即）把整批响应放进一个 MULTI/EXEC pipeline 发送：
+    list 模式为一次 RPUSH + 一次 PUBLISH，stream 模式为每条一个 XADD。
+    单一 flush 任务保证写入顺序；缓冲达到 max_pending 时 write() 会等待（背压），内存有界。
+    """
+
+    def __init__(
+        self,
+        agent_run_id: str,
+        flush_interval: float = RESPONSE_WRITER_FLUSH_INTERVAL,
+        max_batch_size: int = RESPONSE_WRITER_MAX_BATCH_SIZE,
+        max_pending: int = RESPONSE_WRITER_MAX_PENDING,
+    ):
+        self.agent_run_id = agent_run_id
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.use_stream = use_response_stream()
+        self.flush_count = 0
+        self.written_count = 0
+        self.failed_count = 0
+        self.closed = False
+
+        self._buffer: List[str] = []
+        self._closing = False
+        self._data_available = asyncio.Event()  # 缓冲非空
+        self._batch_ready = asyncio.Event()  # 缓冲达到批大小或正在关闭，立即 flush
+        self._has_space = asyncio.Event()  # 缓冲低于上限，write() 可以继续
+        self._has_space.set()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background flush task."""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run())
+
+    async def write(self, response_json: str):
+        """Buffer a serialized response, waiting if the buffer is full."""
+        if self._closing:
+            raise RuntimeError(f"Response writer for {self.agent_run_id} is closed")
+        while len(self._buffer) >= self.max_pending:
+            self._has_space.clear()
+            await self._has_space.wait()
+        self._buffer.append(response_json)
+        self._data_available.set()
+        if len(self._buffer) >= self.max_batch_size:
+            self._batch_ready.set()
+
+    async def close(self, timeout: Optional[float] = None):
+        """Flush everything still buffered and stop the flush task."""
+        if self.closed:
+            return
+        self._closing = True
+        self._data_available.set()
+        self._batch_ready.set()
+        try:
+            if self._flusher:
+                await asyncio.wait_for(asyncio.shield(self._flusher), timeout=timeout)
+            else:
+                await self._flush()
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout flushing {len(self._buffer)} buffered responses for {self.agent_run_id}")
+            self._flusher.cancel()
+        finally:
+            self.closed = True
+            logger.debug(f"Response writer closed for {self.agent_run_id}: {self.written_count} responses in {self.flush_count} flushes ({self.failed_count} failed)")
+
+    async def _run(self):
+        while True:
+            await self._data_available.wait()
+            if not self._closing and len(self._buffer) < self.max_batch_size:
+                # 等待一个短时间窗口，把这段时间内产生的块合并为一批
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+            if self._closing and not self._buffer:
+                return
+
+    async def _flush(self):
+        batch, self._buffer = self._buffer, []
+        self._data_available.clear()
+        self._batch_ready.clear()
+        self._has_space.set()
+        if not batch:
+            return
+        try:
+            await retry(lambda: self._send(batch), max_attempts=3, delay_seconds=1)
+            self.written_count += len(batch)
+        except Exception as e:
+            self.failed_count += len(batch)
+            logger.error(f"Failed to write {len(batch)} responses to Redis for {self.agent_run_id}: {e}")
+        finally:
+            self.flush_count += 1
+
+    async def _send(self, batch: List[str]):
+        pipe = await redis.pipeline(transaction=True)
+        if self.use_stream:
+            stream_key = get_response_stream_key(self.agent_run_id)
+            for response_json in batch:
+                pipe.xadd(stream_key, {"data": response_json})
+        else:
+            pipe.rpush(f"agent_run:{self.agent_run_id}:responses", *batch)
+            pipe.publish(f"agent_run:{self.agent_run_id}:new_response", "new")
+        await pipe.execute()
+
+def get_run_stop_flag_key(agent_run_id: str) -> str:
+    return f"agent_run:{agent_run_id}:stop"
+
+async def mark_run_stop_requested(agent_run_id: str):
+    """Persist a STOP request so runs that were not subscribed when it was published still stop."""
+    await redis.set(get_run_stop_flag_key(agent_run_id), "STOP", ex=redis.REDIS_KEY_TTL)
+
+async def push_control_signal(agent_run_id: str, signal: str):
+    """Append a control signal (STOP / END_STREAM / ERROR) to the response stream so stream consumers terminate."""
+    await redis.xadd(get_response_stream_key(agent_run_id), {"control": signal})
+
 async def update_agent_run_status(
     client,
     agent_run_id: str,
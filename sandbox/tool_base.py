@@ -26,6 +26,10 @@ class SandboxToolsBase(Tool):
         self._sandbox_id = None
         self._sandbox_pass = None
 
+    def _get_resource_key(self) -> str:
+        # 同一项目的沙箱工具（浏览器、桌面操作、文件写入）共享一个沙箱，调度时互斥执行
+        return f"sandbox:{self.project_id}"
+
     async def _ensure_sandbox(self) -> Any:
         """Ensure a valid sandbox instance, retrieve it from the project if needed.
 
@@ -22,6 +22,7 @@ from fastapi import HTTPException
 from utils.logger import logger
 from services.postgresql import DBConnection
 from services import redis
+from utils.cache import Cache
 from utils.config import config
 
 
@@ -353,12 +354,9 @@ class APIKeyService:
             cache_key = f"api_key:{public_key}:{self._hash_secret_key(secret_key)[:8]}"
 
             try:
-                redis_client = await redis.get_client()
-                cached_result = await redis_client.get(cache_key)
-                if cached_result:
-                    import json
-
-                    cached_data = json.loads(cached_result)
+                # 两级缓存：进程内命中时不需要访问 Redis
+                cached_data = await Cache.get(cache_key)
+                if cached_data:
                     logger.debug(f"API key validation cache hit for {public_key}")
                     return APIKeyValidationResult(
                         is_valid=cached_data["is_valid"],
@@ -456,18 +454,15 @@ class APIKeyService:
     async def _cache_validation_result(
         self, cache_key: str, result: APIKeyValidationResult, ttl: int = 120
     ):
-        """Cache validation result in Redis"""
+        """Cache validation result in the two-tier cache"""
         try:
-            redis_client = await redis.get_client()
-            import json
-
             cache_data = {
                 "is_valid": result.is_valid,
                 "account_id": str(result.account_id) if result.account_id else None,
                 "key_id": str(result.key_id) if result.key_id else None,
                 "error_message": result.error_message,
             }
-            await redis_client.setex(cache_key, ttl, json.dumps(cache_data))
+            await Cache.set(cache_key, cache_data, ttl=ttl)
         except Exception as e:
             logger.warning(f"Failed to cache validation result: {e}")
 
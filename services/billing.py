@@ -5,15 +5,16 @@ stripe listen --forward-to localhost:8000/api/billing/webhook
 """
 
 from fastapi import APIRouter, HTTPException, Depends, Request
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple, List
 import stripe
-from datetime import datetime, timezone, timedelta
+import json
+from datetime import date, datetime, timezone, timedelta
 
 # from supabase import Client as SupabaseClient
 from utils.cache import Cache
 from utils.logger import logger
 from utils.config import config, EnvMode
-from services.postgresql import DBConnection
+from services.postgresql import DBConnection, _build_insert_query, mark_read_your_writes
 from utils.simple_auth_middleware import get_current_user_id_from_jwt
 from pydantic import BaseModel
 from utils.constants import MODEL_ACCESS_TIERS, MODEL_NAME_ALIASES, HARDCODED_MODEL_PRICES
@@ -26,6 +27,13 @@ stripe.api_key = config.STRIPE_SECRET_KEY
 # Token price multiplier
 TOKEN_PRICE_MULTIPLIER = 1.5
 
+# Use fixed cutoff date: June 30, 2025 09:00 UTC
+# Ignore all token counts before this date
+USAGE_CUTOFF_DATE = datetime(2025, 6, 30, 9, 0, 0, tzinfo=timezone.utc)
+
+# 账本在写入时会主动失效缓存，TTL 只是兜底
+MONTHLY_USAGE_CACHE_TTL = 10 * 60
+
 # Initialize router
 router = APIRouter(prefix="/billing", tags=["billing"])
 
@@ -322,54 +330,252 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
         return None
 
 async def calculate_monthly_usage(client, user_id: str) -> float:
-    """Calculate total agent run minutes for the current month for a user."""
-    result = await Cache.get(f"monthly_usage:{user_id}")
-    if result:
-        return result
+    """Return the user's token cost for the current month from the usage ledger."""
+    return await Cache.get_or_compute(
+        f"monthly_usage:{user_id}",
+        lambda: _get_ledger_usage(client, user_id),
+        ttl=MONTHLY_USAGE_CACHE_TTL
+    )
+
+
+async def _get_ledger_usage(client, user_id: str) -> float:
+    month = _usage_month_start()
+    result = await client.table('usage_monthly_ledger') \
+        .select('total_cost, reconciled_at') \
+        .eq('account_id', user_id) \
+        .eq('month', month) \
+        .primary() \
+        .maybe_single() \
+        .execute()
+
+    if result.data and result.data.get('reconciled_at'):
+        return float(result.data['total_cost'])
+
+    # 账本行不存在或只包含增量（本月首次查询 / 尚未回填），全量扫描一次并写入账本
+    return await reconcile_account_usage(user_id, month)
+
+
+# ---- 月度用量账本 ----
+# usage_monthly_ledger 每个 (account_id, month) 一行：
+#   - 写入 assistant_response_end 消息时由 insert_usage_message 在同一事务里增量累加；
+#   - reconcile_account_usage / reconcile_usage_ledger 按消息表全量重算并覆盖（回填与对账）。
+
+def _usage_month_start(moment: Optional[datetime] = None) -> date:
+    moment = moment or datetime.now(timezone.utc)
+    return date(moment.year, moment.month, 1)
+
+
+def _usage_month_range(month: date) -> Tuple[datetime, datetime]:
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    if month.month == 12:
+        end = datetime(month.year + 1, 1, 1, tzinfo=timezone.utc)
+    else:
+        end = datetime(month.year, month.month + 1, 1, tzinfo=timezone.utc)
+    return max(start, USAGE_CUTOFF_DATE), end
+
+
+def _usage_from_content(content) -> Tuple[int, int, float]:
+    if isinstance(content, str):
+        content = json.loads(content)
+    usage = (content or {}).get('usage') or {}
+    prompt_tokens = int(usage.get('prompt_tokens') or 0)
+    completion_tokens = int(usage.get('completion_tokens') or 0)
+    model = (content or {}).get('model', 'unknown')
+    return prompt_tokens, completion_tokens, calculate_token_cost(prompt_tokens, completion_tokens, model)
+
+
+async def _lock_account_ledger(conn, account_id: str):
+    """Serialize ledger writers of one account until the current transaction ends."""
+    await conn.execute("SELECT pg_advisory_xact_lock(hashtext('usage_monthly_ledger:' || $1))", account_id)
+
+
+async def _add_message_usage(conn, account_id: str, content, created_at: datetime) -> bool:
+    if created_at < USAGE_CUTOFF_DATE:
+        return False
+
+    prompt_tokens, completion_tokens, cost = _usage_from_content(content)
+    if not prompt_tokens and not completion_tokens:
+        return False
+
+    await conn.execute(
+        """
+        INSERT INTO usage_monthly_ledger AS l
+            (account_id, month, total_cost, prompt_tokens, completion_tokens, message_count, last_message_at, updated_at)
+        VALUES ($1, $2, $3, $4, $5, 1, $6, now())
+        ON CONFLICT (account_id, month) DO UPDATE SET
+            total_cost = l.total_cost + EXCLUDED.total_cost,
+            prompt_tokens = l.prompt_tokens + EXCLUDED.prompt_tokens,
+            completion_tokens = l.completion_tokens + EXCLUDED.completion_tokens,
+            message_count = l.message_count + 1,
+            last_message_at = GREATEST(l.last_message_at, EXCLUDED.last_message_at),
+            updated_at = now()
+        """,
+        account_id, _usage_month_start(created_at), cost, prompt_tokens, completion_tokens, created_at
+    )
+    return True
+
+
+async def insert_usage_message(thread_id: str, data: Dict, content) -> List[Dict]:
+    """Insert an assistant_response_end message and add its usage to the monthly ledger in one transaction.
+
+    消息写入和账本累加与 reconcile_account_usage 持有同一把账户级 advisory 锁：
+    对账要么在消息提交之后扫描（只由对账计入），要么在消息写入之前完成（随后增量累加），
+    不会重复计算或遗漏。账本累加失败只回滚到保存点，不影响消息本身，由对账任务修正。
+    """
+    query, values = _build_insert_query('messages', list(data), [data])
+    recorded = False
+
+    db = DBConnection()
+    client = await db.client
+    async with client.pool.acquire() as conn:
+        async with conn.transaction():
+            account_id = await conn.fetchval("SELECT account_id FROM threads WHERE thread_id = $1", str(thread_id))
+            if account_id:
+                await _lock_account_ledger(conn, account_id)
+            rows = [dict(row) for row in await conn.fetch(query, *values)]
+            if account_id and rows:
+                try:
+                    async with conn.transaction():
+                        recorded = await _add_message_usage(
+                            conn, account_id, content, rows[0].get('created_at') or datetime.now(timezone.utc)
+                        )
+                except Exception as e:
+                    logger.warning(f"Failed to record usage for thread {thread_id}: {str(e)}")
+    mark_read_your_writes()
+
+    if recorded:
+        await Cache.invalidate(f"monthly_usage:{account_id}")
+    return rows
+
+
+async def reconcile_account_usage(account_id: str, month: Optional[date] = None) -> float:
+    """Recompute one account's ledger row for a month from the messages table."""
+    month = month or _usage_month_start()
+    range_start, range_end = _usage_month_range(month)
 
-    start_time = time.time()
-    
-    # Use get_usage_logs to fetch all usage data (it already handles the date filtering and batching)
     total_cost = 0.0
-    page = 0
-    items_per_page = 1000
-    
-    while True:
-        # Get usage logs for this page
-        usage_result = await get_usage_logs(client, user_id, page, items_per_page)
-        
-        if not usage_result['logs']:
-            break
-        
-        # Sum up the estimated costs from this page
-        for log_entry in usage_result['logs']:
-            total_cost += log_entry['estimated_cost']
-        
-        # If there are no more pages, break
-        if not usage_result['has_more']:
-            break
-            
-        page += 1
-    
-    end_time = time.time()
-    execution_time = end_time - start_time
-    logger.info(f"Calculate monthly usage took {execution_time:.3f} seconds, total cost: {total_cost}")
-    
-    await Cache.set(f"monthly_usage:{user_id}", total_cost, ttl=2 * 60)
+    prompt_tokens = 0
+    completion_tokens = 0
+    message_count = 0
+    last_message_at = None
+
+    db = DBConnection()
+    client = await db.client
+    # 扫描和覆盖在同一事务里并持有账户锁，期间 insert_usage_message 的写入会等待，
+    # 不会出现"扫描之后、覆盖之前"写入的消息被覆盖丢失或重复累加
+    async with client.pool.acquire() as conn, conn.transaction():
+        await _lock_account_ledger(conn, account_id)
+        rows = await conn.fetch(
+            """
+            SELECT m.content, m.created_at
+            FROM messages m
+            JOIN threads t ON t.thread_id = m.thread_id::text
+            WHERE t.account_id = $1
+              AND m.type = 'assistant_response_end'
+              AND m.created_at >= $2 AND m.created_at < $3
+            """,
+            account_id, range_start, range_end
+        )
+        for row in rows:
+            try:
+                row_prompt, row_completion, row_cost = _usage_from_content(row['content'])
+            except Exception as e:
+                logger.warning(f"Skipping malformed usage entry for account {account_id}: {e}")
+                continue
+            prompt_tokens += row_prompt
+            completion_tokens += row_completion
+            total_cost += row_cost
+            message_count += 1
+            if last_message_at is None or row['created_at'] > last_message_at:
+                last_message_at = row['created_at']
+
+        await conn.execute(
+            """
+            INSERT INTO usage_monthly_ledger
+                (account_id, month, total_cost, prompt_tokens, completion_tokens, message_count, last_message_at, reconciled_at, updated_at)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, now(), now())
+            ON CONFLICT (account_id, month) DO UPDATE SET
+                total_cost = EXCLUDED.total_cost,
+                prompt_tokens = EXCLUDED.prompt_tokens,
+                completion_tokens = EXCLUDED.completion_tokens,
+                message_count = EXCLUDED.message_count,
+                last_message_at = EXCLUDED.last_message_at,
+                reconciled_at = now(),
+                updated_at = now()
+            """,
+            account_id, month, total_cost, prompt_tokens, completion_tokens, message_count, last_message_at
+        )
+    mark_read_your_writes()
+
+    await Cache.invalidate(f"monthly_usage:{account_id}")
+    logger.info(f"Reconciled usage ledger for account {account_id} ({month:%Y-%m}): "
+                f"{message_count} messages, total cost {total_cost}")
     return total_cost
 
 
+async def reconcile_usage_ledger(month: Optional[date] = None, account_ids: Optional[List[str]] = None) -> Dict:
+    """Backfill / reconcile the ledger for every account with usage in a month.
+
+    Returns a summary with the number of accounts processed and the accounts whose
+    ledger total drifted from the recomputed value.
+    """
+    month = month or _usage_month_start()
+    range_start, range_end = _usage_month_range(month)
+
+    db = DBConnection()
+    client = await db.client
+    async with client.pool.acquire() as conn:
+        if account_ids is None:
+            rows = await conn.fetch(
+                """
+                SELECT DISTINCT t.account_id
+                FROM messages m
+                JOIN threads t ON t.thread_id = m.thread_id::text
+                WHERE m.type = 'assistant_response_end'
+                  AND m.created_at >= $1 AND m.created_at < $2
+                """,
+                range_start, range_end
+            )
+            account_ids = [row['account_id'] for row in rows]
+
+        previous = {
+            row['account_id']: float(row['total_cost'])
+            for row in await conn.fetch(
+                "SELECT account_id, total_cost FROM usage_monthly_ledger WHERE month = $1 AND account_id = ANY($2)",
+                month, account_ids
+            )
+        }
+
+    drifted = {}
+    failed = []
+    for account_id in account_ids:
+        try:
+            total_cost = await reconcile_account_usage(account_id, month)
+        except Exception as e:
+            logger.error(f"Failed to reconcile usage ledger for account {account_id}: {e}")
+            failed.append(account_id)
+            continue
+        before = previous.get(account_id)
+        if before is None or abs(before - total_cost) > 1e-6:
+            drifted[account_id] = {"ledger": before, "recomputed": total_cost}
+
+    logger.info(f"Usage ledger reconcile for {month:%Y-%m}: {len(account_ids)} accounts, "
+                f"{len(drifted)} adjusted, {len(failed)} failed")
+    return {
+        "month": month.isoformat(),
+        "accounts": len(account_ids),
+        "adjusted": drifted,
+        "failed": failed,
+    }
+
+
 async def get_usage_logs(client, user_id: str, page: int = 0, items_per_page: int = 1000) -> Dict:
     """Get detailed usage logs for a user with pagination."""
     # Get start of current month in UTC
     now = datetime.now(timezone.utc)
     start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
     
-    # Use fixed cutoff date: June 26, 2025 midnight UTC
-    # Ignore all token counts before this date
-    cutoff_date = datetime(2025, 6, 30, 9, 0, 0, tzinfo=timezone.utc)
-    
-    start_of_month = max(start_of_month, cutoff_date)
+    start_of_month = max(start_of_month, USAGE_CUTOFF_DATE)
     
     # First get all threads for this user in batches
     batch_size = 1000
@@ -1,15 +1,47 @@
 """
 自定义ADK数据库会话服务 - 只存储模型响应，过滤用户消息
+
+同时支持上下文压缩检查点：检查点是 author 为 CHECKPOINT_AUTHOR 的事件，内容是此前对话的摘要。
+get_session 只返回「最新检查点 + 其后的事件」，检查点之前的前缀保持字节稳定，便于模型服务端的提示词缓存命中。
+有检查点时先用一条索引查询取得最新检查点的时间，再只从数据库加载该时间之后的事件，
+每轮的查询和反序列化开销不再随完整历史增长。
 """
 
-from typing import Any, Optional
+import uuid
+from typing import Any, List, Optional
+from google.adk.sessions.base_session_service import GetSessionConfig # type: ignore
 from google.adk.sessions.database_session_service import DatabaseSessionService # type: ignore
 from google.adk.sessions.session import Session # type: ignore
 from google.adk.events.event import Event # type: ignore
+from google.genai import types # type: ignore
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 摘要检查点事件的 author；前端只读取 author='user' 的事件，检查点不会出现在消息列表中
+CHECKPOINT_AUTHOR = "context_checkpoint"
+CHECKPOINT_HEADER = "[Summary of the earlier conversation]\n"
+
+# 按检查点时间过滤时向前多留的秒数，吸收时间戳在 float / timestamptz 之间转换的误差；多加载的事件由裁剪去掉
+CHECKPOINT_LOOKBACK_SECONDS = 1.0
+
+
+def apply_checkpoint_view(events: List[Event]) -> List[Event]:
+    """把事件列表裁剪为「最新检查点 + 其后的事件」，没有检查点时原样返回"""
+    last_checkpoint = None
+    for index in range(len(events) - 1, -1, -1):
+        if getattr(events[index], "author", None) == CHECKPOINT_AUTHOR:
+            last_checkpoint = index
+            break
+    if last_checkpoint is None:
+        return events
+
+    # 检查点以用户消息的身份进入模型上下文，而不是“其他 agent 的发言”
+    checkpoint = events[last_checkpoint].model_copy(update={"author": "user"})
+    tail = [event for event in events[last_checkpoint + 1:] if getattr(event, "author", None) != CHECKPOINT_AUTHOR]
+    return [checkpoint] + tail
+
+
 class ModelOnlyDBSessionService(DatabaseSessionService):
     """
     继承ADK的DatabaseSessionService，只存储模型响应事件
@@ -21,6 +53,48 @@ class ModelOnlyDBSessionService(DatabaseSessionService):
         super().__init__(db_url, **kwargs)
         logger.info("ModelOnlyDBSessionService initialized - will filter user events")
     
+    async def get_session(self, **kwargs: Any) -> Optional[Session]:
+        """获取会话，只加载并返回「最新摘要检查点 + 其后的事件」"""
+        session = None
+        if kwargs.get("config") is None:
+            checkpoint_ts = await self._latest_checkpoint_timestamp(
+                kwargs.get("app_name"), kwargs.get("user_id"), kwargs.get("session_id")
+            )
+            if checkpoint_ts is not None:
+                session = await super().get_session(
+                    **kwargs, config=GetSessionConfig(after_timestamp=checkpoint_ts - CHECKPOINT_LOOKBACK_SECONDS)
+                )
+                if session is not None and not any(
+                    getattr(event, "author", None) == CHECKPOINT_AUTHOR for event in session.events
+                ):
+                    # 时区或复制延迟导致过滤边界落在检查点之后：退回全量加载，保证不丢尾部事件
+                    logger.warning(f"Checkpoint not found in filtered events of session {kwargs.get('session_id')}, loading full history")
+                    session = None
+
+        if session is None:
+            session = await super().get_session(**kwargs)
+        if session is not None and session.events:
+            session.events = apply_checkpoint_view(session.events)
+        return session
+
+    async def _latest_checkpoint_timestamp(self, app_name: str, user_id: str, session_id: str) -> Optional[float]:
+        """Epoch seconds of the session's latest checkpoint event, or None (also on lookup failure)."""
+        try:
+            from services.postgresql import DBConnection
+
+            client = await DBConnection().client
+            rows = await client.fetch(
+                "events",
+                "SELECT MAX(timestamp) AS checkpoint_at FROM events "
+                "WHERE app_name = $1 AND user_id = $2 AND session_id = $3 AND author = $4",
+                app_name, user_id, session_id, CHECKPOINT_AUTHOR,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to look up context checkpoint for session {session_id}: {e}")
+            return None
+        checkpoint_at = rows[0]["checkpoint_at"] if rows else None
+        return checkpoint_at.timestamp() if checkpoint_at is not None else None
+
     async def append_event(self, session: Session, event: Event) -> Event:
         """
         重写append_event方法，过滤用户事件
@@ -33,4 +107,19 @@ class ModelOnlyDBSessionService(DatabaseSessionService):
         
         # 存储非用户事件（模型响应等）
         logger.debug(f"Storing non-user event: {event.id} (author: {getattr(event, 'author', 'unknown')})")
-        return await super().append_event(session, event) 
\ No newline at end of file
+        return await super().append_event(session, event)
+
+    async def append_checkpoint(self, session: Session, summary: str, timestamp: float) -> Event:
+        """写入摘要检查点事件
+
+        timestamp 应落在被摘要的最后一个事件与保留的第一个尾部事件之间，
+        这样按时间排序时检查点恰好位于两者之间。
+        """
+        event = Event(
+            invocation_id=f"checkpoint-{uuid.uuid4()}",
+            author=CHECKPOINT_AUTHOR,
+            content=types.Content(role="user", parts=[types.Part(text=CHECKPOINT_HEADER + summary)]),
+            timestamp=timestamp,
+        )
+        logger.info(f"Writing context checkpoint for session {session.id} at {timestamp}")
+        return await super().append_event(session, event)
@@ -10,16 +10,247 @@ PostgreSQLSchema / PostgreSQLTable (查询构建器)：99%的数据库操作都
     ↓
 QueryResult (结果包装器) ：统一查询结果格式
 
+查询形状与预编译语句：
+    - 构建器生成的 SQL 只包含占位符（IN 使用 = ANY($n)，LIMIT/OFFSET 也参数化），
+      相同调用点无论参数取值如何都得到同一段 SQL 文本，即"查询形状"。
+    - asyncpg 在每个连接上维护按 SQL 文本索引的预编译语句 LRU
+      （容量由 POSTGRES_STATEMENT_CACHE_SIZE 控制），形状稳定后热点查询不再重复 parse/plan。
+    - select(count="exact") 通过 COUNT(*) OVER() 与数据在同一次往返中返回。
+    - 每个形状的调用次数与延迟分布记录在进程内，通过 get_query_metrics() 导出。
+
+连接池：
+    - 池大小按进程角色（api / worker）从配置读取，连接池被 InstrumentedPool 包装，
+      记录获取连接的等待时间直方图、在用连接数与超时次数，通过 get_pool_metrics() 导出。
+    - 配置 DATABASE_REPLICA_URL 后，select() 构建的只读查询走副本池；
+      当前上下文（一次请求 / 一个任务）一旦写过数据，后续读取自动回到主库（read-your-writes），
+      也可以通过 .primary() 或 use_primary() 显式要求读主库。
+
 """
 
 from typing import Optional, List, Dict, Any, Union
+from contextlib import contextmanager
 import asyncpg # type: ignore
 from utils.logger import logger
 from utils.config import config
+from collections import OrderedDict
+import contextvars
 import threading
+import asyncio
+import hashlib
+import time
 import os
 import json
 
+# 窗口计数列名，COUNT(*) OVER() 的结果会从返回行中剥离
+_TOTAL_COUNT_COLUMN = "__total_count"
+
+# 延迟直方图的桶上限（毫秒），最后一个桶收集所有更慢的查询
+_LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+# 最多跟踪的查询形状数量，超出后淘汰最久未使用的形状
+_MAX_TRACKED_SHAPES = 500
+
+# 获取连接等待时间直方图的桶上限（毫秒）
+_POOL_WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+# 当前上下文是否必须读主库（写入后置位，保证同一请求内读到自己的写入）
+_read_primary = contextvars.ContextVar("postgres_read_primary", default=False)
+
+_query_shape_metrics: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_metrics_lock = threading.Lock()
+
+
+def get_query_shape_key(query: str) -> str:
+    """Return a short stable key for a normalized query text"""
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]
+
+
+def _record_query_metrics(table_name: str, query: str, elapsed_ms: float, failed: bool = False):
+    """Record latency for one execution of a query shape"""
+    key = get_query_shape_key(query)
+    with _metrics_lock:
+        stats = _query_shape_metrics.get(key)
+        if stats is None:
+            stats = {
+                "shape": key,
+                "table": table_name,
+                "query": query,
+                "calls": 0,
+                "errors": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "buckets": [0] * (len(_LATENCY_BUCKETS_MS) + 1),
+            }
+            _query_shape_metrics[key] = stats
+            if len(_query_shape_metrics) > _MAX_TRACKED_SHAPES:
+                _query_shape_metrics.popitem(last=False)
+        else:
+            _query_shape_metrics.move_to_end(key)
+
+        stats["calls"] += 1
+        if failed:
+            stats["errors"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        for i, bound in enumerate(_LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                stats["buckets"][i] += 1
+                break
+        else:
+            stats["buckets"][-1] += 1
+
+    if elapsed_ms >= config.POSTGRES_SLOW_QUERY_MS:
+        logger.warning(f"Slow query on {table_name} ({elapsed_ms:.1f}ms, shape {key}): {query}")
+
+
+def get_query_metrics(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Export per-shape latency metrics, ordered by total time spent"""
+    with _metrics_lock:
+        snapshot = [dict(stats, buckets=list(stats["buckets"])) for stats in _query_shape_metrics.values()]
+
+    bucket_labels = [f"le_{bound}ms" for bound in _LATENCY_BUCKETS_MS] + ["inf"]
+    for stats in snapshot:
+        stats["avg_ms"] = round(stats["total_ms"] / stats["calls"], 3) if stats["calls"] else 0.0
+        stats["total_ms"] = round(stats["total_ms"], 3)
+        stats["max_ms"] = round(stats["max_ms"], 3)
+        stats["buckets"] = dict(zip(bucket_labels, stats["buckets"]))
+
+    snapshot.sort(key=lambda stats: stats["total_ms"], reverse=True)
+    return snapshot[:limit] if limit else snapshot
+
+
+def reset_query_metrics():
+    """Clear all collected query metrics"""
+    with _metrics_lock:
+        _query_shape_metrics.clear()
+
+
+async def _timed_fetch(conn, table_name: str, query: str, params: List[Any]):
+    """Run conn.fetch and record its latency under the query shape"""
+    start = time.perf_counter()
+    failed = False
+    try:
+        return await conn.fetch(query, *params)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        _record_query_metrics(table_name, query, (time.perf_counter() - start) * 1000, failed)
+
+
+def mark_read_your_writes():
+    """Route the remaining reads of the current context to the primary
+
+    表构建器的 insert / insert_many / update / delete 会自动调用；直接通过 client.pool.acquire()
+    拿连接写库的代码不会经过这里，必须在写入之后自行调用，否则同一请求里随后的 select()/fetch()
+    可能从尚未追上的只读副本读到旧数据。
+    """
+    _read_primary.set(True)
+
+
+@contextmanager
+def use_primary():
+    """Force select() queries inside the block to read from the primary"""
+    token = _read_primary.set(True)
+    try:
+        yield
+    finally:
+        _read_primary.reset(token)
+
+
+class InstrumentedPool:
+    """asyncpg.Pool wrapper recording acquire wait time and connections in use"""
+
+    def __init__(self, pool: asyncpg.Pool, name: str, acquire_timeout: Optional[float] = None):
+        self._pool = pool
+        self.name = name
+        self.acquire_timeout = acquire_timeout
+        self.in_use = 0
+        self.max_in_use = 0
+        self.acquire_count = 0
+        self.acquire_timeouts = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.wait_buckets = [0] * (len(_POOL_WAIT_BUCKETS_MS) + 1)
+
+    def acquire(self, *, timeout: Optional[float] = None):
+        """Acquire a connection (usable with ``async with`` or ``await``)"""
+        return _InstrumentedAcquire(self, timeout if timeout is not None else self.acquire_timeout)
+
+    async def release(self, connection, *, timeout: Optional[float] = None):
+        """Release a connection acquired with ``await pool.acquire()``"""
+        try:
+            await self._pool.release(connection, timeout=timeout)
+        finally:
+            self.in_use -= 1
+
+    def _record_acquire(self, wait_ms: float):
+        self.acquire_count += 1
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+        self.wait_total_ms += wait_ms
+        self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+        for i, bound in enumerate(_POOL_WAIT_BUCKETS_MS):
+            if wait_ms <= bound:
+                self.wait_buckets[i] += 1
+                break
+        else:
+            self.wait_buckets[-1] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of pool gauges and acquire-wait histogram"""
+        bucket_labels = [f"le_{bound}ms" for bound in _POOL_WAIT_BUCKETS_MS] + ["inf"]
+        return {
+            "name": self.name,
+            "size": self._pool.get_size(),
+            "idle": self._pool.get_idle_size(),
+            "min_size": self._pool.get_min_size(),
+            "max_size": self._pool.get_max_size(),
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "acquire_count": self.acquire_count,
+            "acquire_timeouts": self.acquire_timeouts,
+            "wait_avg_ms": round(self.wait_total_ms / self.acquire_count, 3) if self.acquire_count else 0.0,
+            "wait_max_ms": round(self.wait_max_ms, 3),
+            "wait_buckets": dict(zip(bucket_labels, self.wait_buckets)),
+        }
+
+    def __getattr__(self, name):
+        # 其余接口（close / execute / fetch / get_size ...）直接透传给底层连接池
+        return getattr(self._pool, name)
+
+
+class _InstrumentedAcquire:
+    """Acquire context returned by InstrumentedPool.acquire()"""
+
+    def __init__(self, pool: InstrumentedPool, timeout: Optional[float]):
+        self._pool = pool
+        self._timeout = timeout
+        self._connection = None
+
+    async def _acquire(self):
+        start = time.perf_counter()
+        try:
+            connection = await self._pool._pool.acquire(timeout=self._timeout)
+        except asyncio.TimeoutError:
+            self._pool.acquire_timeouts += 1
+            logger.warning(f"Timed out acquiring connection from pool {self._pool.name} "
+                           f"(in use: {self._pool.in_use}, max: {self._pool._pool.get_max_size()})")
+            raise
+        self._pool._record_acquire((time.perf_counter() - start) * 1000)
+        return connection
+
+    async def __aenter__(self):
+        self._connection = await self._acquire()
+        return self._connection
+
+    async def __aexit__(self, *exc):
+        connection, self._connection = self._connection, None
+        await self._pool.release(connection)
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+
 class DBConnection:
     """Thread-safe singleton database connection manager using PostgreSQL"""
     
@@ -34,12 +265,28 @@ class DBConnection:
                     cls._instance = super().__new__(cls)
                     cls._instance._initialized = False
                     cls._instance._pool = None
+                    cls._instance._read_pool = None
+                    cls._instance._role = "api"
         return cls._instance
 
     def __init__(self):
         """Initialization method, actual initialization is not performed here"""
         pass
 
+    def set_role(self, role: str):
+        """Select pool sizing for this process ("api" or "worker"); call before initialize()"""
+        if role not in ("api", "worker"):
+            raise ValueError(f"Unknown database pool role: {role}")
+        if self._initialized and role != self._role:
+            logger.warning(f"DBConnection already initialized as {self._role}, ignoring role {role}")
+            return
+        self._role = role
+
+    def _pool_size(self):
+        if self._role == "worker":
+            return config.POSTGRES_WORKER_POOL_MIN_SIZE, config.POSTGRES_WORKER_POOL_MAX_SIZE
+        return config.POSTGRES_API_POOL_MIN_SIZE, config.POSTGRES_API_POOL_MAX_SIZE
+
     async def initialize(self):
         """Initialize database connection pool"""
         if self._initialized:
@@ -59,16 +306,38 @@ class DBConnection:
                 logger.error("Missing PostgreSQL DATABASE_URL environment variable")
                 raise RuntimeError("PostgreSQL DATABASE_URL environment variable must be set.")
             
+            min_size, max_size = self._pool_size()
+            acquire_timeout = config.POSTGRES_POOL_ACQUIRE_TIMEOUT or None
+
             # Create PostgreSQL connection pool
-            self._pool = await asyncpg.create_pool(
+            pool = await asyncpg.create_pool(
                 database_url,
-                min_size=1, # Minimum number of connections
-                max_size=10, # Maximum number of connections
-                command_timeout=60 # Command timeout
+                min_size=min_size, # Minimum number of connections
+                max_size=max_size, # Maximum number of connections
+                command_timeout=config.POSTGRES_COMMAND_TIMEOUT, # Command timeout
+                statement_cache_size=config.POSTGRES_STATEMENT_CACHE_SIZE # Per-connection prepared statement LRU
             )
+            self._pool = InstrumentedPool(pool, f"{self._role}-primary", acquire_timeout)
+
+            # Optional read replica for select() queries
+            if config.DATABASE_REPLICA_URL:
+                try:
+                    replica_pool = await asyncpg.create_pool(
+                        config.DATABASE_REPLICA_URL,
+                        min_size=min_size,
+                        max_size=config.POSTGRES_REPLICA_POOL_MAX_SIZE,
+                        command_timeout=config.POSTGRES_COMMAND_TIMEOUT,
+                        statement_cache_size=config.POSTGRES_STATEMENT_CACHE_SIZE
+                    )
+                    self._read_pool = InstrumentedPool(replica_pool, f"{self._role}-replica", acquire_timeout)
+                except Exception as e:
+                    # 副本不可用时退化为只使用主库
+                    logger.warning(f"PostgreSQL replica pool initialization failed, reading from primary: {e}")
+                    self._read_pool = None
             
             self._initialized = True
-            logger.info("PostgreSQL connection pool initialized successfully")
+            logger.info(f"PostgreSQL connection pool initialized successfully "
+                        f"(role={self._role}, min={min_size}, max={max_size}, replica={self._read_pool is not None})")
             
         except Exception as e:
             logger.error(f"PostgreSQL connection pool initialization error: {e}")
@@ -79,49 +348,103 @@ class DBConnection:
         """Get database client from connection pool"""
         if not self._initialized:
             await self.initialize()
-        return PostgreSQLClient(self._pool)
+        return PostgreSQLClient(self._pool, self._read_pool)
+
+    def pool_metrics(self) -> List[Dict[str, Any]]:
+        """Metrics for every pool owned by this process"""
+        return [pool.metrics() for pool in (self._pool, self._read_pool) if pool is not None]
 
     @classmethod
     async def disconnect(cls):
         """Disconnect database connection"""
         if cls._instance and cls._instance._pool:
             await cls._instance._pool.close()
+            if cls._instance._read_pool:
+                await cls._instance._read_pool.close()
             cls._instance._pool = None
+            cls._instance._read_pool = None
             cls._instance._initialized = False
             logger.info("PostgreSQL connection pool closed")
 
+
+def get_pool_metrics() -> List[Dict[str, Any]]:
+    """Export pool gauges for the process-wide DBConnection"""
+    if DBConnection._instance is None:
+        return []
+    return DBConnection._instance.pool_metrics()
+
 class PostgreSQLClient:
     """PostgreSQL client wrapper providing database operation interfaces"""
     
-    def __init__(self, pool: asyncpg.Pool):
+    def __init__(self, pool: asyncpg.Pool, read_pool: Optional[asyncpg.Pool] = None):
         self.pool = pool
+        self.read_pool = read_pool
     
     def table(self, table_name: str):
         """Create table query builder"""
-        return PostgreSQLTable(self.pool, table_name)
+        return PostgreSQLTable(self.pool, table_name, self.read_pool)
     
     def schema(self, schema_name: str):
         """Create schema query builder (for Supabase schema compatibility)"""
-        return PostgreSQLSchema(self.pool, schema_name)
+        return PostgreSQLSchema(self.pool, schema_name, self.read_pool)
+
+    async def fetch(self, table_name: str, query: str, *params) -> List[Dict[str, Any]]:
+        """Run a hand-written read query the builder cannot express (joins, row comparisons)
+
+        与 select() 一样默认走只读副本、记录查询指标；table_name 只用于指标归类。
+        """
+        pool = self.pool if self.read_pool is None or _read_primary.get() else self.read_pool
+        async with pool.acquire() as conn:
+            rows = await _timed_fetch(conn, table_name, query, list(params))
+        return [dict(row) for row in rows]
 
 class PostgreSQLSchema:
     """Schema query builder for supporting schema functionality"""
     
-    def __init__(self, pool: asyncpg.Pool, schema_name: str):
+    def __init__(self, pool: asyncpg.Pool, schema_name: str, read_pool: Optional[asyncpg.Pool] = None):
         self.pool = pool
+        self.read_pool = read_pool
         self.schema_name = schema_name
     
     def table(self, table_name: str):
         """Create table query builder in specified schema"""
         full_table_name = f"{self.schema_name}.{table_name}"
-        return PostgreSQLTable(self.pool, full_table_name)
+        return PostgreSQLTable(self.pool, full_table_name, self.read_pool)
+
+
+# asyncpg 单条语句最多 32767 个参数，批量插入按此拆分
+_MAX_QUERY_PARAMS = 32767
+
+
+def _build_insert_query(table_name: str, columns: List[str], records: List[Dict[str, Any]], returning: str = "*"):
+    """Build one multi-row INSERT; records missing a column insert NULL for it"""
+    values_placeholders = []
+    all_values = []
+    for record in records:
+        record_placeholders = []
+        for column in columns:
+            value = record.get(column)
+            # 没有注册 JSON codec，dict 按 JSON 文本传给 json/jsonb 列
+            if isinstance(value, dict):
+                value = json.dumps(value)
+            all_values.append(value)
+            record_placeholders.append(f"${len(all_values)}")
+        values_placeholders.append(f"({', '.join(record_placeholders)})")
+
+    query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES {', '.join(values_placeholders)}"
+    if returning:
+        query += f" RETURNING {returning}"
+    return query, all_values
+
 
 class PostgreSQLTable:
     """PostgreSQL table query builder providing database operation interfaces"""
     
-    def __init__(self, pool: asyncpg.Pool, table_name: str):
+    def __init__(self, pool: asyncpg.Pool, table_name: str, read_pool: Optional[asyncpg.Pool] = None):
         self.pool = pool
+        self.read_pool = read_pool
         self.table_name = table_name
+        self._use_primary = False
         self._select_fields = "*"
         self._where_conditions = []
         self._order_by = []
@@ -201,20 +524,39 @@ class PostgreSQLTable:
             self._where_conditions.append(f"{column} LIKE ${len(self._params) + 1}")
             self._params.append(f"%{value}%")
         return self
-    
+
+    def overlaps(self, column: str, values: List[Any]):
+        """Add array overlap condition: column && $n (any element in common, GIN-indexable)"""
+        self._params.append(list(values))
+        self._where_conditions.append(f"{column} && ${len(self._params)}")
+        return self
+
+    def after(self, columns: List[str], values: List[Any]):
+        """Add keyset (row value) condition: (col1, col2, ...) > (val1, val2, ...)
+
+        用于替代 OFFSET 分页：配合相同列的 ORDER BY，可以直接命中复合索引定位下一页。
+        """
+        placeholders = []
+        for value in values:
+            self._params.append(value)
+            placeholders.append(f"${len(self._params)}")
+
+        self._where_conditions.append(f"({', '.join(columns)}) > ({', '.join(placeholders)})")
+        return self
+
     def in_(self, column: str, values: List[Any]):
-        """Add IN condition"""
+        """Add IN condition
+
+        使用 = ANY($n) 并把整个列表作为一个数组参数，保证 SQL 文本与列表长度无关，
+        这样同一调用点可以复用同一条预编译语句。
+        """
         if not values:
             # If list is empty, add a condition that is always false
             self._where_conditions.append("1 = 0")
             return self
         
-        placeholders = []
-        for value in values:
-            self._params.append(value)
-            placeholders.append(f"${len(self._params)}")
-        
-        self._where_conditions.append(f"{column} IN ({', '.join(placeholders)})")
+        self._params.append(list(values))
+        self._where_conditions.append(f"{column} = ANY(${len(self._params)})")
         return self
     
     def is_(self, column: str, value: Any):
@@ -283,6 +625,16 @@ class PostgreSQLTable:
         self._limit_value = count
         return self
     
+    def primary(self):
+        """Read from the primary even when a replica is configured"""
+        self._use_primary = True
+        return self
+    
+    def _select_pool(self):
+        if self.read_pool is None or self._use_primary or _read_primary.get():
+            return self.pool
+        return self.read_pool
+    
     def single(self):
         """Mark query should return single result"""
         self._single_result = True
@@ -295,19 +647,15 @@ class PostgreSQLTable:
         self._limit_value = 1
         return self
     
-    async def execute(self):
-        """Execute query"""
-        # Build SELECT query
-        query_parts = [f"SELECT {self._select_fields}"]
-        
-        # If count is needed, build count query
-        count_query = None
-        if self._count_flag:
-            count_query = f"SELECT COUNT(*) FROM {self.table_name}"
-            if self._where_conditions:
-                count_query += f" WHERE {' AND '.join(self._where_conditions)}"
-        
-        query_parts.append(f"FROM {self.table_name}")
+    def _build_select_query(self, with_count: bool):
+        """Build the normalized SELECT text and its parameter list"""
+        params = list(self._params)
+
+        select_fields = self._select_fields
+        if with_count:
+            select_fields = f"{select_fields}, COUNT(*) OVER() AS {_TOTAL_COUNT_COLUMN}"
+
+        query_parts = [f"SELECT {select_fields}", f"FROM {self.table_name}"]
         
         # Add WHERE clause
         if self._where_conditions:
@@ -317,25 +665,41 @@ class PostgreSQLTable:
         if self._order_by:
             query_parts.append(f"ORDER BY {', '.join(self._order_by)}")
         
-        # Add LIMIT and OFFSET
+        # Add LIMIT and OFFSET (参数化，避免每个分页值都生成新的查询形状)
         if self._limit_value:
-            query_parts.append(f"LIMIT {self._limit_value}")
+            params.append(self._limit_value)
+            query_parts.append(f"LIMIT ${len(params)}")
         if self._offset_value:
-            query_parts.append(f"OFFSET {self._offset_value}")
+            params.append(self._offset_value)
+            query_parts.append(f"OFFSET ${len(params)}")
         
-        query = " ".join(query_parts)
+        return " ".join(query_parts), params
+
+    async def execute(self):
+        """Execute query"""
+        query, params = self._build_select_query(with_count=self._count_flag)
         
         try:
-            async with self.pool.acquire() as conn:
-                # Execute main query
-                rows = await conn.fetch(query, *self._params)
+            async with self._select_pool().acquire() as conn:
+                # Execute main query (count is folded in via window function)
+                rows = await _timed_fetch(conn, self.table_name, query, params)
                 data = [dict(row) for row in rows]
                 
-                # If count is needed, execute count query
                 count = None
                 if self._count_flag:
-                    count_result = await conn.fetchval(count_query, *self._params)
-                    count = int(count_result) if count_result else 0
+                    if data:
+                        count = int(data[0][_TOTAL_COUNT_COLUMN])
+                        for row in data:
+                            row.pop(_TOTAL_COUNT_COLUMN, None)
+                    elif self._offset_value:
+                        # 页越界时窗口函数拿不到总数，退回单独的 COUNT 查询
+                        count_query = f"SELECT COUNT(*) FROM {self.table_name}"
+                        if self._where_conditions:
+                            count_query += f" WHERE {' AND '.join(self._where_conditions)}"
+                        count_rows = await _timed_fetch(conn, self.table_name, count_query, self._params)
+                        count = int(count_rows[0][0]) if count_rows else 0
+                    else:
+                        count = 0
                 
                 # Handle single and maybe_single cases
                 if self._single_result:
@@ -366,34 +730,47 @@ class PostgreSQLTable:
             
             # Get all field names
             columns = list(data[0].keys())
-            
-            # Build insert query
-            values_placeholders = []
-            all_values = []
-            
-            for i, record in enumerate(data):
-                record_placeholders = []
-                for j, column in enumerate(columns):
-                    placeholder_index = i * len(columns) + j + 1
-                    record_placeholders.append(f"${placeholder_index}")
-                    all_values.append(record[column])
-                values_placeholders.append(f"({', '.join(record_placeholders)})")
-            
-            query = f"""
-            INSERT INTO {self.table_name} ({', '.join(columns)})
-            VALUES {', '.join(values_placeholders)}
-            RETURNING *
-            """
+            query, all_values = _build_insert_query(self.table_name, columns, data)
             
             async with self.pool.acquire() as conn:
-                rows = await conn.fetch(query, *all_values)
+                rows = await _timed_fetch(conn, self.table_name, query, all_values)
                 result_data = [dict(row) for row in rows]
+                mark_read_your_writes()
                 return QueryResult(result_data)
                 
         except Exception as e:
             logger.error(f"Insert operation failed: {e}")
             raise RuntimeError(f"Database insert failed: {str(e)}")
     
+    async def insert_many(self, records: List[Dict[str, Any]], batch_size: int = 500, returning: str = "*"):
+        """Insert many rows with batched multi-row INSERTs in one transaction.
+
+        列取所有记录键的并集（缺失的列插入 NULL，而不是列默认值）；每批行数同时受
+        batch_size 和参数上限约束。N 行只需要 ceil(N / batch_size) 次往返。
+        """
+        if not records:
+            return QueryResult([])
+        
+        columns = list(dict.fromkeys(column for record in records for column in record))
+        rows_per_batch = max(1, min(batch_size, _MAX_QUERY_PARAMS // len(columns)))
+        result_data = []
+        
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    for start in range(0, len(records), rows_per_batch):
+                        query, values = _build_insert_query(
+                            self.table_name, columns, records[start:start + rows_per_batch], returning
+                        )
+                        rows = await _timed_fetch(conn, self.table_name, query, values)
+                        result_data.extend(dict(row) for row in rows)
+            mark_read_your_writes()
+            return QueryResult(result_data)
+                
+        except Exception as e:
+            logger.error(f"Bulk insert into {self.table_name} failed: {e}")
+            raise RuntimeError(f"Database bulk insert failed: {str(e)}")
+    
     async def update(self, data: Dict[str, Any]):
         """Update data in table"""
         try:
@@ -414,8 +791,9 @@ class PostgreSQLTable:
             query = " ".join(query_parts)
             
             async with self.pool.acquire() as conn:
-                rows = await conn.fetch(query, *(self._params + values))
+                rows = await _timed_fetch(conn, self.table_name, query, self._params + values)
                 result_data = [dict(row) for row in rows]
+                mark_read_your_writes()
                 
                 # Handle single result case
                 if self._single_result or self._maybe_single:
@@ -441,8 +819,9 @@ class PostgreSQLTable:
             query = " ".join(query_parts)
             
             async with self.pool.acquire() as conn:
-                rows = await conn.fetch(query, *self._params)
+                rows = await _timed_fetch(conn, self.table_name, query, self._params)
                 result_data = [dict(row) for row in rows]
+                mark_read_your_writes()
                 return QueryResult(result_data)
                 
         except Exception as e:
@@ -16,6 +16,10 @@ Redis connection service - asyncio version
     2. lrange(response_list_key, last_index, -1)  ← 获取新数据
     3. 立即返回给前端渲染
 
+AGENT_RESPONSE_TRANSPORT=stream 时改用 Redis Streams:
+    生产者: xadd(response_stream_key, {"data": response})   ← 存储 + 唤醒一次完成
+    消费者: xread({response_stream_key: last_id}, block=...) ← 按 entry ID 续读，断线后可从确切 ID 恢复
+
 await redis.rpush("my_list", "item1")
 await redis.rpush("my_list", "item2") 
 await redis.rpush("my_list", "item3")
@@ -30,7 +34,7 @@ import os
 from dotenv import load_dotenv # type: ignore
 import asyncio
 from utils.logger import logger
-from typing import List, Any
+from typing import List, Any, Dict, Optional
 from utils.retry import retry
 
 # Redis客户端和连接池全局变量
@@ -249,3 +253,43 @@ async def expire(key: str, seconds: int):
     """
     redis_client = await get_client()
     return await redis_client.expire(key, seconds)
+
+async def xadd(key: str, fields: Dict[str, Any], maxlen: Optional[int] = None):
+    """Append an entry to a Redis Stream
+
+    Args:
+        key: stream key name
+        fields: entry field/value pairs
+        maxlen: approximate maximum stream length, optional
+
+    Returns:
+        ID of the added entry (e.g. "1718000000000-0")
+    """
+    redis_client = await get_client()
+    return await redis_client.xadd(key, fields, maxlen=maxlen, approximate=True)
+
+async def xread(streams: Dict[str, str], count: Optional[int] = None, block: Optional[int] = None):
+    """Read entries newer than the given IDs from one or more Redis Streams
+
+    Args:
+        streams: mapping of stream key -> last seen ID ("0-0" to read from the beginning)
+        count: maximum number of entries per stream, optional
+        block: milliseconds to block waiting for new entries, optional
+
+    Returns:
+        [[key, [(entry_id, fields), ...]], ...], empty list on block timeout
+    """
+    redis_client = await get_client()
+    return await redis_client.xread(streams, count=count, block=block)
+
+async def pipeline(transaction: bool = True):
+    """Create a Redis pipeline, commands are buffered locally and sent in one round trip on execute()
+
+    Args:
+        transaction: wrap the buffered commands in MULTI/EXEC, default True
+
+    Returns:
+        Redis pipeline object
+    """
+    redis_client = await get_client()
+    return redis_client.pipeline(transaction=transaction)
@@ -0,0 +1,57 @@
+BEGIN;
+
+-- Chunked knowledge base content used for query-time retrieval
+CREATE TABLE IF NOT EXISTS agent_knowledge_base_chunks (
+    chunk_id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    entry_id UUID NOT NULL REFERENCES agent_knowledge_base_entries(entry_id) ON DELETE CASCADE,
+    agent_id UUID NOT NULL REFERENCES agents(agent_id) ON DELETE CASCADE,
+
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    token_count INTEGER NOT NULL,
+    embedding REAL[], -- Optional, only filled when KB_EMBEDDING_MODEL is configured
+
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+
+    CONSTRAINT agent_kb_chunks_entry_chunk_unique UNIQUE (entry_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_agent_kb_chunks_agent_id ON agent_knowledge_base_chunks(agent_id);
+CREATE INDEX IF NOT EXISTS idx_agent_kb_chunks_entry_id ON agent_knowledge_base_chunks(entry_id);
+
+ALTER TABLE agent_knowledge_base_chunks ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY agent_kb_chunks_user_access ON agent_knowledge_base_chunks
+    FOR ALL
+    USING (
+        EXISTS (
+            SELECT 1 FROM agents a
+            WHERE a.agent_id = agent_knowledge_base_chunks.agent_id
+            AND basejump.has_role_on_account(a.account_id) = true
+        )
+    );
+
+COMMENT ON TABLE agent_knowledge_base_chunks IS 'Retrieval chunks of agent knowledge base entries; rebuilt whenever the entry is updated';
+
+-- updated_at of the entry version the current chunks were built from; entries that produce
+-- no chunks are marked too, so they are not reindexed on every query
+ALTER TABLE agent_knowledge_base_entries ADD COLUMN IF NOT EXISTS chunked_at TIMESTAMPTZ;
+
+COMMENT ON COLUMN agent_knowledge_base_entries.chunked_at IS 'updated_at of the entry version the retrieval chunks were built from';
+
+-- Marking an entry as chunked is not an edit of the entry
+CREATE OR REPLACE FUNCTION update_agent_kb_entry_timestamp()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.chunked_at IS DISTINCT FROM OLD.chunked_at THEN
+        RETURN NEW;
+    END IF;
+    NEW.updated_at = NOW();
+    IF NEW.content != OLD.content THEN
+        NEW.content_tokens = LENGTH(NEW.content) / 4;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,33 @@
+"""
+Cache 本地层测试：调用方修改取回的对象不能影响后续读取（不需要 Redis）。
+
+运行: python -m pytest tests/test_cache.py
+"""
+
+import asyncio
+import json
+
+from utils.cache import _MISSING, _cache
+
+
+def test_mutating_a_local_hit_does_not_change_the_cached_value():
+    cache = _cache()
+    cache._local_set("agent:1", json.dumps({"name": "a", "tools": ["x"]}), ttl=60)
+
+    async def read_and_mutate():
+        first = await cache.get("agent:1")
+        first["name"] = "changed"
+        first["tools"].append("y")
+        first["extra"] = True
+        return first, await cache.get("agent:1")
+
+    first, second = asyncio.run(read_and_mutate())
+    assert second == {"name": "a", "tools": ["x"]}
+    assert first is not second
+
+
+def test_expired_local_entry_is_a_miss():
+    cache = _cache()
+    cache._local["agent:1"] = (0.0, json.dumps({"name": "a"}))
+    assert cache._local_get("agent:1") is _MISSING
+    assert "agent:1" not in cache._local
@@ -0,0 +1,162 @@
+"""
+ToolScheduler 调度顺序测试：共享并发、同一资源互斥且按调用顺序、SERIAL 屏障、终止工具、并发上限和超时。
+
+运行: python -m pytest tests/test_tool_scheduler.py
+"""
+
+import asyncio
+
+from agentpress.tool import ToolConcurrency, ToolResult, ToolSchedulingSpec
+from agentpress.tool_scheduler import ToolScheduler
+
+SHARED = ToolConcurrency.SHARED
+EXCLUSIVE = ToolConcurrency.EXCLUSIVE
+SERIAL = ToolConcurrency.SERIAL
+
+
+class SpecRegistry:
+    """Only what ToolScheduler needs from ToolRegistry: function name -> scheduling spec."""
+
+    def __init__(self, specs):
+        self.specs = specs
+
+    def get_scheduling_spec(self, function_name):
+        return self.specs.get(function_name) or ToolSchedulingSpec(EXCLUSIVE, function_name)
+
+
+class Recorder:
+    """Fake tool executor that records start/end order and peak concurrency."""
+
+    def __init__(self, delays=None, failures=()):
+        self.delays = delays or {}
+        self.failures = set(failures)
+        self.events = []
+        self.active = 0
+        self.peak = 0
+
+    async def execute(self, tool_call):
+        call_id = tool_call['id']
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.events.append(('start', call_id))
+        try:
+            await asyncio.sleep(self.delays.get(call_id, 0.01))
+            if call_id in self.failures:
+                raise RuntimeError(f"{call_id} failed")
+            return ToolResult(success=True, output=call_id)
+        finally:
+            self.active -= 1
+            self.events.append(('end', call_id))
+
+    def position(self, kind, call_id):
+        return self.events.index((kind, call_id))
+
+
+def call(call_id, function_name):
+    return {'id': call_id, 'function_name': function_name, 'arguments': {}}
+
+
+def run_batch(specs, tool_calls, recorder, **kwargs):
+    scheduler = ToolScheduler(SpecRegistry(specs), recorder.execute, **kwargs)
+
+    async def collect():
+        return [item async for item in scheduler.run(tool_calls)]
+
+    return asyncio.run(collect())
+
+
+def test_shared_calls_run_concurrently():
+    recorder = Recorder(delays={'a': 0.05, 'b': 0.05, 'c': 0.05})
+    specs = {'search': ToolSchedulingSpec(SHARED, 'search')}
+    results = run_batch(specs, [call('a', 'search'), call('b', 'search'), call('c', 'search')], recorder)
+    assert recorder.peak == 3
+    assert sorted(index for index, _, _ in results) == [0, 1, 2]
+
+
+def test_exclusive_calls_on_one_resource_run_one_at_a_time_in_call_order():
+    # 先到的调用更慢：如果没有互斥锁，b/c 会先于 a 结束
+    recorder = Recorder(delays={'a': 0.05, 'b': 0.02, 'c': 0.01})
+    specs = {'edit': ToolSchedulingSpec(EXCLUSIVE, 'workspace')}
+    run_batch(specs, [call('a', 'edit'), call('b', 'edit'), call('c', 'edit')], recorder)
+    assert recorder.peak == 1
+    assert recorder.events == [
+        ('start', 'a'), ('end', 'a'),
+        ('start', 'b'), ('end', 'b'),
+        ('start', 'c'), ('end', 'c'),
+    ]
+
+
+def test_exclusive_calls_on_different_resources_overlap():
+    recorder = Recorder(delays={'a': 0.05, 'b': 0.05})
+    specs = {
+        'edit': ToolSchedulingSpec(EXCLUSIVE, 'workspace'),
+        'browse': ToolSchedulingSpec(EXCLUSIVE, 'browser'),
+    }
+    run_batch(specs, [call('a', 'edit'), call('b', 'browse')], recorder)
+    assert recorder.peak == 2
+
+
+def test_serial_call_is_a_barrier():
+    recorder = Recorder(delays={'a': 0.05, 'b': 0.01, 's': 0.02, 'c': 0.01, 'd': 0.01})
+    specs = {
+        'search': ToolSchedulingSpec(SHARED, 'search'),
+        'shell': ToolSchedulingSpec(SERIAL, 'shell'),
+    }
+    tool_calls = [call('a', 'search'), call('b', 'search'), call('s', 'shell'), call('c', 'search'), call('d', 'search')]
+    run_batch(specs, tool_calls, recorder)
+
+    # 屏障在之前的调用全部结束后才开始，之后的调用在屏障结束后才开始
+    assert recorder.position('start', 's') > recorder.position('end', 'a')
+    assert recorder.position('start', 's') > recorder.position('end', 'b')
+    assert recorder.position('start', 'c') > recorder.position('end', 's')
+    assert recorder.position('start', 'd') > recorder.position('end', 's')
+    # 屏障之后的共享调用之间仍然并发
+    assert recorder.position('start', 'd') < recorder.position('end', 'c')
+
+
+def test_consecutive_serial_calls_keep_call_order():
+    recorder = Recorder(delays={'s1': 0.03, 's2': 0.01})
+    specs = {'shell': ToolSchedulingSpec(SERIAL, 'shell')}
+    run_batch(specs, [call('s1', 'shell'), call('s2', 'shell')], recorder)
+    assert recorder.events == [('start', 's1'), ('end', 's1'), ('start', 's2'), ('end', 's2')]
+
+
+def test_terminating_tool_waits_for_earlier_calls_and_skips_later_ones():
+    recorder = Recorder(delays={'a': 0.03})
+    specs = {
+        'search': ToolSchedulingSpec(SHARED, 'search'),
+        'complete': ToolSchedulingSpec(SHARED, 'complete'),
+    }
+    results = run_batch(specs, [call('a', 'search'), call('done', 'complete'), call('late', 'search')], recorder)
+
+    assert [tool_call['id'] for _, tool_call, _ in results] == ['a', 'done']
+    assert ('start', 'late') not in recorder.events
+    assert recorder.position('start', 'done') > recorder.position('end', 'a')
+
+
+def test_global_concurrency_cap():
+    recorder = Recorder(delays={str(i): 0.02 for i in range(6)})
+    specs = {'search': ToolSchedulingSpec(SHARED, 'search')}
+    run_batch(specs, [call(str(i), 'search') for i in range(6)], recorder, max_parallel=2)
+    assert recorder.peak == 2
+
+
+def test_results_are_yielded_in_completion_order():
+    recorder = Recorder(delays={'slow': 0.06, 'fast': 0.01})
+    specs = {'search': ToolSchedulingSpec(SHARED, 'search')}
+    results = run_batch(specs, [call('slow', 'search'), call('fast', 'search')], recorder)
+    assert [(index, tool_call['id']) for index, tool_call, _ in results] == [(1, 'fast'), (0, 'slow')]
+
+
+def test_timeout_and_errors_become_failed_results():
+    recorder = Recorder(delays={'hang': 1.0}, failures={'boom'})
+    specs = {
+        'wait': ToolSchedulingSpec(SHARED, 'wait', timeout=0.05),
+        'search': ToolSchedulingSpec(SHARED, 'search'),
+    }
+    results = run_batch(specs, [call('hang', 'wait'), call('boom', 'search'), call('ok', 'search')], recorder)
+    by_id = {tool_call['id']: result for _, tool_call, result in results}
+
+    assert not by_id['hang'].success and 'timed out' in by_id['hang'].output
+    assert not by_id['boom'].success and 'boom failed' in by_id['boom'].output
+    assert by_id['ok'].success
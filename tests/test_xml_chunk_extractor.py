@@ -0,0 +1,118 @@
+"""
+StreamingXMLChunkExtractor 的增量解析测试
+
+把同一段响应按不同方式切分成 delta 逐个 feed，结果必须和一次性 feed 完整内容相同，
+尤其是起始/结束标签被切断在两个 delta 之间的情况。
+
+运行: python -m pytest tests/test_xml_chunk_extractor.py
+"""
+
+import pytest
+
+from agentpress.xml_tool_parser import StreamingXMLChunkExtractor
+
+FUNCTION_CALLS_BLOCK = (
+    '<function_calls>\n'
+    '<invoke name="create_file">\n'
+    '<parameter name="file_path">a.txt</parameter>\n'
+    '<parameter name="file_contents">hello</parameter>\n'
+    '</invoke>\n'
+    '</function_calls>'
+)
+
+LEGACY_BLOCK = '<create-file file_path="a.txt">\n<create-file>nested</create-file>\nhello\n</create-file>'
+
+
+def feed_all(extractor, deltas):
+    chunks = []
+    for delta in deltas:
+        chunks.extend(extractor.feed(delta))
+    return chunks
+
+
+def split_every(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_single_delta_returns_block():
+    content = f"Let me create it.\n{FUNCTION_CALLS_BLOCK}\nDone."
+    assert StreamingXMLChunkExtractor().feed(content) == [FUNCTION_CALLS_BLOCK]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16, 17])
+def test_function_calls_split_into_small_deltas(size):
+    content = f"Before {FUNCTION_CALLS_BLOCK} between {FUNCTION_CALLS_BLOCK} after"
+    chunks = feed_all(StreamingXMLChunkExtractor(), split_every(content, size))
+    assert chunks == [FUNCTION_CALLS_BLOCK, FUNCTION_CALLS_BLOCK]
+
+
+@pytest.mark.parametrize("cut", range(1, len('<function_calls>')))
+def test_start_tag_cut_at_every_position(cut):
+    content = "text " + FUNCTION_CALLS_BLOCK
+    boundary = len("text ") + cut
+    chunks = feed_all(StreamingXMLChunkExtractor(), [content[:boundary], content[boundary:]])
+    assert chunks == [FUNCTION_CALLS_BLOCK]
+
+
+@pytest.mark.parametrize("cut", range(1, len('</function_calls>')))
+def test_end_tag_cut_at_every_position(cut):
+    boundary = len(FUNCTION_CALLS_BLOCK) - len('</function_calls>') + cut
+    extractor = StreamingXMLChunkExtractor()
+    assert extractor.feed(FUNCTION_CALLS_BLOCK[:boundary]) == []
+    assert extractor.feed(FUNCTION_CALLS_BLOCK[boundary:]) == [FUNCTION_CALLS_BLOCK]
+
+
+def test_block_is_returned_by_the_delta_that_closes_it():
+    extractor = StreamingXMLChunkExtractor()
+    assert extractor.feed(FUNCTION_CALLS_BLOCK[:-1]) == []
+    assert extractor.feed(FUNCTION_CALLS_BLOCK[-1:] + " trailing text") == [FUNCTION_CALLS_BLOCK]
+    assert extractor.feed(" more text") == []
+
+
+def test_unterminated_block_is_not_returned():
+    extractor = StreamingXMLChunkExtractor()
+    assert feed_all(extractor, split_every(FUNCTION_CALLS_BLOCK[:-5], 4)) == []
+
+
+def test_plain_text_is_not_buffered_indefinitely():
+    extractor = StreamingXMLChunkExtractor()
+    for _ in range(1000):
+        extractor.feed("no tool calls in this sentence. ")
+    assert len(extractor._buffer) <= extractor._start_holdback
+
+
+def test_empty_delta_is_ignored():
+    extractor = StreamingXMLChunkExtractor()
+    assert extractor.feed("") == []
+    assert extractor.feed(FUNCTION_CALLS_BLOCK) == [FUNCTION_CALLS_BLOCK]
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 13])
+def test_legacy_tags_are_nesting_aware_across_deltas(size):
+    extractor = StreamingXMLChunkExtractor(["create-file", "str-replace"], function_calls=False)
+    content = f"intro {LEGACY_BLOCK} outro <str-replace>x</str-replace>"
+    chunks = feed_all(extractor, split_every(content, size))
+    assert chunks == [LEGACY_BLOCK, "<str-replace>x</str-replace>"]
+
+
+def test_legacy_tag_prefix_of_another_tag_does_not_match():
+    extractor = StreamingXMLChunkExtractor(["create-file"], function_calls=False)
+    assert feed_all(extractor, ["<create-files>", "x</create-files>"]) == []
+
+
+def test_legacy_closing_tag_cut_between_deltas():
+    extractor = StreamingXMLChunkExtractor(["create-file"], function_calls=False)
+    assert extractor.feed(LEGACY_BLOCK[:-6]) == []
+    assert extractor.feed(LEGACY_BLOCK[-6:]) == [LEGACY_BLOCK]
+
+
+def test_split_feeds_match_single_feed_for_mixed_content():
+    content = (
+        "a <function_calls>one</function_calls> b "
+        "<create-file p='1'>two</create-file> c "
+        "<function_calls><invoke name='x'></invoke></function_calls>"
+    )
+    expected = StreamingXMLChunkExtractor(["create-file"]).feed(content)
+    assert len(expected) == 3
+    for size in range(1, 12):
+        assert feed_all(StreamingXMLChunkExtractor(["create-file"]), split_every(content, size)) == expected
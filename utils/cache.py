@@ -1,26 +1,236 @@
+"""
+Two-tier cache: in-process LRU/TTL in front of Redis.
+
+读取顺序：本地 LRU -> Redis -> (get_or_compute) 计算函数。
+    - 本地条目的 TTL 取 min(调用方 ttl, CACHE_LOCAL_TTL)，即使失效通知丢失，不一致窗口也有上限。
+    - 本地层保存序列化后的 JSON 文本，每次读取都重新解码：调用方修改拿到的 dict/list 不会影响其他读取者。
+    - set / invalidate 会在 cache:invalidate 频道广播键名，其他进程收到后丢弃本地条目。
+    - get_or_compute 对同一个键的并发未命中只执行一次计算（single-flight），其余调用方等待同一结果。
+    - 按键前缀（第一个冒号之前的部分）统计命中、未命中与延迟，通过 Cache.stats() 导出。
+"""
+
+import asyncio
 import json
-from typing import Any
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from services import redis
 from services.redis import get_client
+from utils.config import config
+from utils.logger import logger
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+INVALIDATION_READ_TIMEOUT = 5.0
+
+_MISSING = object()
+
+
+def _key_prefix(key: str) -> str:
+    return key.split(":", 1)[0]
 
 
 class _cache:
+    def __init__(self):
+        self._node_id = uuid.uuid4().hex[:12]
+        self._local: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+        self._listener_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ---- 本地 LRU ----
+
+    def _local_get(self, key: str) -> Any:
+        entry = self._local.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._local.pop(key, None)
+            return _MISSING
+        self._local.move_to_end(key)
+        return json.loads(value)
+
+    def _local_set(self, key: str, value: str, ttl: int):
+        """value 是 JSON 文本"""
+        local_ttl = min(ttl, config.CACHE_LOCAL_TTL)
+        if local_ttl <= 0 or config.CACHE_LOCAL_MAXSIZE <= 0:
+            return
+        self._ensure_listener()
+        self._local[key] = (time.monotonic() + local_ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > config.CACHE_LOCAL_MAXSIZE:
+            self._local.popitem(last=False)
+
+    # ---- 跨进程失效 ----
+
+    def _ensure_listener(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._listener_task is None or self._listener_task.done() or self._listener_loop is not loop:
+            self._listener_loop = loop
+            self._listener_task = loop.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = await redis.create_pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=INVALIDATION_READ_TIMEOUT)
+                    if message:
+                        self._handle_invalidation(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 订阅断开期间可能漏掉失效通知，清空本地层保证一致性
+                logger.warning(f"Cache invalidation listener failed, reconnecting: {e}")
+                self._local.clear()
+                await asyncio.sleep(1)
+            finally:
+                if pubsub:
+                    try:
+                        await pubsub.unsubscribe()
+                        await pubsub.close()
+                    except Exception as e:
+                        logger.debug(f"Error closing cache invalidation pubsub: {e}")
+
+    def _handle_invalidation(self, message: Dict[str, Any]):
+        data = message.get("data")
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        try:
+            payload = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        if payload.get("node") == self._node_id:
+            return
+        self._local.pop(payload.get("key"), None)
+
+    async def _broadcast_invalidation(self, key: str):
+        try:
+            await redis.publish(INVALIDATION_CHANNEL, json.dumps({"node": self._node_id, "key": key}))
+        except Exception as e:
+            logger.warning(f"Failed to publish cache invalidation for {key}: {e}")
+
+    # ---- 统计 ----
+
+    def _record(self, key: str, event: str, elapsed_ms: Optional[float] = None):
+        stats = self._stats.get(_key_prefix(key))
+        if stats is None:
+            stats = self._stats[_key_prefix(key)] = {
+                "local_hits": 0, "redis_hits": 0, "misses": 0,
+                "computes": 0, "compute_errors": 0, "coalesced": 0,
+                "redis_ms_total": 0.0, "redis_ms_max": 0.0,
+                "compute_ms_total": 0.0, "compute_ms_max": 0.0,
+            }
+        stats[event] += 1
+        if elapsed_ms is not None:
+            kind = "compute" if event in ("computes", "compute_errors") else "redis"
+            stats[f"{kind}_ms_total"] += elapsed_ms
+            stats[f"{kind}_ms_max"] = max(stats[f"{kind}_ms_max"], elapsed_ms)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Hit/miss/latency counters per key prefix"""
+        result = {}
+        for prefix, stats in self._stats.items():
+            snapshot = dict(stats)
+            redis_calls = stats["redis_hits"] + stats["misses"]
+            compute_calls = stats["computes"] + stats["compute_errors"]
+            lookups = stats["local_hits"] + redis_calls
+            snapshot["hit_ratio"] = round((stats["local_hits"] + stats["redis_hits"]) / lookups, 4) if lookups else 0.0
+            snapshot["redis_ms_avg"] = round(stats["redis_ms_total"] / redis_calls, 3) if redis_calls else 0.0
+            snapshot["compute_ms_avg"] = round(stats["compute_ms_total"] / compute_calls, 3) if compute_calls else 0.0
+            result[prefix] = snapshot
+        return result
+
+    # ---- 对外接口 ----
+
+    async def _get_entry(self, key: str) -> Any:
+        value = self._local_get(key)
+        if value is not _MISSING:
+            self._record(key, "local_hits")
+            return value
+
+        start = time.perf_counter()
+        redis_client = await get_client()
+        # 值和剩余 TTL 在一次往返中取回，本地条目不会比 Redis 中的活得更久
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(f"cache:{key}")
+        pipe.ttl(f"cache:{key}")
+        result, ttl = await pipe.execute()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if result is None:
+            self._record(key, "misses", elapsed_ms)
+            return _MISSING
+
+        self._record(key, "redis_hits", elapsed_ms)
+        if ttl and ttl > 0:
+            self._local_set(key, result, ttl)
+        return json.loads(result)
+
     async def get(self, key: str):
-        redis = await get_client()
-        key = f"cache:{key}"
-        result = await redis.get(key)
-        if result:
-            return json.loads(result)
-        return None
+        value = await self._get_entry(key)
+        return None if value is _MISSING else value
 
     async def set(self, key: str, value: Any, ttl: int = 15 * 60):
-        redis = await get_client()
-        key = f"cache:{key}"
-        await redis.set(key, json.dumps(value), ex=ttl)
+        await self._set_serialized(key, json.dumps(value), ttl)
+
+    async def _set_serialized(self, key: str, serialized: str, ttl: int):
+        redis_client = await get_client()
+        await redis_client.set(f"cache:{key}", serialized, ex=ttl)
+        self._local_set(key, serialized, ttl)
+        await self._broadcast_invalidation(key)
 
     async def invalidate(self, key: str):
-        redis = await get_client()
-        key = f"cache:{key}"
-        await redis.delete(key)
+        self._local.pop(key, None)
+        redis_client = await get_client()
+        await redis_client.delete(f"cache:{key}")
+        await self._broadcast_invalidation(key)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int = 15 * 60):
+        """Return the cached value, or run ``compute`` once for all concurrent misses of ``key``.
+
+        与 get 不同，缓存的 None / 0 等假值也视为命中。Redis 不可用时直接计算，不影响调用方。
+        """
+        try:
+            value = await self._get_entry(key)
+            if value is not _MISSING:
+                return value
+        except Exception as e:
+            logger.warning(f"Cache lookup failed for {key}, computing directly: {e}")
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute_and_store(key, compute, ttl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._record(key, "coalesced")
+        # shield：某个等待者被取消不会中断其他等待者共享的计算
+        # 共享的是 JSON 文本，每个等待者各自解码出独立的对象
+        return json.loads(await asyncio.shield(task))
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: int) -> str:
+        start = time.perf_counter()
+        try:
+            value = await compute()
+        except Exception:
+            self._record(key, "compute_errors", (time.perf_counter() - start) * 1000)
+            raise
+        self._record(key, "computes", (time.perf_counter() - start) * 1000)
+        serialized = json.dumps(value)
+        try:
+            await self._set_serialized(key, serialized, ttl)
+        except Exception as e:
+            logger.warning(f"Failed to store computed cache value for {key}: {e}")
+            self._local_set(key, serialized, ttl)
+        return serialized
 
 
 Cache = _cache()
@@ -237,6 +237,69 @@ class Configuration:
     REDIS_PORT: int = 6379
     REDIS_PASSWORD: Optional[str] = None
     REDIS_SSL: bool = False
+    # Agent 响应传输方式："list"（RPUSH + PUBLISH + LRANGE）或 "stream"（XADD + XREAD BLOCK，支持按 ID 断点续传）
+    AGENT_RESPONSE_TRANSPORT: str = "list"
+
+    # utils.cache 本地缓存层：最多缓存的条目数，以及本地条目的最长存活秒数（0 表示关闭本地层）
+    CACHE_LOCAL_MAXSIZE: int = 2048
+    CACHE_LOCAL_TTL: int = 30
+
+    # services.llm 中 ADK Agent/Runner 缓存的最大条目数（按模型配置、工具集、instruction 区分）
+    ADK_RUNTIME_CACHE_SIZE: int = 32
+
+    # 摘要检查点式上下文压缩：会话事件超过 token 预算时，把尾部之外的历史总结成 events 表中的检查点事件
+    CONTEXT_COMPACTION_ENABLED: bool = False
+    CONTEXT_COMPACTION_TOKEN_BUDGET: int = 60000
+    CONTEXT_COMPACTION_TAIL_EVENTS: int = 20  # 保留原文的最近事件数（会向前对齐到用户消息）
+    CONTEXT_COMPACTION_MODEL: Optional[str] = None  # 生成摘要用的模型，默认与当前对话模型相同
+    CONTEXT_COMPACTION_SUMMARY_MAX_TOKENS: int = 2000
+
+    # 知识库检索：配置后 chunk 写入时计算 embedding，检索时与 BM25 结果融合（为空则只用词法检索）
+    KB_EMBEDDING_MODEL: Optional[str] = None
+
+    # 浏览器截图进入模型上下文前的处理：最长边像素（0 表示不缩放）与 JPEG 质量
+    BROWSER_SCREENSHOT_MAX_DIMENSION: int = 1280
+    BROWSER_SCREENSHOT_JPEG_QUALITY: int = 70
+    # 截图与上一轮已发送的相同时只发送一句说明。临时消息不写入线程历史，
+    # 仅在模型会话保留上一轮临时消息时（如 ADK 会话事件）才应开启
+    BROWSER_SCREENSHOT_SKIP_UNCHANGED: bool = False
+
+    # 浏览器工具截图存储（utils/screenshot_store.py）
+    SCREENSHOT_FORMAT: str = "webp"  # webp | jpeg | png
+    SCREENSHOT_QUALITY: int = 80
+    SCREENSHOT_MAX_DIMENSION: int = 0  # 最长边像素，0 表示保持原尺寸
+    SCREENSHOT_LOCAL_DIR: str = "screenshots"
+    SCREENSHOT_PUBLIC_BASE_URL: str = "http://localhost:8000"
+    SCREENSHOT_RETENTION_HOURS: int = 72  # 0 表示不按时间清理
+    SCREENSHOT_LOCAL_MAX_FILES: int = 5000  # 0 表示不限
+    SCREENSHOT_CLEANUP_INTERVAL: int = 600
+
+    # MCP 客户端会话池（mcp_module/session_pool.py）
+    MCP_SESSION_MAX_CONCURRENCY: int = 4  # 单个服务器会话上的最大并发请求数
+    MCP_SESSION_CONNECT_TIMEOUT: int = 15
+    MCP_SESSION_HEALTH_CHECK_INTERVAL: int = 60  # 空闲超过该秒数的会话复用前先 ping，0 表示不检查
+    MCP_SESSION_IDLE_TTL: int = 300
+
+    # MCP 服务器发现（agent/tools/mcp_tool_wrapper.py）
+    MCP_DISCOVERY_DEADLINE_MS: int = 3000  # 启动时等待 MCP 服务器的总时长，未及时响应的服务器在后台完成后再注册；0 表示一直等待
+    MCP_SCHEMA_CACHE_TTL: int = 3600  # 缓存的工具定义在此时间内视为新鲜
+    MCP_SCHEMA_CACHE_MAX_STALE: int = 86400  # 过期后仍先使用旧定义、同时后台刷新的最长时间
+
+    # PostgreSQL 连接池配置（api 为 FastAPI 进程，worker 为 Dramatiq 进程，各自独立的连接池）
+    DATABASE_REPLICA_URL: Optional[str] = None  # 只读副本，配置后 select() 查询默认走副本
+    POSTGRES_COMMAND_TIMEOUT: int = 60
+    POSTGRES_API_POOL_MIN_SIZE: int = 1
+    POSTGRES_API_POOL_MAX_SIZE: int = 10
+    POSTGRES_WORKER_POOL_MIN_SIZE: int = 1
+    POSTGRES_WORKER_POOL_MAX_SIZE: int = 10
+    POSTGRES_REPLICA_POOL_MAX_SIZE: int = 10
+    POSTGRES_POOL_ACQUIRE_TIMEOUT: int = 0  # 获取连接的超时秒数，0 表示一直等待
+
+    # PostgreSQL 查询配置
+    # 每个连接上 asyncpg 预编译语句 LRU 的容量（按 SQL 文本缓存，0 表示关闭）
+    POSTGRES_STATEMENT_CACHE_SIZE: int = 256
+    # 超过该耗时（毫秒）的查询会以 warning 级别记录
+    POSTGRES_SLOW_QUERY_MS: int = 500
     
     # PPIP/E2B 沙箱配置
     E2B_API_KEY: Optional[str] = None
@@ -0,0 +1,218 @@
+"""
+Screenshot sink for browser tools.
+
+截图流水线：
+    原始 PNG -> 内容哈希（去重） -> 线程池中缩放并编码为 WebP/JPEG -> 存储后端 -> 可访问 URL
+
+- 文件名由原始字节的 SHA-256 决定，同一画面重复截图只会编码、写入一次，并返回同一个 URL；
+- 截图写入 SCREENSHOT_LOCAL_DIR，由 /api/screenshots 提供访问；ScreenshotStore 只依赖后端的
+  url_for / exists / save / cleanup，需要对象存储时可以按同样的接口增加后端；
+- 写入后按 SCREENSHOT_RETENTION_HOURS / SCREENSHOT_LOCAL_MAX_FILES 在后台清理旧截图，
+  两次清理之间至少间隔 SCREENSHOT_CLEANUP_INTERVAL 秒。
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from utils.config import config
+from utils.logger import logger
+
+# 进程内记住最近的哈希 -> 截图信息，命中时跳过编码，只刷新文件的修改时间
+_RECENT_SCREENSHOTS_SIZE = 256
+
+_CONTENT_TYPES = {
+    "webp": ("image/webp", "webp"),
+    "jpeg": ("image/jpeg", "jpg"),
+    "jpg": ("image/jpeg", "jpg"),
+    "png": ("image/png", "png"),
+}
+
+MEDIA_TYPES_BY_SUFFIX = {
+    ".webp": "image/webp",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+}
+
+
+def _output_format() -> Tuple[str, str, str]:
+    fmt = (config.SCREENSHOT_FORMAT or "webp").lower()
+    if fmt not in _CONTENT_TYPES:
+        logger.warning(f"Unsupported SCREENSHOT_FORMAT {fmt}, falling back to webp")
+        fmt = "webp"
+    content_type, ext = _CONTENT_TYPES[fmt]
+    return ("jpeg" if fmt == "jpg" else fmt), content_type, ext
+
+
+def encode_screenshot(png_bytes: bytes, fmt: str, quality: int, max_dimension: int) -> bytes:
+    """Downscale and re-encode one screenshot. CPU-bound, call via asyncio.to_thread."""
+    from PIL import Image
+
+    if fmt == "png" and max_dimension <= 0:
+        return png_bytes
+
+    image = Image.open(io.BytesIO(png_bytes))
+    if max_dimension > 0:
+        image.thumbnail((max_dimension, max_dimension))
+    if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    if fmt == "png":
+        image.save(output, format="PNG", optimize=True)
+    else:
+        image.save(output, format=fmt.upper(), quality=quality)
+    return output.getvalue()
+
+
+class LocalScreenshotBackend:
+    """Writes screenshots into a local directory served by GET /api/screenshots/{filename}."""
+
+    def __init__(self, directory: str, public_base_url: str):
+        self.directory = directory
+        self.public_base_url = public_base_url.rstrip("/")
+
+    def url_for(self, filename: str) -> str:
+        return f"{self.public_base_url}/api/screenshots/{filename}"
+
+    async def exists(self, filename: str) -> bool:
+        return await asyncio.to_thread(self._touch, os.path.join(self.directory, filename))
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        # 重复出现的画面刷新修改时间，避免仍在使用的截图被保留期清理掉
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def save(self, filename: str, data: bytes, content_type: str) -> str:
+        await asyncio.to_thread(self._write, filename, data)
+        return self.url_for(filename)
+
+    def _write(self, filename: str, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        # 先写临时文件再原子替换，避免并发读取到半个文件
+        tmp_path = os.path.join(self.directory, f".{filename}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.directory, filename))
+
+    async def cleanup(self, retention_seconds: int, max_files: int) -> int:
+        return await asyncio.to_thread(self._cleanup, retention_seconds, max_files)
+
+    def _cleanup(self, retention_seconds: int, max_files: int) -> int:
+        if not os.path.isdir(self.directory):
+            return 0
+
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith("."):
+                    entries.append((entry.stat().st_mtime, entry.path))
+        entries.sort()
+
+        cutoff = time.time() - retention_seconds if retention_seconds > 0 else None
+        excess = len(entries) - max_files if max_files > 0 else 0
+        removed = 0
+        for index, (mtime, path) in enumerate(entries):
+            if index >= excess and (cutoff is None or mtime >= cutoff):
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+class ScreenshotStore:
+    def __init__(self, backend):
+        self.backend = backend
+        self._recent: "OrderedDict[str, Dict[str, object]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._last_cleanup = 0.0
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    async def save(self, png_bytes: bytes, description: str) -> dict:
+        """Store one screenshot and return the info dict used in browser tool results."""
+        digest = hashlib.sha256(png_bytes).hexdigest()[:32]
+        fmt, content_type, ext = _output_format()
+        filename = f"{digest}.{ext}"
+
+        info = self._recent.get(filename)
+        if info is not None and not await self.backend.exists(filename):
+            # exists() 同时刷新修改时间，复用中的截图不会被按 mtime 清理；文件已被清理时重新写入
+            self._recent.pop(filename, None)
+            info = None
+        if info is None:
+            # 同一画面的并发保存共享一次编码和写入
+            pending = self._pending.get(filename)
+            if pending is None:
+                pending = asyncio.ensure_future(self._store(filename, png_bytes, fmt, content_type))
+                self._pending[filename] = pending
+                pending.add_done_callback(lambda _: self._pending.pop(filename, None))
+            info = await asyncio.shield(pending)
+        else:
+            self._recent.move_to_end(filename)
+
+        self._schedule_cleanup()
+        return {**info, "description": description}
+
+    async def _store(self, filename: str, png_bytes: bytes, fmt: str, content_type: str) -> Dict[str, object]:
+        url = self.backend.url_for(filename)
+        if url and await self.backend.exists(filename):
+            logger.debug(f"Screenshot {filename} already stored, reusing")
+            size = None
+        else:
+            data = await asyncio.to_thread(
+                encode_screenshot, png_bytes, fmt, config.SCREENSHOT_QUALITY, config.SCREENSHOT_MAX_DIMENSION
+            )
+            url = await self.backend.save(filename, data, content_type)
+            size = len(data)
+            logger.debug(f"Screenshot {filename} stored ({len(png_bytes)} -> {size} bytes)")
+
+        info = {"url": url, "filename": filename, "size": size, "content_type": content_type}
+        self._recent[filename] = info
+        while len(self._recent) > _RECENT_SCREENSHOTS_SIZE:
+            self._recent.popitem(last=False)
+        return info
+
+    def _schedule_cleanup(self):
+        now = time.monotonic()
+        if now - self._last_cleanup < config.SCREENSHOT_CLEANUP_INTERVAL:
+            return
+        if self._cleanup_task is not None and not self._cleanup_task.done():
+            return
+        self._last_cleanup = now
+        self._cleanup_task = asyncio.create_task(self._cleanup())
+
+    async def _cleanup(self):
+        try:
+            removed = await self.backend.cleanup(
+                config.SCREENSHOT_RETENTION_HOURS * 3600, config.SCREENSHOT_LOCAL_MAX_FILES
+            )
+            if removed:
+                # 被清理的截图可能还在最近列表里，整体清空让下次保存重新写入
+                self._recent.clear()
+                logger.info(f"Removed {removed} expired screenshots")
+        except Exception as e:
+            logger.warning(f"Screenshot cleanup failed: {e}")
+
+
+_store: Optional[ScreenshotStore] = None
+
+
+def get_screenshot_store() -> ScreenshotStore:
+    global _store
+    if _store is None:
+        _store = ScreenshotStore(
+            LocalScreenshotBackend(config.SCREENSHOT_LOCAL_DIR, config.SCREENSHOT_PUBLIC_BASE_URL)
+        )
+    return _store
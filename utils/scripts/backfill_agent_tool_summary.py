@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+AGENT TOOL SUMMARY BACKFILL
+
+Recomputes the tool summary columns on agents (has_mcp_tools, has_agentpress_tools,
+tool_names, tools_count) from the config of each agent's current version. Run once
+after deploying the columns; agents whose current version predates them keep the
+column defaults until then. Safe to re-run.
+
+Usage:
+    python backfill_agent_tool_summary.py                     # Backfill all agents
+    python backfill_agent_tool_summary.py --batch-size 1000   # Custom batch size (default 500)
+    python backfill_agent_tool_summary.py --dry-run           # Only count the agents that would change
+"""
+
+import asyncio
+import argparse
+import sys
+import json
+from pathlib import Path
+
+backend_dir = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from agent.versioning.version_service import summarize_version_config
+from services.postgresql import DBConnection, mark_read_your_writes
+from utils.logger import logger
+
+SUMMARY_COLUMNS = ('has_mcp_tools', 'has_agentpress_tools', 'tool_names', 'tools_count')
+
+
+async def backfill(batch_size: int, dry_run: bool) -> dict:
+    client = await DBConnection().client
+    summary = {'scanned': 0, 'updated': 0}
+    last_agent_id = None
+
+    while True:
+        async with client.pool.acquire() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT a.agent_id, a.has_mcp_tools, a.has_agentpress_tools, a.tool_names, a.tools_count, v.config
+                FROM agents a
+                JOIN agent_versions v ON v.version_id = a.current_version_id
+                WHERE ($1::varchar IS NULL OR a.agent_id > $1)
+                ORDER BY a.agent_id
+                LIMIT $2
+                """,
+                last_agent_id, batch_size
+            )
+            if not rows:
+                break
+            last_agent_id = rows[-1]['agent_id']
+            summary['scanned'] += len(rows)
+
+            changed = []
+            for row in rows:
+                tool_summary = summarize_version_config(row['config'])
+                current = {column: row[column] for column in SUMMARY_COLUMNS}
+                current['tool_names'] = list(current['tool_names'] or [])
+                if current != tool_summary:
+                    changed.append((row['agent_id'], tool_summary))
+            summary['updated'] += len(changed)
+
+            if changed and not dry_run:
+                await conn.executemany(
+                    """
+                    UPDATE agents
+                    SET has_mcp_tools = $2, has_agentpress_tools = $3, tool_names = $4, tools_count = $5
+                    WHERE agent_id = $1
+                    """,
+                    [
+                        (agent_id, s['has_mcp_tools'], s['has_agentpress_tools'], s['tool_names'], s['tools_count'])
+                        for agent_id, s in changed
+                    ]
+                )
+                mark_read_your_writes()
+        logger.info(f"Agent tool summary backfill: scanned {summary['scanned']}, updated {summary['updated']}")
+
+    return summary
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill the tool summary columns on agents")
+    parser.add_argument("--batch-size", type=int, default=500, help="Agents per batch (default 500)")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the agents that would change")
+    args = parser.parse_args()
+
+    db = DBConnection()
+    await db.initialize()
+
+    try:
+        summary = await backfill(args.batch_size, args.dry_run)
+        print(json.dumps({**summary, 'dry_run': args.dry_run}, indent=2))
+    except Exception as e:
+        logger.error(f"Agent tool summary backfill failed: {e}", exc_info=True)
+        sys.exit(1)
+    finally:
+        await DBConnection.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+USAGE LEDGER RECONCILE
+
+Rebuilds usage_monthly_ledger rows from the messages table. Run once after
+deploying the ledger to backfill the current month, and periodically (e.g. daily)
+to correct any drift from failed incremental updates.
+
+Usage:
+    python reconcile_usage_ledger.py                          # Reconcile the current month for all accounts
+    python reconcile_usage_ledger.py --month 2025-09          # Reconcile a specific month
+    python reconcile_usage_ledger.py --account <account_id>   # Reconcile specific accounts (repeatable)
+"""
+
+import asyncio
+import argparse
+import sys
+import json
+from datetime import date, datetime
+from pathlib import Path
+
+backend_dir = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(backend_dir))
+
+from services.billing import reconcile_usage_ledger
+from services.postgresql import DBConnection
+from services import redis
+from utils.logger import logger
+
+
+def parse_month(value: str) -> date:
+    parsed = datetime.strptime(value, "%Y-%m")
+    return date(parsed.year, parsed.month, 1)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill / reconcile the monthly usage ledger")
+    parser.add_argument("--month", type=parse_month, default=None, help="Month to reconcile (YYYY-MM), defaults to current month")
+    parser.add_argument("--account", action="append", dest="accounts", default=None, help="Account ID to reconcile (repeatable)")
+    args = parser.parse_args()
+
+    db = DBConnection()
+    await db.initialize()
+    await redis.initialize_async()
+
+    try:
+        summary = await reconcile_usage_ledger(month=args.month, account_ids=args.accounts)
+        print(json.dumps(summary, indent=2, default=str))
+    except Exception as e:
+        logger.error(f"Usage ledger reconcile failed: {e}", exc_info=True)
+        sys.exit(1)
+    finally:
+        await redis.close()
+        await DBConnection.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())